@@ -0,0 +1,46 @@
+# Data access for the employees and admins tables on the auth paths.
+#
+# Each statement selects only the column it needs, returns plain tuples and
+# starts with a /* q:<name> */ tag, which the query metrics (and MySQL's
+# statement digests) group by. The SQL strings are built once here. PyMySQL
+# only speaks the text protocol, so there are no server-side prepared
+# statements; a fixed statement text is the reusable part.
+# Every function takes a tuple cursor (pymysql.cursors.Cursor).
+
+# table -> password hash column
+PASSWORD_COLUMNS = {"employees": "passwd", "admins": "password"}
+
+PASSWORD_HASH_SQL = {
+    table: f"SELECT /* q:{table}.password_hash */ {column} FROM {table} WHERE username = %s LIMIT 1"
+    for table, column in PASSWORD_COLUMNS.items()
+}
+
+# Only overwrites the hash that was verified, so a concurrent password
+# change wins
+REHASH_SQL = {
+    table: f"UPDATE /* q:{table}.rehash */ {table} SET {column} = %s WHERE username = %s AND {column} = %s"
+    for table, column in PASSWORD_COLUMNS.items()
+}
+
+DELETE_SQL = {
+    table: f"DELETE /* q:{table}.delete */ FROM {table} WHERE username = %s"
+    for table in PASSWORD_COLUMNS
+}
+
+
+# Stored password hash for a username, or None if there is no such account
+def password_hash(cursor, table, username):
+    cursor.execute(PASSWORD_HASH_SQL[table], (username,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def replace_password_hash(cursor, table, username, old_hash, new_hash):
+    cursor.execute(REHASH_SQL[table], (new_hash, username, old_hash))
+    return cursor.rowcount > 0
+
+
+# Delete an account in one statement; False if there was none
+def delete_account(cursor, table, username):
+    cursor.execute(DELETE_SQL[table], (username,))
+    return cursor.rowcount > 0
@@ -0,0 +1,26 @@
+# gunicorn settings, picked up automatically from the working directory:
+#   gunicorn wakinjologin:wakinjologin
+# With GUNICORN_PRELOAD=1 the app is imported once in the master and the
+# workers fork from it, which saves each worker the import. The import runs
+# create_app(), which builds the connection pool, the hashing pool and the
+# username filters and queues their background tasks, but opens no
+# connection, starts no hashing worker or thread: the pools connect and
+# spawn on first use, which is after the fork, and post_fork starts the
+# background tasks in each worker. So preloading is safe.
+# A worker's /readyz answers 503 until its warm-up below has finished.
+import os
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', 10000)}")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+preload_app = os.getenv("GUNICORN_PRELOAD") == "1"
+
+
+def post_fork(server, worker):
+    import wakinjologin
+
+    wakinjologin.start_background_tasks()
+    # Open the pool and start the hashing workers before taking traffic
+    if wakinjologin.PREWARM:
+        wakinjologin.warm_up()
+        server.log.info("Worker %s warmed up: %s", worker.pid, wakinjologin.startup_stats())
@@ -0,0 +1,415 @@
+# Inventory movement ledger and the daily snapshots derived from it.
+#
+# Every change to items.quantity appends a row to inventory_movements in the
+# same transaction (delta, resulting quantity and the price at the time).
+# refresh_snapshots() folds every movement not yet folded into per-item and
+# per-company daily totals, so stock-at-date, turnover and valuation read a
+# handful of precomputed rows instead of scanning the history. Movements are
+# marked as folded one by one, not by an id watermark: AUTO_INCREMENT ids
+# are taken before their transaction commits, so a slow transaction can
+# make a lower id visible after higher ones have been folded.
+#
+# company_inventory holds live per-company totals (items, units, value),
+# adjusted in the same transaction as every registration and movement.
+import datetime
+import unicodedata
+from decimal import Decimal
+
+# Row in snapshot_watermarks: locked by a refresh so only one runs at a
+# time, and holding the id up to which every visible movement is folded
+WATERMARK = "inventory_daily"
+
+MOVEMENT_COLUMNS = "item_id, company_name, delta, quantity_after, price_per_item, reason"
+
+
+# Append movements for /update_inventory lines. movements are
+# (item id, delta, quantity after) and rows the locked item rows by key.
+def record_movements(cursor, movements, rows):
+    if movements:
+        cursor.executemany(*movement_inserts(movements, rows))
+
+
+# The (sql, params list) for executemany() that record_movements() runs
+def movement_inserts(movements, rows):
+    by_id = {row['id']: row for row in rows.values()}
+    return (
+        f"INSERT INTO inventory_movements ({MOVEMENT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s)",
+        [
+            (item_id, by_id[item_id]['company_name'], delta, quantity_after,
+             by_id[item_id]['price_per_item'], 'add' if delta > 0 else 'subtract')
+            for item_id, delta, quantity_after in movements
+        ]
+    )
+
+
+# The (sql, params) appending the movement for a registration of quantity
+# units of an item, run right after the INSERT (or upsert) into items
+def registration_movement(item_name, company_name, quantity):
+    return (
+        f"INSERT INTO inventory_movements ({MOVEMENT_COLUMNS}) "
+        f"SELECT id, company_name, %s, quantity, price_per_item, 'register' FROM items "
+        f"WHERE item_name = %s AND company_name = %s",
+        (quantity, item_name, company_name)
+    )
+
+
+# Same for a chunk of newly inserted items: params are the
+# (item_name, quantity, company_name, price_per_item) rows just inserted
+def bulk_registration_movements(params):
+    placeholders = ", ".join(["(%s, %s)"] * len(params))
+    return (
+        f"INSERT INTO inventory_movements ({MOVEMENT_COLUMNS}) "
+        f"SELECT id, company_name, quantity, quantity, price_per_item, 'register' FROM items "
+        f"WHERE (item_name, company_name) IN ({placeholders})",
+        [value for item_name, _, company_name, _ in params for value in (item_name, company_name)]
+    )
+
+
+# Migration step: existing stock becomes one opening movement per item, so
+# the snapshots start from the right levels. Does nothing once the ledger
+# has rows.
+def seed_opening_movements(cursor):
+    cursor.execute("SELECT 1 FROM inventory_movements LIMIT 1")
+    if cursor.fetchone() is None:
+        cursor.execute(
+            f"INSERT INTO inventory_movements ({MOVEMENT_COLUMNS}) "
+            f"SELECT id, company_name, quantity, quantity, price_per_item, 'opening' FROM items"
+        )
+
+
+def _watermark(cursor):
+    cursor.execute(
+        "INSERT IGNORE INTO snapshot_watermarks (name, last_movement_id) VALUES (%s, 0)", (WATERMARK,)
+    )
+    cursor.execute(
+        "SELECT last_movement_id FROM snapshot_watermarks WHERE name = %s FOR UPDATE", (WATERMARK,)
+    )
+    return cursor.fetchone()['last_movement_id']
+
+
+# Text folded the way MySQL 8's default collation, utf8mb4_0900_ai_ci,
+# compares it: case and accents ignored, trailing spaces significant (NO PAD)
+def collation_key(text):
+    decomposed = unicodedata.normalize('NFKD', str(text).casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+# Latest snapshot row per key, for the keys touched by a batch, optionally
+# only among the days before `before`
+def _latest(cursor, table, key_column, keys, before=None):
+    if not keys:
+        return {}
+    placeholders = ", ".join(["%s"] * len(keys))
+    condition, params = ("AND day < %s ", [before]) if before is not None else ("", [])
+    cursor.execute(
+        f"SELECT s.* FROM {table} s JOIN ("
+        f"SELECT {key_column}, MAX(day) AS day FROM {table} WHERE {key_column} IN ({placeholders}) "
+        f"{condition}GROUP BY {key_column}) latest USING ({key_column}, day)",
+        list(keys) + params
+    )
+    return {row[key_column]: row for row in cursor.fetchall()}
+
+
+# Fold one batch of movements (in id order) into the daily tables.
+#
+# Per item, ids are in commit order: every movement is written while its
+# item's row is locked, so a later movement of the same item can't have
+# been folded before an earlier one. Across items that doesn't hold, so a
+# company's days are not built forward from its latest row. Instead each
+# movement adds its change to its own day and to every later day already
+# recorded, which gives the same result in any order.
+def _apply_batch(cursor, movements):
+    item_ids = {movement['item_id'] for movement in movements}
+    item_state = {
+        item_id: (row['closing_quantity'], row['closing_value'])
+        for item_id, row in _latest(cursor, "inventory_item_daily", "item_id", item_ids).items()
+    }
+
+    item_days = {}  # (item id, day) -> [company, in, out, closing qty, closing value]
+    changes = {}  # (company key, day) -> [company, in, out, quantity change, value change]
+    for movement in movements:
+        day = movement['day']
+        item_id = movement['item_id']
+        company = movement['company_name']
+        delta = movement['delta']
+        value = Decimal(movement['quantity_after']) * movement['price_per_item']
+        previous_quantity, previous_value = item_state.get(item_id, (0, Decimal(0)))
+        item_state[item_id] = (movement['quantity_after'], value)
+
+        totals = item_days.get((item_id, day))
+        if totals is None:
+            totals = item_days[(item_id, day)] = [company, 0, 0, 0, Decimal(0)]
+        totals[1 if delta > 0 else 2] += abs(delta)
+        totals[3], totals[4] = movement['quantity_after'], value
+
+        change = changes.get((collation_key(company), day))
+        if change is None:
+            change = changes[(collation_key(company), day)] = [company, 0, 0, 0, Decimal(0)]
+        change[1 if delta > 0 else 2] += abs(delta)
+        change[3] += movement['quantity_after'] - previous_quantity
+        change[4] += value - previous_value
+
+    cursor.executemany(
+        "INSERT INTO inventory_item_daily "
+        "(item_id, day, company_name, quantity_in, quantity_out, closing_quantity, closing_value) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+        "quantity_in = quantity_in + VALUES(quantity_in), quantity_out = quantity_out + VALUES(quantity_out), "
+        "closing_quantity = VALUES(closing_quantity), closing_value = VALUES(closing_value)",
+        [(item_id, day, *totals) for (item_id, day), totals in item_days.items()]
+    )
+    cursor.executemany(
+        "INSERT INTO inventory_company_daily "
+        "(company_name, day, quantity_in, quantity_out, closing_quantity, closing_value) "
+        "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+        "quantity_in = VALUES(quantity_in), quantity_out = VALUES(quantity_out), "
+        "closing_quantity = VALUES(closing_quantity), closing_value = VALUES(closing_value)",
+        _company_days(cursor, changes)
+    )
+
+
+# Company day rows (company, day, in, out, closing qty, closing value)
+# with changes applied: every recorded day from the earliest changed one
+# on, plus a row for each changed day not recorded yet
+def _company_days(cursor, changes):
+    first_day = min(day for _, day in changes)
+    companies = {company for company, _, _, _, _ in changes.values()}
+    # Closing before the first changed day, and the days recorded since
+    before = {
+        collation_key(company): (row['closing_quantity'], row['closing_value'])
+        for company, row in _latest(cursor, "inventory_company_daily", "company_name", companies,
+                                    before=first_day).items()
+    }
+    placeholders = ", ".join(["%s"] * len(companies))
+    cursor.execute(
+        "SELECT company_name, day, quantity_in, quantity_out, closing_quantity, closing_value "
+        f"FROM inventory_company_daily WHERE company_name IN ({placeholders}) AND day >= %s",
+        list(companies) + [first_day]
+    )
+    recorded = {(collation_key(row['company_name']), row['day']): row for row in cursor.fetchall()}
+
+    rows = []
+    for company_key in sorted({key for key, _ in changes}):
+        # Closing as it stood before this batch, carried over days without a row
+        quantity, value = before.get(company_key, (0, Decimal(0)))
+        changed_quantity, changed_value = 0, Decimal(0)
+        days = sorted(day for key, day in recorded.keys() | changes.keys() if key == company_key)
+        for day in days:
+            company, quantity_in, quantity_out, quantity_change, value_change = changes.get(
+                (company_key, day), (None, 0, 0, 0, Decimal(0)))
+            changed_quantity += quantity_change
+            changed_value += value_change
+            row = recorded.get((company_key, day))
+            if row is not None:
+                company = row['company_name']
+                quantity_in += row['quantity_in']
+                quantity_out += row['quantity_out']
+                quantity, value = row['closing_quantity'], row['closing_value']
+            rows.append((company, day, quantity_in, quantity_out,
+                         quantity + changed_quantity, value + changed_value))
+    return rows
+
+
+# Fold every movement not folded yet into the daily snapshots, oldest id
+# first, batch by batch. Each batch is one transaction that also marks its
+# movements folded, under the watermark row's lock, so concurrent refreshes
+# never count a movement twice. Returns the number of movements applied.
+def refresh_snapshots(connection, batch_size=5000):
+    applied = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            _watermark(cursor)
+            cursor.execute(
+                "SELECT id, item_id, company_name, delta, quantity_after, price_per_item, "
+                "DATE(created_at) AS day FROM inventory_movements WHERE folded = 0 ORDER BY id LIMIT %s",
+                (batch_size,)
+            )
+            movements = cursor.fetchall()
+            if not movements:
+                connection.rollback()
+                return applied
+            _apply_batch(cursor, movements)
+            placeholders = ", ".join(["%s"] * len(movements))
+            cursor.execute(
+                f"UPDATE inventory_movements SET folded = 1 WHERE id IN ({placeholders})",
+                [movement['id'] for movement in movements]
+            )
+            # Reports quote this: every movement up to it is in the snapshots
+            cursor.execute(
+                "UPDATE snapshot_watermarks SET last_movement_id = COALESCE("
+                "(SELECT MIN(id) - 1 FROM inventory_movements WHERE folded = 0), "
+                "(SELECT MAX(id) FROM inventory_movements), 0) WHERE name = %s",
+                (WATERMARK,)
+            )
+            connection.commit()
+            applied += len(movements)
+            if len(movements) < batch_size:
+                return applied
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# Migration step: movements up to the old id watermark are already folded
+def mark_watermarked_movements_folded(cursor):
+    cursor.execute(
+        "UPDATE inventory_movements m JOIN snapshot_watermarks w ON w.name = %s "
+        "SET m.folded = 1 WHERE m.id <= w.last_movement_id AND m.folded = 0",
+        (WATERMARK,)
+    )
+
+
+def snapshot_watermark(cursor):
+    cursor.execute("SELECT last_movement_id FROM snapshot_watermarks WHERE name = %s", (WATERMARK,))
+    row = cursor.fetchone()
+    return row['last_movement_id'] if row else 0
+
+
+# Closing stock and value at the end of `day`, per company or for one
+# item (by id), from the latest snapshot on or before that day
+def stock_at(cursor, day, company_name=None, item_id=None):
+    if item_id is not None:
+        cursor.execute(
+            "SELECT item_id, company_name, day, closing_quantity, closing_value FROM inventory_item_daily "
+            "WHERE item_id = %s AND day <= %s ORDER BY day DESC LIMIT 1",
+            (item_id, day)
+        )
+        return cursor.fetchall()
+    condition, params = ("AND company_name = %s", [company_name]) if company_name else ("", [])
+    cursor.execute(
+        "SELECT s.company_name, s.day, s.closing_quantity, s.closing_value FROM inventory_company_daily s JOIN ("
+        "SELECT company_name, MAX(day) AS day FROM inventory_company_daily "
+        f"WHERE day <= %s {condition} GROUP BY company_name) latest USING (company_name, day) "
+        "ORDER BY s.company_name",
+        [day] + params
+    )
+    return cursor.fetchall()
+
+
+# Units in and out between two days (inclusive), per company or for one item
+def turnover(cursor, start, end, company_name=None, item_id=None):
+    if item_id is not None:
+        cursor.execute(
+            "SELECT item_id, COALESCE(SUM(quantity_in), 0) AS quantity_in, "
+            "COALESCE(SUM(quantity_out), 0) AS quantity_out FROM inventory_item_daily "
+            "WHERE item_id = %s AND day BETWEEN %s AND %s GROUP BY item_id",
+            (item_id, start, end)
+        )
+        return cursor.fetchall()
+    condition, params = ("AND company_name = %s", [company_name]) if company_name else ("", [])
+    cursor.execute(
+        "SELECT company_name, SUM(quantity_in) AS quantity_in, SUM(quantity_out) AS quantity_out "
+        f"FROM inventory_company_daily WHERE day BETWEEN %s AND %s {condition} "
+        "GROUP BY company_name ORDER BY company_name",
+        [start, end] + params
+    )
+    return cursor.fetchall()
+
+
+# JSON-friendly copy of a report row (DECIMAL and DATE values as strings)
+def report_row(row):
+    return {
+        key: str(value) if isinstance(value, Decimal)
+        else value.isoformat() if isinstance(value, datetime.date) else value
+        for key, value in row.items()
+    }
+
+
+# Live per-company totals. Every statement below adds deltas inside the
+# caller's transaction; rebuild_company_totals() recomputes from items.
+COMPANY_TOTALS_UPSERT = (
+    "ON DUPLICATE KEY UPDATE item_count = item_count + VALUES(item_count), "
+    "total_quantity = total_quantity + VALUES(total_quantity), "
+    "total_value = total_value + VALUES(total_value)"
+)
+
+
+# The (sql, params list) for executemany() adjusting company totals for
+# /update_inventory movements. Companies go in sorted order so concurrent
+# transactions lock their rows in the same order.
+def company_total_updates(movements, rows):
+    by_id = {row['id']: row for row in rows.values()}
+    totals = {}
+    for item_id, delta, _ in movements:
+        row = by_id[item_id]
+        key = collation_key(row['company_name'])
+        company_name, quantity, value = totals.get(key, (row['company_name'], 0, Decimal(0)))
+        totals[key] = (company_name, quantity + delta, value + delta * row['price_per_item'])
+    return (
+        "INSERT INTO company_inventory (company_name, item_count, total_quantity, total_value) "
+        "VALUES (%s, 0, %s, %s) " + COMPANY_TOTALS_UPSERT,
+        [totals[key] for key in sorted(totals)]
+    )
+
+
+def record_company_totals(cursor, movements, rows):
+    if movements:
+        cursor.executemany(*company_total_updates(movements, rows))
+
+
+# The (sql, params) adding a registration of quantity units to its
+# company's totals; new_item says whether the item itself is new
+def registration_company_total(item_name, company_name, quantity, new_item):
+    return (
+        "INSERT INTO company_inventory (company_name, item_count, total_quantity, total_value) "
+        "SELECT company_name, %s, %s, %s * price_per_item FROM items "
+        "WHERE item_name = %s AND company_name = %s " + COMPANY_TOTALS_UPSERT,
+        (1 if new_item else 0, quantity, quantity, item_name, company_name)
+    )
+
+
+# Same for a chunk of newly inserted (item_name, quantity, company_name,
+# price_per_item) rows
+def bulk_registration_company_totals(params):
+    placeholders = ", ".join(["(%s, %s)"] * len(params))
+    return (
+        "INSERT INTO company_inventory (company_name, item_count, total_quantity, total_value) "
+        "SELECT company_name, COUNT(*), SUM(quantity), SUM(quantity * price_per_item) FROM items "
+        f"WHERE (item_name, company_name) IN ({placeholders}) GROUP BY company_name " + COMPANY_TOTALS_UPSERT,
+        [value for item_name, _, company_name, _ in params for value in (item_name, company_name)]
+    )
+
+
+# Recompute every company's totals from items (migration backfill and the
+# rebuild-aggregates command). The caller commits.
+def rebuild_company_totals(cursor):
+    cursor.execute("DELETE FROM company_inventory")
+    cursor.execute(
+        "INSERT INTO company_inventory (company_name, item_count, total_quantity, total_value) "
+        "SELECT company_name, COUNT(*), SUM(quantity), SUM(quantity * price_per_item) FROM items "
+        "GROUP BY company_name"
+    )
+
+
+def company_value(cursor, company_name=None):
+    condition, params = ("WHERE company_name = %s", (company_name,)) if company_name else ("", ())
+    cursor.execute(
+        "SELECT company_name, item_count, total_quantity, total_value FROM company_inventory "
+        f"{condition} ORDER BY total_value DESC",
+        params
+    )
+    return cursor.fetchall()
+
+
+# Items below a quantity threshold, lowest stock first
+def low_stock(cursor, below, limit, company_name=None):
+    condition, params = ("company_name = %s AND ", [company_name]) if company_name else ("", [])
+    cursor.execute(
+        "SELECT id, item_name, company_name, quantity, price_per_item FROM items "
+        f"WHERE {condition}quantity < %s ORDER BY quantity, id LIMIT %s",
+        params + [below, limit]
+    )
+    return cursor.fetchall()
+
+
+# Items with the highest stock value (quantity * price_per_item)
+def top_items(cursor, limit, company_name=None):
+    condition, params = ("WHERE company_name = %s ", [company_name]) if company_name else ("", [])
+    cursor.execute(
+        "SELECT id, item_name, company_name, quantity, price_per_item, stock_value FROM items "
+        f"{condition}ORDER BY stock_value DESC LIMIT %s",
+        params + [limit]
+    )
+    return cursor.fetchall()
@@ -0,0 +1,398 @@
+# Load-testing harness for the wakinjologin API.
+#
+# Boots the app under gunicorn against a throwaway MySQL container (or uses
+# an existing database / running server), seeds employees and items through
+# the bulk endpoints, then drives each workload at a fixed concurrency and
+# prints machine-readable JSON: throughput, p50/p95/p99 latency, status
+# counts and DB queries per request (from the /metrics counters).
+#
+#   python loadtest.py --docker --out results.json
+#   python loadtest.py --db-host 127.0.0.1 --db-user root --db-password secret --db-name bench
+#   python loadtest.py --url http://127.0.0.1:5000 --compare results.json
+#
+# The app's SQL is MySQL-specific (FOR UPDATE, ON DUPLICATE KEY, row
+# constructors), so the stand-in database is a real MySQL/MariaDB server.
+import argparse
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pymysql
+import requests
+
+import migrations
+
+PASSWORD = "loadtest-pass"
+
+# Workload mixes: scenario -> {operation: weight}
+SCENARIOS = {
+    "login_storm": {"login": 1},
+    "register": {"register": 1},
+    "inventory": {"update_inventory": 1},
+    "catalogue": {"get_items": 1},
+    "mixed": {"login": 20, "get_items": 60, "update_inventory": 15, "register": 5},
+}
+
+
+def wait_until(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            sys.exit(f"Timed out waiting for {what}")
+        time.sleep(0.5)
+
+
+def mysql_ready(db):
+    pymysql.connect(**db).close()
+    return True
+
+
+# Start a disposable MySQL container; returns (container id, connect kwargs)
+def start_mysql_container(image, port):
+    db = {"host": "127.0.0.1", "port": port, "user": "root", "password": "loadtest", "database": "wakinjologin"}
+    container = subprocess.check_output([
+        "docker", "run", "-d", "--rm",
+        "-e", f"MYSQL_ROOT_PASSWORD={db['password']}",
+        "-e", f"MYSQL_DATABASE={db['database']}",
+        "-p", f"127.0.0.1:{port}:3306",
+        image,
+    ], text=True).strip()
+    wait_until(lambda: mysql_ready(db), 180, "MySQL to accept connections")
+    return container, db
+
+
+def migrate_database(db):
+    connection = pymysql.connect(**db, cursorclass=pymysql.cursors.DictCursor)
+    try:
+        migrations.migrate(connection, echo=lambda message: print(message, file=sys.stderr))
+    finally:
+        connection.close()
+
+
+# Run the app under gunicorn with limits relaxed so the limiter doesn't
+# turn a login storm into a stream of 429s
+def start_server(db, port, workers, threads, extra_env):
+    env = dict(os.environ)
+    env.update({
+        "host": db["host"],
+        "user": db["user"],
+        "password": db["password"],
+        "database": db["database"],
+        "DB_AUTO_MIGRATE": "0",
+        "METRICS_DIR": tempfile.mkdtemp(prefix="wakinjologin-metrics-"),
+        # Workers only flush after serving a request; flush on every one so
+        # the last requests of a run are counted in db_queries_per_request
+        "METRICS_FLUSH_INTERVAL": "0",
+        "SHARED_STATE_DIR": tempfile.mkdtemp(prefix="wakinjologin-state-"),
+        "LOGIN_LIMIT_PER_USER": "1000000",
+        "LOGIN_LIMIT_PER_IP": "1000000",
+    })
+    if db.get("port"):
+        env["port"] = str(db["port"])
+    env.update(extra_env)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+         "-b", f"127.0.0.1:{port}", "wakinjologin:wakinjologin"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_until(lambda: server.poll() is None and requests.get(url + "/readyz", timeout=2).ok, 60, "the app to be ready")
+    return server, url
+
+
+# Register the test data through the bulk endpoints; any rejected chunk
+# aborts the run, as the numbers would be meaningless against a partial set
+def seed(url, employees, items, companies, chunk=500):
+    session = requests.Session()
+
+    def post(path, payload):
+        response = session.post(url + path, json=payload, timeout=600)
+        if not 200 <= response.status_code < 300:
+            sys.exit(f"Seeding failed: {path} answered {response.status_code}: {response.text[:500]}")
+
+    for start in range(0, employees, chunk):
+        rows = [
+            {"worker_id": f"lt-{n}", "username": f"loadtest{n}", "phone_number": "0700000000", "passwd": PASSWORD}
+            for n in range(start, min(start + chunk, employees))
+        ]
+        post("/register_bulk", {"employees": rows})
+    for start in range(0, items, chunk):
+        rows = [
+            {"item_name": f"item{n}", "quantity": 1000000, "company_name": f"company{n % companies}",
+             "price_per_item": "9.99"}
+            for n in range(start, min(start + chunk, items))
+        ]
+        post("/item_register_bulk", {"items": rows})
+
+
+def login_token(url):
+    response = requests.post(url + "/login", data={"username": "loadtest0", "passwd": PASSWORD}, timeout=30)
+    return response.json().get("token") if response.ok else None
+
+
+# Sum of every sample of a counter in the /metrics text, or None if the
+# endpoint isn't there
+def scrape_counter(url, name):
+    try:
+        response = requests.get(url + "/metrics", timeout=10)
+    except requests.RequestException:
+        return None
+    if not response.ok:
+        return None
+    pattern = re.compile(r"^wakinjologin_" + re.escape(name) + r"(?:\{[^}]*\})? ([0-9.eE+-]+)$")
+    total = 0.0
+    for line in response.text.splitlines():
+        match = pattern.match(line)
+        if match:
+            total += float(match.group(1))
+    return total
+
+
+class Workload:
+    def __init__(self, url, args, token):
+        self.url = url
+        self.args = args
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._register_counter = iter(range(10 ** 12))
+        self._register_lock = threading.Lock()
+        self._run_id = f"{os.getpid()}-{int(time.time())}"
+
+    def login(self, session, rng):
+        username = f"loadtest{rng.randrange(self.args.employees)}"
+        return session.post(self.url + "/login", data={"username": username, "passwd": PASSWORD}, timeout=30)
+
+    def register(self, session, rng):
+        with self._register_lock:
+            n = next(self._register_counter)
+        username = f"lt-{self._run_id}-{n}"
+        return session.post(self.url + "/register", data={
+            "worker_id": username, "username": username, "phone_number": "0700000000",
+            "passwd": PASSWORD, "confirm_passwd": PASSWORD,
+        }, timeout=30)
+
+    def update_inventory(self, session, rng):
+        items = []
+        for n in rng.sample(range(self.args.items), min(self.args.batch, self.args.items)):
+            items.append({
+                "item_name": f"item{n}", "company_name": f"company{n % self.args.companies}",
+                "quantity": 1, "type": rng.choice(("add", "subtract")),
+            })
+        return session.post(self.url + "/update_inventory", json={"items": items}, headers=self.headers, timeout=30)
+
+    def get_items(self, session, rng):
+        params = {"company_name": f"company{rng.randrange(self.args.companies)}", "limit": self.args.page_size}
+        return session.get(self.url + "/get_items", params=params, timeout=30)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    # Nearest-rank percentile
+    index = min(len(ordered), max(1, math.ceil(fraction * len(ordered)))) - 1
+    return ordered[index]
+
+
+def latency_summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        "p50": percentile(ordered, 0.50),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99),
+        "max": ordered[-1] if ordered else None,
+        "mean": sum(ordered) / len(ordered) if ordered else None,
+    }
+
+
+# Drive one scenario with `concurrency` threads for `duration` seconds
+def run_scenario(name, mix, workload, url, concurrency, duration, seed_value):
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    samples = []  # (operation, seconds, status)
+    samples_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        session = requests.Session()
+        local = []
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = getattr(workload, operation)(session, rng).status_code
+            except requests.RequestException:
+                status = 0
+            local.append((operation, time.perf_counter() - started, status))
+        with samples_lock:
+            samples.extend(local)
+
+    queries_before = scrape_counter(url, "db_query_seconds_count")
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    queries_after = scrape_counter(url, "db_query_seconds_count")
+
+    statuses = {}
+    by_operation = {}
+    for operation, seconds, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        by_operation.setdefault(operation, []).append(seconds * 1000)
+    errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+    result = {
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "latency_ms": latency_summary([seconds * 1000 for _, seconds, _ in samples]),
+        "status": statuses,
+        "operations": {
+            operation: {"requests": len(latencies), "latency_ms": latency_summary(latencies)}
+            for operation, latencies in by_operation.items()
+        },
+        "db_queries_per_request": None,
+    }
+    if queries_before is not None and queries_after is not None and samples:
+        result["db_queries_per_request"] = (queries_after - queries_before) / len(samples)
+    print(f"{name}: {result['requests']} requests, {result['throughput_rps']:.1f} req/s, "
+          f"p95 {result['latency_ms']['p95'] or 0:.1f} ms, {errors} errors", file=sys.stderr)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Compare against an earlier results file; returns the list of regressions
+# (throughput down or p95 up by more than the tolerance)
+def compare(baseline, current, tolerance):
+    regressions = []
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        throughput = (result["throughput_rps"] / before["throughput_rps"] - 1) if before["throughput_rps"] else 0.0
+        p95_before, p95_now = before["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        p95 = (p95_now / p95_before - 1) if p95_before and p95_now else 0.0
+        print(f"{name}: throughput {throughput:+.1%}, p95 {p95:+.1%}", file=sys.stderr)
+        if throughput < -tolerance:
+            regressions.append(f"{name}: throughput {throughput:+.1%}")
+        if p95 > tolerance:
+            regressions.append(f"{name}: p95 latency {p95:+.1%}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the wakinjologin API")
+    target = parser.add_argument_group("target")
+    target.add_argument("--url", help="benchmark an already running server instead of starting one")
+    target.add_argument("--docker", action="store_true", help="start a throwaway MySQL container")
+    target.add_argument("--docker-image", default="mysql:8.0")
+    target.add_argument("--docker-port", type=int, default=33306)
+    target.add_argument("--db-host", default="127.0.0.1")
+    target.add_argument("--db-port", type=int, default=3306)
+    target.add_argument("--db-user", default="root")
+    target.add_argument("--db-password", default="")
+    target.add_argument("--db-name", default="wakinjologin_bench")
+    target.add_argument("--port", type=int, default=5055, help="port for the app started by the harness")
+    target.add_argument("--workers", type=int, default=2)
+    target.add_argument("--threads", type=int, default=8)
+    target.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app (repeatable)")
+    data = parser.add_argument_group("data")
+    data.add_argument("--employees", type=int, default=200)
+    data.add_argument("--items", type=int, default=2000)
+    data.add_argument("--companies", type=int, default=20)
+    data.add_argument("--no-seed", action="store_true")
+    load = parser.add_argument_group("load")
+    load.add_argument("--scenarios", default=",".join(SCENARIOS),
+                      help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    load.add_argument("--batch", type=int, default=10, help="items per /update_inventory request")
+    load.add_argument("--page-size", type=int, default=100)
+    load.add_argument("--seed", type=int, default=1)
+    output = parser.add_argument_group("output")
+    output.add_argument("--out", help="write the JSON results here as well as to stdout")
+    output.add_argument("--compare", help="earlier results file; exit 1 on regressions")
+    output.add_argument("--tolerance", type=float, default=0.10)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    container = server = None
+    try:
+        url = args.url
+        if not url:
+            if args.docker:
+                container, db = start_mysql_container(args.docker_image, args.docker_port)
+            else:
+                db = {"host": args.db_host, "port": args.db_port, "user": args.db_user,
+                      "password": args.db_password, "database": args.db_name}
+            migrate_database(db)
+            extra_env = dict(item.split("=", 1) for item in args.env)
+            server, url = start_server(db, args.port, args.workers, args.threads, extra_env)
+        if not args.no_seed:
+            seed(url, args.employees, args.items, args.companies)
+
+        workload = Workload(url, args, login_token(url))
+        results = {
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("db_password", "out", "compare")},
+            "scenarios": {},
+        }
+        for name in args.scenarios.split(","):
+            results["scenarios"][name] = run_scenario(
+                name, SCENARIOS[name], workload, url, args.concurrency, args.duration, args.seed
+            )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if container:
+            subprocess.call(["docker", "stop", container], stdout=subprocess.DEVNULL)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+# Versioned schema migrations for the wakinjologin database.
+#
+# Each migration is (version, description, steps); a step is either an SQL
+# string or a callable taking a cursor. Applied versions are recorded in
+# schema_migrations, so running migrate() again only applies what is new.
+# Every step is written to be safe to re-run, because MySQL commits DDL
+# immediately and a migration that fails halfway is retried from the start.
+#
+# Migrations are not applied unless asked for. After an upgrade run
+#   flask --app wakinjologin migrate
+# (or start the app with DB_AUTO_MIGRATE=1); /readyz reports 503 while any
+# migration is pending, because the routes rely on the tables they add.
+import pymysql
+from pymysql.constants.ER import NO_SUCH_TABLE
+
+import ledger
+
+# Named lock so several workers starting at once don't migrate concurrently
+MIGRATION_LOCK = "wakinjologin_migrate"
+
+
+class MigrationError(Exception):
+    pass
+
+
+def index_exists(cursor, table, index_name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (table, index_name)
+    )
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table, column):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1",
+        (table, column)
+    )
+    return cursor.fetchone() is not None
+
+
+# Step that creates an index unless one with that name exists already. MySQL
+# has no CREATE INDEX IF NOT EXISTS, hence the lookup.
+def add_index(table, index_name, columns, unique=False):
+    def step(cursor):
+        if index_exists(cursor, table, index_name):
+            return
+        try:
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table} ({columns})")
+        except pymysql.err.IntegrityError as e:
+            raise MigrationError(f"{table} has duplicate rows on ({columns}), merge them first: {e}")
+    step.__name__ = f"add_index({table}.{index_name})"
+    return step
+
+
+# Step that adds a column unless it exists already
+def add_column(table, column, definition):
+    def step(cursor):
+        if not column_exists(cursor, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    step.__name__ = f"add_column({table}.{column})"
+    return step
+
+
+MIGRATIONS = [
+    (1, "create employees, admins and items tables", [
+        """CREATE TABLE IF NOT EXISTS employees (
+            worker_id VARCHAR(64) NOT NULL,
+            username VARCHAR(255) NOT NULL,
+            phone_number VARCHAR(32) NOT NULL,
+            passwd VARCHAR(255) NOT NULL,
+            PRIMARY KEY (worker_id)
+        ) DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS admins (
+            admin_id VARCHAR(64) NOT NULL,
+            username VARCHAR(255) NOT NULL,
+            phone_number VARCHAR(32) NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            PRIMARY KEY (admin_id)
+        ) DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS items (
+            id INT NOT NULL AUTO_INCREMENT,
+            item_name VARCHAR(255) NOT NULL,
+            quantity INT NOT NULL DEFAULT 0,
+            company_name VARCHAR(255) NOT NULL,
+            price_per_item DECIMAL(12, 2) NOT NULL,
+            PRIMARY KEY (id)
+        ) DEFAULT CHARSET=utf8mb4""",
+    ]),
+    (2, "index the hot lookups", [
+        add_index("employees", "uq_employees_username", "username", unique=True),
+        add_index("admins", "uq_admins_username", "username", unique=True),
+        add_index("employees", "idx_employees_worker_id", "worker_id"),
+        add_index("items", "uq_items_company_item", "company_name, item_name", unique=True),
+        add_index("items", "idx_items_company_id", "company_name, id"),
+        add_index("items", "idx_items_quantity", "quantity"),
+    ]),
+    (3, "inventory movement ledger and daily snapshots", [
+        """CREATE TABLE IF NOT EXISTS inventory_movements (
+            id BIGINT NOT NULL AUTO_INCREMENT,
+            item_id INT NOT NULL,
+            company_name VARCHAR(255) NOT NULL,
+            delta INT NOT NULL,
+            quantity_after INT NOT NULL,
+            price_per_item DECIMAL(12, 2) NOT NULL,
+            reason VARCHAR(16) NOT NULL,
+            created_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            PRIMARY KEY (id),
+            KEY idx_movements_item (item_id, id),
+            KEY idx_movements_created (created_at)
+        ) DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS inventory_item_daily (
+            item_id INT NOT NULL,
+            day DATE NOT NULL,
+            company_name VARCHAR(255) NOT NULL,
+            quantity_in INT NOT NULL,
+            quantity_out INT NOT NULL,
+            closing_quantity INT NOT NULL,
+            closing_value DECIMAL(16, 2) NOT NULL,
+            PRIMARY KEY (item_id, day)
+        ) DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS inventory_company_daily (
+            company_name VARCHAR(255) NOT NULL,
+            day DATE NOT NULL,
+            quantity_in BIGINT NOT NULL,
+            quantity_out BIGINT NOT NULL,
+            closing_quantity BIGINT NOT NULL,
+            closing_value DECIMAL(18, 2) NOT NULL,
+            PRIMARY KEY (company_name, day)
+        ) DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS snapshot_watermarks (
+            name VARCHAR(64) NOT NULL,
+            last_movement_id BIGINT NOT NULL,
+            PRIMARY KEY (name)
+        ) DEFAULT CHARSET=utf8mb4""",
+        ledger.seed_opening_movements,
+    ]),
+    (4, "company inventory totals and report indexes", [
+        """CREATE TABLE IF NOT EXISTS company_inventory (
+            company_name VARCHAR(255) NOT NULL,
+            item_count INT NOT NULL,
+            total_quantity BIGINT NOT NULL,
+            total_value DECIMAL(18, 2) NOT NULL,
+            PRIMARY KEY (company_name)
+        ) DEFAULT CHARSET=utf8mb4""",
+        ledger.rebuild_company_totals,
+        add_column("items", "stock_value", "DECIMAL(18, 2) AS (quantity * price_per_item) STORED"),
+        add_index("items", "idx_items_company_quantity", "company_name, quantity"),
+        add_index("items", "idx_items_company_value", "company_name, stock_value"),
+        add_index("items", "idx_items_value", "stock_value"),
+    ]),
+    (5, "idempotency keys", [
+        """CREATE TABLE IF NOT EXISTS idempotency_keys (
+            scope CHAR(64) CHARACTER SET ascii NOT NULL,
+            idem_key VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+            fingerprint CHAR(64) CHARACTER SET ascii NOT NULL,
+            status_code SMALLINT NULL,
+            response MEDIUMBLOB NULL,
+            mimetype VARCHAR(255) NULL,
+            created_at DATETIME(6) NOT NULL,
+            expires_at DATETIME(6) NOT NULL,
+            PRIMARY KEY (scope, idem_key),
+            KEY idx_idempotency_expires (expires_at)
+        ) DEFAULT CHARSET=utf8mb4""",
+    ]),
+    (6, "fold snapshot movements individually", [
+        add_column("inventory_movements", "folded", "TINYINT(1) NOT NULL DEFAULT 0"),
+        add_index("inventory_movements", "idx_movements_unfolded", "folded, id"),
+        ledger.mark_watermarked_movements_folded,
+    ]),
+    (7, "token revocations", [
+        """CREATE TABLE IF NOT EXISTS token_revocations (
+            role VARCHAR(16) CHARACTER SET ascii NOT NULL,
+            username VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+            revoked_at DOUBLE NOT NULL,
+            PRIMARY KEY (role, username),
+            KEY idx_revocations_revoked_at (revoked_at)
+        ) DEFAULT CHARSET=utf8mb4""",
+    ]),
+]
+
+
+def _ensure_version_table(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (version)
+        ) DEFAULT CHARSET=utf8mb4"""
+    )
+
+
+def applied_versions(cursor):
+    _ensure_version_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row["version"] if isinstance(row, dict) else row[0] for row in cursor.fetchall()}
+
+
+# Apply every pending migration in order. Returns the versions applied.
+def migrate(connection, echo=print):
+    cursor = connection.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, 60) AS acquired", (MIGRATION_LOCK,))
+    row = cursor.fetchone()
+    if not (row["acquired"] if isinstance(row, dict) else row[0]):
+        raise MigrationError("Timed out waiting for another process to finish migrating")
+    try:
+        done = applied_versions(cursor)
+        applied = []
+        for version, description, steps in MIGRATIONS:
+            if version in done:
+                continue
+            echo(f"Applying migration {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            connection.commit()
+            applied.append(version)
+        return applied
+    finally:
+        cursor.execute("DO RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        cursor.close()
+
+
+# Versions not applied yet. Unlike applied_versions() this creates nothing,
+# so it is safe in a readiness check.
+def pending_versions(cursor):
+    try:
+        cursor.execute("SELECT version FROM schema_migrations")
+    except pymysql.err.ProgrammingError as e:
+        if e.args[0] != NO_SUCH_TABLE:
+            raise
+        done = set()
+    else:
+        done = {row["version"] if isinstance(row, dict) else row[0] for row in cursor.fetchall()}
+    return [version for version, _, _ in MIGRATIONS if version not in done]
+
+
+def pending_migrations(connection):
+    cursor = connection.cursor()
+    try:
+        done = applied_versions(cursor)
+    finally:
+        cursor.close()
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in done]
+
+
+# The queries on the request paths, with sample parameters, checked with
+# EXPLAIN at startup: (name, sql, params)
+HOT_QUERIES = [
+    ("employee by username", "SELECT passwd FROM employees WHERE username = %s", ("x",)),
+    ("admin by username", "SELECT password FROM admins WHERE username = %s", ("x",)),
+    ("item by name and company",
+     "SELECT id, quantity FROM items WHERE item_name = %s AND company_name = %s", ("x", "y")),
+    ("items by name and company (batch)",
+     "(SELECT 0 AS requested, id, quantity FROM items WHERE item_name = %s AND company_name = %s) UNION ALL "
+     "(SELECT 1 AS requested, id, quantity FROM items WHERE item_name = %s AND company_name = %s)",
+     ("x", "y", "z", "w")),
+    ("items page by company",
+     "SELECT id FROM items WHERE company_name = %s AND id > %s ORDER BY id LIMIT 100", ("y", 0)),
+    ("company stock at date",
+     "SELECT company_name, MAX(day) FROM inventory_company_daily WHERE day <= %s AND company_name = %s "
+     "GROUP BY company_name", ("2024-01-01", "y")),
+    ("low stock by company",
+     "SELECT id FROM items WHERE company_name = %s AND quantity < %s ORDER BY quantity, id LIMIT 100", ("y", 5)),
+    ("top items by company",
+     "SELECT id FROM items WHERE company_name = %s ORDER BY stock_value DESC LIMIT 10", ("y",)),
+    ("item stock at date",
+     "SELECT closing_quantity FROM inventory_item_daily WHERE item_id = %s AND day <= %s "
+     "ORDER BY day DESC LIMIT 1", (1, "2024-01-01")),
+]
+
+
+# EXPLAIN each hot query and describe the ones MySQL would answer with a
+# full table scan. Returns a list of warning strings.
+def check_query_plans(connection):
+    warnings = []
+    cursor = connection.cursor(pymysql.cursors.DictCursor)
+    try:
+        for name, sql, params in HOT_QUERIES:
+            try:
+                cursor.execute("EXPLAIN " + sql, params)
+            except pymysql.Error as e:
+                warnings.append(f"{name}: EXPLAIN failed: {e}")
+                continue
+            for row in cursor.fetchall():
+                if row.get("type") == "ALL":
+                    warnings.append(
+                        f"{name}: full scan of {row.get('table')} (~{row.get('rows')} rows), "
+                        f"possible keys: {row.get('possible_keys') or 'none'}"
+                    )
+    finally:
+        cursor.close()
+    return warnings
@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+# Configure the app before it is imported: no database at import, no
+# background threads, and shared state in a scratch directory
+os.environ.setdefault("SHARED_STATE_DIR", tempfile.mkdtemp(prefix="wakinjologin-tests-"))
+os.environ.setdefault("DB_STARTUP_CHECK", "0")
+os.environ.setdefault("SNAPSHOT_REFRESH_INTERVAL", "0")
+os.environ.setdefault("PREWARM", "0")
+os.environ.setdefault("TOKEN_SECRET", "test-secret-" + "x" * 32)
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("HASH_WORKERS", "2")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest  # noqa: E402
+
+import wakinjologin  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    wakinjologin.wakinjologin.config["TESTING"] = True
+    return wakinjologin.wakinjologin.test_client()
+
+
+@pytest.fixture(autouse=True)
+def no_background_tasks(monkeypatch):
+    # Tests drive the index maintainer and the snapshot refresher directly
+    monkeypatch.setitem(wakinjologin._background_state, "pid", os.getpid())
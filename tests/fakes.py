@@ -0,0 +1,113 @@
+# In-memory stand-ins for a PyMySQL connection. Cursors are the real PyMySQL
+# (and timed) cursor classes with only the network round trip replaced, so
+# argument escaping and executemany()'s multi-row INSERT rewrite run as in
+# production.
+import functools
+import re
+import types
+
+import pymysql
+from pymysql import converters
+
+import wakinjologin
+from ledger import collation_key
+
+ITEM_LOOKUP = re.compile(r"\(SELECT (\d+) AS requested, .*? WHERE item_name = '([^']*)' AND company_name = '([^']*)'")
+
+
+class FakeConnection:
+    encoding = "utf8"
+    charset = "utf8mb4"
+    _result = None
+
+    # handler(sql) returns the rows of a statement (a list of dicts) or,
+    # for writes, the affected row count
+    def __init__(self, handler=None):
+        self.handler = handler or (lambda sql: 0)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.open = True
+        self.lastrowid = 0
+
+    def cursor(self, cursor=None):
+        return fake_cursor(cursor or wakinjologin.TimedDictCursor)(self)
+
+    def escape(self, obj, mapping=None):
+        return converters.escape_item(obj, self.charset, mapping)
+
+    literal = escape
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.open = False
+
+    def get_autocommit(self):
+        return False
+
+    def run(self, sql):
+        self.statements.append(sql)
+        result = self.handler(sql)
+        if isinstance(result, int):
+            return [], result
+        return list(result), len(result)
+
+
+@functools.lru_cache(maxsize=None)
+def fake_cursor(base):
+    dict_rows = issubclass(base, pymysql.cursors.DictCursorMixin)
+
+    class FakeCursor(base):
+        def _query(self, q):
+            if not isinstance(q, str):
+                q = bytes(q).decode("utf-8")
+            rows, rowcount = self.connection.run(q)
+            self._rows = tuple(rows if dict_rows else (tuple(row.values()) for row in rows))
+            self.rownumber = 0
+            self.rowcount = rowcount
+            self.lastrowid = self.connection.lastrowid
+            self._result = types.SimpleNamespace(warning_count=0)
+            return rowcount
+
+        # Unbuffered (SS) cursors read their rows one at a time
+        def read_next(self):
+            if self.rownumber >= len(self._rows):
+                return None
+            return self._rows[self.rownumber]
+
+    FakeCursor.__name__ = f"Fake{base.__name__}"
+    return FakeCursor
+
+
+# Whether sql is a fetch_items() lookup
+def is_item_lookup(sql):
+    return sql.startswith("(SELECT 0 AS requested")
+
+
+# Answer a fetch_items() lookup from item rows, matching names the way the
+# default utf8mb4_0900_ai_ci collation does
+def item_lookup(sql, rows):
+    result = []
+    for index, item_name, company_name in ITEM_LOOKUP.findall(sql):
+        wanted = (collation_key(item_name), collation_key(company_name))
+        result.extend(dict(row, requested=int(index)) for row in rows
+                      if (collation_key(row["item_name"]), collation_key(row["company_name"])) == wanted)
+    return result
+
+
+# Route db_connection() to a single fake connection
+def use_connection(monkeypatch, connection):
+    monkeypatch.setattr(wakinjologin.db_pool, "acquire", lambda *args, **kwargs: connection)
+    monkeypatch.setattr(wakinjologin.db_pool, "release", lambda *args, **kwargs: None)
+    return connection
@@ -0,0 +1,184 @@
+import asyncio
+import functools
+import json
+from decimal import Decimal
+
+import bcrypt
+import pytest
+
+pytest.importorskip("quart")
+aiomysql = pytest.importorskip("aiomysql")
+
+from aiomysql.utils import _ContextManager  # noqa: E402
+
+import wakinjologin  # noqa: E402
+import wakinjologin_asgi  # noqa: E402
+from fakes import FakeConnection, is_item_lookup, item_lookup  # noqa: E402
+
+BOLT = {"id": 1, "item_name": "bolt", "company_name": "Acme", "quantity": 10, "price_per_item": Decimal("2.50")}
+
+
+# An aiomysql connection without the network: cursors are the real aiomysql
+# (and timed) cursor classes with only the round trip replaced, so argument
+# escaping and executemany()'s multi-row INSERT rewrite run as in production
+class FakeAsyncConnection(FakeConnection):
+    closed = False
+
+    def cursor(self, cursor=None):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(fake_async_cursor(cursor or wakinjologin_asgi.TimedDictCursor)(self))
+        return _ContextManager(future)
+
+    @property
+    def loop(self):
+        return asyncio.get_running_loop()
+
+    async def begin(self):
+        pass
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+    def get_transaction_status(self):
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def fake_async_cursor(base):
+    dict_rows = issubclass(base, aiomysql.DictCursor) or issubclass(base, aiomysql.SSDictCursor)
+
+    class FakeCursor(base):
+        async def _query(self, q):
+            if not isinstance(q, str):
+                q = bytes(q).decode("utf-8")
+            rows, rowcount = self._connection.run(q)
+            self._rows = [row if dict_rows else tuple(row.values()) for row in rows]
+            self._rownumber = 0
+            self._rowcount = rowcount
+            self._lastrowid = self._connection.lastrowid
+            return rowcount
+
+        async def _read_next(self):
+            if self._rownumber >= len(self._rows):
+                return None
+            return self._rows[self._rownumber]
+
+    FakeCursor.__name__ = f"Fake{base.__name__}"
+    return FakeCursor
+
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def acquire(self):
+        return self.connection
+
+    def release(self, connection):
+        pass
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeAsyncConnection(lambda sql: 1)
+    monkeypatch.setattr(wakinjologin_asgi, "db_pool", FakePool(connection))
+    return connection
+
+
+def call(method, path, **kwargs):
+    async def request():
+        return await wakinjologin_asgi.app.test_client().open(path, method=method, **kwargs)
+    return asyncio.run(request())
+
+
+def test_login_issues_a_token(connection):
+    hashed = bcrypt.hashpw(b"hunter2", bcrypt.gensalt(wakinjologin.BCRYPT_ROUNDS)).decode()
+    connection.handler = lambda sql: [{"passwd": hashed}] if "FROM employees" in sql else 1
+
+    response = call("POST", "/login", form={"username": "asgi-alice", "passwd": "hunter2"})
+    assert response.status_code == 200
+    body = asyncio.run(response.get_json())
+    assert wakinjologin.verify_token(body["token"])["sub"] == "asgi-alice"
+
+    response = call("POST", "/login", form={"username": "asgi-bob", "passwd": "wrong"})
+    assert response.status_code == 400
+
+
+def test_update_inventory_writes_one_transaction(connection):
+    connection.handler = lambda sql: item_lookup(sql, [BOLT]) if is_item_lookup(sql) else 1
+    version = wakinjologin.items_cache.version()
+
+    response = call("POST", "/update_inventory", json={"items": [
+        {"item_name": "Bolt", "company_name": "ACME", "quantity": 3, "type": "subtract"},
+    ]})
+    assert response.status_code == 200
+    updates = asyncio.run(response.get_json())["updates"]
+    assert updates[0]["message"].endswith(" 7")
+    assert "UPDATE items SET quantity = CASE id WHEN 1 THEN 7 END WHERE id IN (1)" in connection.statements
+    assert any(sql.startswith("INSERT INTO inventory_movements") for sql in connection.statements)
+    assert connection.commits == 1
+    assert wakinjologin.items_cache.version() != version
+
+
+def test_update_inventory_reports_unknown_items(connection):
+    connection.handler = lambda sql: [] if is_item_lookup(sql) else 1
+    response = call("POST", "/update_inventory", json={"items": [
+        {"item_name": "gear", "company_name": "Acme", "quantity": 1, "type": "add"},
+    ]})
+    assert response.status_code == 404
+    assert connection.commits == 0
+
+
+def test_get_items_answers_a_matching_etag_with_304(connection):
+    connection.handler = lambda sql: [dict(BOLT)] if sql.startswith("SELECT") else 1
+    wakinjologin.items_cache.invalidate()
+
+    first = call("GET", "/get_items", query_string={"limit": "10"})
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert asyncio.run(first.get_json())["data"][0]["item_name"] == "bolt"
+
+    statements = len(connection.statements)
+    again = call("GET", "/get_items", query_string={"limit": "10"}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert len(connection.statements) == statements
+
+    # A write elsewhere changes the version, so the old ETag no longer matches
+    wakinjologin.items_cache.invalidate()
+    changed = call("GET", "/get_items", query_string={"limit": "10"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+# Drive the ASGI entry point directly, as a server would
+def asgi_get(path, headers=()):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"localhost")] + [(name.encode(), value.encode()) for name, value in headers],
+        "client": ("127.0.0.1", 50000), "server": ("localhost", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(wakinjologin_asgi.application(scope, receive, send))
+    status = messages[0]["status"]
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return status, body
+
+
+def test_flask_only_routes_fall_through_to_the_wsgi_app():
+    assert "/session" not in wakinjologin_asgi.async_paths
+    token, _ = wakinjologin.issue_token("alice", "employee")
+    status, body = asgi_get("/session", headers=[("authorization", f"Bearer {token}")])
+    assert status == 200
+    assert json.loads(body)["data"]["username"] == "alice"
+    assert asgi_get("/session")[0] == 401
@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+import wakinjologin
+from fakes import FakeConnection, use_connection
+
+
+def bearer(role, username="alice"):
+    token, _ = wakinjologin.issue_token(username, role)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_legacy_route_lets_a_missing_token_through(client, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(lambda sql: []))
+    response = client.get("/get_employees")
+    assert response.status_code == 404
+    assert response.get_json()["message"] == "No employees found"
+
+
+def test_legacy_route_refuses_a_wrong_role_or_invalid_token(client):
+    assert client.get("/get_employees", headers=bearer("employee")).status_code == 403
+    assert client.get("/get_employees", headers={"Authorization": "Bearer forged.token"}).status_code == 401
+
+
+def test_new_routes_always_want_a_token(client):
+    for path in ("/reports/top_items", "/debug/queries", "/session"):
+        response = client.get(path)
+        assert response.status_code == 401, path
+
+
+def test_non_ascii_signature_is_refused():
+    token, _ = wakinjologin.issue_token("alice", "admin")
+    payload = token.split(".")[0]
+    assert wakinjologin.verify_token(f"{payload}.é") is None
+    assert wakinjologin.verify_token(token)["sub"] == "alice"
+
+
+def test_non_ascii_signature_gets_401(client):
+    payload = wakinjologin.issue_token("alice", "admin")[0].split(".")[0]
+    response = client.get("/session", headers={"Authorization": f"Bearer {payload}.é"})
+    assert response.status_code == 401
+
+
+def test_revocations_are_shared_through_the_table():
+    revoked_at = wakinjologin.time.time()
+    table = [{"role": "employee", "username": "mallory\n1\tadmin\talice", "revoked_at": revoked_at}]
+    connection = FakeConnection(lambda sql: table if sql.startswith("SELECT role") else 0)
+
+    # Another worker's revocation arrives with the next refresh
+    revocations = wakinjologin.RevocationList()
+    revocations.refresh(connection)
+    assert revocations.revoked_at("employee", "mallory\n1\tadmin\talice") == revoked_at
+    assert revocations.revoked_at("admin", "alice") == 0
+    assert connection.commits == 1
+
+    # This worker's own applies at once, and outlives a refresh that misses it
+    revocations.remember("employee", "Bob", revoked_at)
+    revocations.refresh(connection)
+    assert revocations.revoked_at("employee", "bob") == revoked_at
+
+
+def test_deleted_employee_token_is_revoked(client, monkeypatch):
+    monkeypatch.setattr(wakinjologin, "revocations", wakinjologin.RevocationList())
+    headers = bearer("employee", "bob")
+    assert client.get("/session", headers=headers).status_code == 200
+    connection = use_connection(monkeypatch, FakeConnection(lambda sql: 1))
+    response = client.post("/delete_employee", headers=bearer("admin"), data={"username": "bob"})
+    assert response.status_code == 200
+    assert any(sql.startswith("INSERT INTO token_revocations") for sql in connection.statements)
+    assert client.get("/session", headers=headers).status_code == 401
+
+
+def test_debug_queries_needs_the_flag_and_an_admin_token(client, monkeypatch):
+    monkeypatch.setattr(wakinjologin, "QUERY_TRACE", True)
+    assert client.get("/debug/queries", headers=bearer("admin")).status_code == 404
+
+    monkeypatch.setattr(wakinjologin, "DEBUG_QUERIES", True)
+    assert client.get("/debug/queries").status_code == 401
+    assert client.get("/debug/queries", headers=bearer("employee")).status_code == 403
+    response = client.get("/debug/queries", headers=bearer("admin"))
+    assert response.status_code == 200
+    assert "traces" in response.get_json()["data"]
+
+
+def test_generated_secret_is_shared_and_long_enough(tmp_path, monkeypatch):
+    monkeypatch.delenv("TOKEN_SECRET")
+    monkeypatch.setattr(wakinjologin, "SHARED_STATE_DIR", str(tmp_path))
+    secret = wakinjologin.load_token_secret()
+    assert len(secret) >= wakinjologin.MIN_TOKEN_SECRET_LENGTH
+    assert wakinjologin.load_token_secret() == secret
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["token.secret"]
+
+
+def test_short_secret_is_refused(tmp_path, monkeypatch):
+    monkeypatch.setenv("TOKEN_SECRET", "")
+    with pytest.raises(RuntimeError):
+        wakinjologin.load_token_secret()
+    monkeypatch.delenv("TOKEN_SECRET")
+    monkeypatch.setattr(wakinjologin, "SHARED_STATE_DIR", str(tmp_path))
+    (tmp_path / "token.secret").write_bytes(b"")
+    with pytest.raises(RuntimeError):
+        wakinjologin.load_token_secret()
+
+
+def test_state_dir_is_private(tmp_path):
+    path = wakinjologin.shared_state_dir(str(tmp_path / "state"))
+    assert os.stat(path).st_mode & 0o777 == 0o700
+
+    open_dir = tmp_path / "open"
+    open_dir.mkdir()
+    open_dir.chmod(0o777)
+    with pytest.raises(RuntimeError):
+        wakinjologin.shared_state_dir(str(open_dir))
@@ -0,0 +1,14 @@
+import wakinjologin
+
+
+def test_remembered_password_hits_until_invalidated():
+    cache = wakinjologin.CredentialCache(max_size=10, ttl=60)
+    assert not cache.lookup('employee', "alice", "s3cret")
+    cache.remember('employee', "alice", "s3cret")
+    assert cache.lookup('employee', "alice", "s3cret")
+    assert not cache.lookup('employee', "alice", "wrong")
+    assert not cache.lookup('admin', "alice", "s3cret")
+
+    cache.invalidate('employee', "ALICE")
+    assert not cache.lookup('employee', "alice", "s3cret")
+    assert cache.stats()["hits"] == 1
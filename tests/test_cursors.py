@@ -0,0 +1,52 @@
+import wakinjologin
+from fakes import FakeConnection
+
+
+def histogram_count(name, labels):
+    for metric, metric_labels, values in wakinjologin.metrics.snapshot()["histograms"]:
+        if metric == name and tuple(map(tuple, metric_labels)) == labels:
+            return sum(values[:-1])
+    return 0
+
+
+def test_executemany_multi_row_insert_runs_as_one_statement():
+    connection = FakeConnection(lambda sql: 3)
+    labels = (("statement", "INSERT"), ("query", "test.bulk"))
+    before = histogram_count("db_query_seconds", labels)
+    with connection.cursor(wakinjologin.TimedCursor) as cursor:
+        rows = cursor.executemany(
+            "INSERT /* q:test.bulk */ INTO items (item_name, quantity) VALUES (%s, %s)",
+            [("bolt", 1), ("nut", 2), ("washer's", 3)],
+        )
+    assert rows == 3
+    assert connection.statements == [
+        "INSERT /* q:test.bulk */ INTO items (item_name, quantity) VALUES ('bolt', 1),('nut', 2),('washer\\'s', 3)"
+    ]
+    # Observed once, under the template's labels
+    assert histogram_count("db_query_seconds", labels) == before + 1
+
+
+def test_executemany_row_by_row_statements():
+    connection = FakeConnection(lambda sql: 1)
+    with connection.cursor() as cursor:
+        cursor.executemany("UPDATE items SET quantity = %s WHERE id = %s", [(1, 10), (2, 20)])
+    assert connection.statements == [
+        "UPDATE items SET quantity = 1 WHERE id = 10",
+        "UPDATE items SET quantity = 2 WHERE id = 20",
+    ]
+
+
+def test_statement_labels_of_binary_statement():
+    assert wakinjologin.statement_labels(bytearray(b"/* q:items.insert */ INSERT INTO items VALUES (1)")) == (
+        ("statement", "INSERT"), ("query", "items.insert"))
+
+
+def test_only_parameterized_statements_are_cached():
+    wakinjologin.query_labels.cache_clear()
+    connection = FakeConnection(lambda sql: 1)
+    with connection.cursor(wakinjologin.TimedCursor) as cursor:
+        for item_id in range(3):
+            cursor.execute("UPDATE /* q:test.literal */ items SET quantity = 0 WHERE id = %d" % item_id)
+            cursor.execute("UPDATE /* q:test.template */ items SET quantity = 0 WHERE id = %s", (item_id,))
+        cursor.executemany("INSERT INTO items (item_name) VALUES (%s)", [("a",), ("b",)])
+    assert wakinjologin.query_labels.cache_info().currsize == 2
@@ -0,0 +1,91 @@
+import datetime
+import gzip
+import json
+from decimal import Decimal
+
+import pytest
+from flask import Response
+from werkzeug.http import parse_accept_header
+
+import wakinjologin
+from fakes import FakeConnection, use_connection
+
+ROW = {"id": 7, "item_name": "bolt", "quantity": 3, "company_name": "Acme", "price_per_item": Decimal("12.50")}
+
+
+def negotiate(header, size=4096):
+    return wakinjologin.negotiate_encoding(parse_accept_header(header), size)
+
+
+def test_encoding_follows_accept_encoding_and_size(monkeypatch):
+    monkeypatch.setattr(wakinjologin, "CONTENT_ENCODINGS", ("br", "gzip"))
+    monkeypatch.setattr(wakinjologin, "COMPRESS_MIN_BYTES", 1024)
+    assert negotiate("gzip") == "gzip"
+    assert negotiate("gzip, br") == "br"
+    assert negotiate("br;q=0.5, gzip") == "gzip"
+    assert negotiate("br;q=0, gzip;q=0") is None
+    assert negotiate("identity") is None
+    assert negotiate("") is None
+    assert negotiate("gzip", size=1023) is None
+    assert negotiate("gzip", size=None) is None
+
+    monkeypatch.setattr(wakinjologin, "COMPRESS_MIN_BYTES", -1)
+    assert negotiate("gzip") is None
+
+
+def test_compressed_body_gets_a_weak_etag():
+    response = Response(b"{}", mimetype="application/json")
+    response.set_etag("abc")
+    wakinjologin.weaken_etag(response)
+    assert response.headers["ETag"] == 'W/"abc"'
+    wakinjologin.weaken_etag(response)
+    assert response.headers["ETag"] == 'W/"abc"'
+
+
+@pytest.fixture
+def items(monkeypatch):
+    monkeypatch.setattr(wakinjologin, "items_cache", wakinjologin.ItemsCache())
+    monkeypatch.setattr(wakinjologin, "COMPRESS_MIN_BYTES", 0)
+    use_connection(monkeypatch, FakeConnection(lambda sql: [dict(ROW)] if sql.startswith("SELECT") else 1))
+
+
+def test_compressed_items_are_revalidated_by_their_weak_etag(client, items):
+    plain = client.get("/get_items", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert not plain.headers["ETag"].startswith("W/")
+
+    compressed = client.get("/get_items", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"] == "W/" + plain.headers["ETag"]
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert gzip.decompress(compressed.data) == plain.data
+
+    again = client.get("/get_items", headers={"Accept-Encoding": "gzip",
+                                              "If-None-Match": compressed.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_small_json_responses_stay_uncompressed(client, monkeypatch):
+    monkeypatch.setattr(wakinjologin, "COMPRESS_MIN_BYTES", 1024)
+    response = client.get("/healthz", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+@pytest.mark.skipif(wakinjologin.orjson is None, reason="orjson is not installed")
+def test_orjson_output_matches_the_stdlib_encoder(monkeypatch):
+    document = {
+        "status": "success",
+        "data": [dict(ROW, price_per_item=Decimal("0.10")), ROW],
+        "at": datetime.datetime(2024, 3, 1, 12, 30), "day": datetime.date(2024, 3, 1),
+        "ratio": 0.1 + 0.2, "missing": None, "flags": [True, False], "nested": {"b": 1, "a": -0.0},
+    }
+    monkeypatch.setattr(wakinjologin, "FAST_JSON", True)
+    fast = wakinjologin.json_bytes(document)
+    huge = wakinjologin.json_bytes({"n": 2 ** 70})  # too big for orjson, so the stdlib encodes it
+    text = wakinjologin.json_bytes({"name": "Ćesar ☃"})
+    monkeypatch.setattr(wakinjologin, "FAST_JSON", False)
+    assert fast == wakinjologin.json_bytes(document)
+    assert huge == wakinjologin.json_bytes({"n": 2 ** 70}) == b'{"n":1180591620717411303424}'
+    # Only the escaping of non-ASCII text differs
+    assert json.loads(text) == json.loads(wakinjologin.json_bytes({"name": "Ćesar ☃"}))
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+import wakinjologin
+
+
+def _wait(event):
+    event.wait(5)
+    return "bulk"
+
+
+def _echo(value):
+    return value
+
+
+def test_interactive_work_runs_while_bulk_work_is_queued():
+    pool = wakinjologin.HashingPool(workers=2, queue_size=2)
+    release = threading.Event()
+    results = []
+    bulk = threading.Thread(target=lambda: results.append(pool.map(_wait, [(release,)] * 10)))
+    bulk.start()
+    try:
+        time.sleep(0.1)
+        # One worker is left to interactive calls, along with the queue
+        assert [pool.run(_echo, n) for n in range(20)] == list(range(20))
+        assert pool.stats()["rejected"] == 0
+    finally:
+        release.set()
+        bulk.join(5)
+    assert results == [["bulk"] * 10]
+
+
+def test_map_gives_up_after_its_timeout():
+    pool = wakinjologin.HashingPool(workers=2, queue_size=0)
+    release = threading.Event()
+    blocker = threading.Thread(target=pool.map, args=(_wait, [(release,)]))
+    blocker.start()
+    try:
+        time.sleep(0.05)
+        with pytest.raises(wakinjologin.HashingBusy):
+            pool.map(_echo, [(1,)], timeout=0.05)
+    finally:
+        release.set()
+        blocker.join(5)
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _fail(value):
+    raise ValueError(value)
+
+
+def test_map_timeout_applies_per_wait_not_to_the_whole_call():
+    pool = wakinjologin.HashingPool(workers=2, queue_size=0)
+    # 20 jobs of 50 ms on one bulk worker take about 1 s, well past the timeout
+    assert pool.map(_sleep, [(0.05,)] * 20, timeout=0.5) == [0.05] * 20
+    assert pool.stats()["rejected"] == 0
+
+
+def test_map_failure_leaves_no_work_behind():
+    pool = wakinjologin.HashingPool(workers=3, queue_size=0)
+    with pytest.raises(ValueError):
+        pool.map(_fail, [(n,) for n in range(10)])
+    deadline = time.monotonic() + 5
+    while pool.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()["in_flight"] == 0
+    assert pool.run(_echo, 1) == 1
@@ -0,0 +1,159 @@
+import datetime
+import hashlib
+import re
+from decimal import Decimal
+
+import pytest
+
+import wakinjologin
+from fakes import FakeConnection, is_item_lookup, item_lookup, use_connection
+
+BOLT = {"id": 1, "item_name": "bolt", "company_name": "Acme", "quantity": 10, "price_per_item": Decimal("2.50")}
+
+
+# The idempotency_keys table, plus one item for /update_inventory to update
+class IdempotencyTable:
+    def __init__(self):
+        self.rows = {}  # (scope, key) -> row
+        self.clock = datetime.datetime(2024, 3, 1)
+
+    @staticmethod
+    def _key(sql):
+        return re.search(r"scope = '(\w+)' AND idem_key = '([^']*)'", sql).groups()
+
+    # The row a statement guarded on the claim's created_at refers to, if
+    # that claim still holds
+    def _claim(self, sql):
+        row = self.rows.get(self._key(sql))
+        claimed_at = re.search(r"created_at = '([^']*)'", sql).group(1)
+        return row if row and str(row["created_at"]) == claimed_at else None
+
+    def take_over(self, scope, key):
+        self.clock += datetime.timedelta(seconds=1)
+        self.rows[(scope, key)].update(created_at=self.clock, status_code=None)
+
+    def __call__(self, sql):
+        if sql.startswith("INSERT IGNORE INTO idempotency_keys"):
+            scope, key, fingerprint = re.search(r"VALUES \('(\w+)', '([^']*)', '(\w+)'", sql).groups()
+            if (scope, key) in self.rows:
+                return 0
+            self.clock += datetime.timedelta(microseconds=1)
+            self.rows[(scope, key)] = {"fingerprint": fingerprint, "status_code": None, "response": None,
+                                       "mimetype": None, "created_at": self.clock, "expired": 0, "stale": 0}
+            return 1
+        if sql.startswith("SELECT created_at"):
+            return [{"created_at": self.rows[self._key(sql)]["created_at"]}]
+        if sql.startswith("SELECT fingerprint"):
+            row = self.rows.get(self._key(sql))
+            return [dict(row)] if row else []
+        if sql.startswith("UPDATE idempotency_keys"):
+            row = self._claim(sql)
+            if row is None:
+                return 0
+            match = re.search(r"status_code = (\d+), response = _binary X'(\w*)', mimetype = '([^']*)'", sql)
+            row.update(status_code=int(match.group(1)), response=bytes.fromhex(match.group(2)),
+                       mimetype=match.group(3))
+            return 1
+        if sql.startswith("DELETE FROM idempotency_keys WHERE scope"):
+            if self._claim(sql) is None:
+                return 0
+            del self.rows[self._key(sql)]
+            return 1
+        if is_item_lookup(sql):
+            return item_lookup(sql, [BOLT])
+        return 1
+
+
+@pytest.fixture
+def table(monkeypatch):
+    # A fresh store each time, so nothing is replayed from an earlier test
+    monkeypatch.setattr(wakinjologin, "idempotency", wakinjologin.IdempotencyStore(ttl=60, pending_timeout=60,
+                                                                                    local_size=100))
+    table = IdempotencyTable()
+    use_connection(monkeypatch, FakeConnection(table))
+    return table
+
+
+def subtract(client, quantity, key="k1"):
+    return client.post("/update_inventory", headers={"Idempotency-Key": key}, json={"items": [
+        {"item_name": "bolt", "company_name": "Acme", "quantity": quantity, "type": "subtract"},
+    ]})
+
+
+def item_updates():
+    return wakinjologin.db_pool.acquire().statements.count(
+        "UPDATE items SET quantity = CASE id WHEN 1 THEN 7 END WHERE id IN (1)")
+
+
+def test_retry_is_replayed_without_running_again(client, table):
+    first = subtract(client, 3)
+    assert first.status_code == 200
+    assert [row["status_code"] for row in table.rows.values()] == [200]
+
+    retry = subtract(client, 3)
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json() == first.get_json()
+    assert item_updates() == 1
+    assert wakinjologin.idempotency.stats()["replayed_local"] == 1
+
+
+def test_retry_on_another_worker_is_replayed_from_the_table(client, table, monkeypatch):
+    first = subtract(client, 3)
+    monkeypatch.setattr(wakinjologin, "idempotency", wakinjologin.IdempotencyStore(ttl=60, pending_timeout=60,
+                                                                                    local_size=100))
+    retry = subtract(client, 3)
+    assert retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert item_updates() == 1
+    assert wakinjologin.idempotency.stats()["replayed_db"] == 1
+
+
+def test_key_reused_for_another_request_is_refused(client, table):
+    assert subtract(client, 3).status_code == 200
+    assert subtract(client, 4).status_code == 422
+
+
+def test_duplicate_of_a_running_request_gets_409(client, table, monkeypatch):
+    assert subtract(client, 3).status_code == 200
+    # As if the first request were still running, seen from another worker
+    for row in table.rows.values():
+        row.update(status_code=None, response=None, mimetype=None)
+    monkeypatch.setattr(wakinjologin, "idempotency", wakinjologin.IdempotencyStore(ttl=60, pending_timeout=60,
+                                                                                    local_size=100))
+    response = subtract(client, 3)
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_server_error_releases_the_key(client, table, monkeypatch):
+    monkeypatch.setattr(wakinjologin, "write_item_quantities", lambda cursor, quantities: 1 / 0)
+    assert subtract(client, 3).status_code == 500
+    assert table.rows == {}
+
+
+def test_overlong_key_is_rejected(client, table):
+    assert subtract(client, 3, key="k" * 256).status_code == 400
+    assert table.rows == {}
+
+
+def test_release_leaves_a_claim_taken_over_meanwhile(client, table, monkeypatch):
+    scope = wakinjologin.idempotency_scope("/update_inventory", None)
+
+    def fail_after_takeover(cursor, quantities):
+        table.take_over(scope, "k1")
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(wakinjologin, "write_item_quantities", fail_after_takeover)
+    assert subtract(client, 3).status_code == 500
+    assert list(table.rows) == [(scope, "k1")]
+
+
+def test_fingerprint_is_keyed():
+    form = [("username", "alice"), ("passwd", "hunter2")]
+    fingerprint = wakinjologin.request_fingerprint("POST", "/register", "", b"", form)
+    plain = hashlib.sha256()
+    for part in (b"POST\0", b"/register\0", b"\0", b"\0", b"passwd=hunter2\0", b"username=alice\0"):
+        plain.update(part)
+    assert fingerprint != plain.hexdigest()
+    assert fingerprint == wakinjologin.request_fingerprint("POST", "/register", "", b"", reversed(form))
@@ -0,0 +1,83 @@
+import threading
+from decimal import Decimal
+
+import wakinjologin
+from fakes import FakeConnection, is_item_lookup, item_lookup, use_connection
+
+ITEMS = {
+    "bolt": {"id": 1, "item_name": "bolt", "company_name": "Acme", "quantity": 10, "price_per_item": Decimal("2.50")},
+    "nut": {"id": 2, "item_name": "nut", "company_name": "Acme", "quantity": 4, "price_per_item": Decimal("0.10")},
+}
+
+
+def inventory(sql):
+    if is_item_lookup(sql):
+        return item_lookup(sql, ITEMS.values())
+    return 1
+
+
+def line(item_name, quantity, update_type="subtract"):
+    return {"item_name": item_name, "company_name": "Acme", "quantity": quantity, "type": update_type}
+
+
+# Submit every request from its own thread, all inside one aggregation window
+def submit_together(aggregator, requests):
+    results = [None] * len(requests)
+
+    def submit(index):
+        results[index] = aggregator.submit(requests[index])
+
+    threads = [threading.Thread(target=submit, args=(index,)) for index in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_requests_in_one_window_share_a_transaction(monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(inventory))
+    aggregator = wakinjologin.InventoryAggregator(window=0.2, max_batch=10)
+    results = submit_together(aggregator, [[line("bolt", 3)], [line("bolt", 4)], [line("nut", 1, "add")]])
+
+    # Each caller sees the quantities left by those ahead of it in the batch
+    new_quantities = sorted(response["message"].rsplit(" ", 1)[1] for _, updates in results for response in updates)
+    assert new_quantities == ["3", "5", "7"]
+    assert connection.commits == 1
+    assert sum(is_item_lookup(sql) for sql in connection.statements) == 1
+    assert "UPDATE items SET quantity = CASE id WHEN 1 THEN 3 WHEN 2 THEN 5 END WHERE id IN (1, 2)" \
+        in connection.statements
+    assert aggregator.stats()["batches"] == 1 and aggregator.stats()["max_batch"] == 3
+
+
+def test_failing_request_leaves_the_others_alone(monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(inventory))
+    aggregator = wakinjologin.InventoryAggregator(window=0.2, max_batch=10)
+    results = submit_together(aggregator, [[line("gear", 1)], [line("bolt", 20)], [line("bolt", 2)]])
+
+    outcomes = sorted((outcome, str(payload)) for outcome, payload in results)
+    assert [outcome for outcome, _ in outcomes] == ["missing", "updates", "updates"]
+    assert "Item not found" in outcomes[0][1]
+    assert sorted(response["status"] for outcome, updates in results if outcome == "updates"
+                  for response in updates) == ["error", "✅ Success"]
+    assert "UPDATE items SET quantity = CASE id WHEN 1 THEN 8 END WHERE id IN (1)" in connection.statements
+    assert connection.commits == 1
+
+
+def test_batches_are_capped_and_leadership_is_handed_on(monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(inventory))
+    aggregator = wakinjologin.InventoryAggregator(window=0.2, max_batch=2)
+    results = submit_together(aggregator, [[line("nut", 1, "add")] for _ in range(5)])
+
+    assert all(outcome == "updates" for outcome, _ in results)
+    # The fake table doesn't keep the writes: each batch starts again from 4
+    assert sorted(updates[0]["message"].rsplit(" ", 1)[1] for _, updates in results) == ["5", "5", "5", "6", "6"]
+    assert aggregator.stats()["batches"] == 3
+    assert connection.commits == 3
+
+
+def test_unavailable_database_is_reported_to_every_caller(monkeypatch):
+    monkeypatch.setattr(wakinjologin.db_pool, "acquire", lambda *args, **kwargs: None)
+    aggregator = wakinjologin.InventoryAggregator(window=0.05, max_batch=10)
+    results = submit_together(aggregator, [[line("bolt", 1)], [line("nut", 1)]])
+    assert results == [("unavailable", None), ("unavailable", None)]
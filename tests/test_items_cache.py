@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+import pytest
+
+import wakinjologin
+from fakes import FakeConnection, is_item_lookup, item_lookup, use_connection
+
+BOLT = {"id": 1, "item_name": "bolt", "company_name": "Acme", "quantity": 10, "price_per_item": Decimal("2.50")}
+
+
+def inventory(sql):
+    if is_item_lookup(sql):
+        return item_lookup(sql, [BOLT])
+    if sql.startswith("SELECT"):
+        return [dict(BOLT)]
+    return 1
+
+
+def listings(connection):
+    return sum(sql.startswith("SELECT") for sql in connection.statements)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = wakinjologin.ItemsCache(max_entries=4)
+    monkeypatch.setattr(wakinjologin, "items_cache", cache)
+    return cache
+
+
+def test_matching_etag_gets_304_without_a_query(client, cache, monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(inventory))
+    first = client.get("/get_items")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "no-cache"
+    etag = first.headers["ETag"]
+
+    again = client.get("/get_items", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    assert again.data == b""
+    # Without the header the body comes from the cache
+    assert client.get("/get_items").get_json() == first.get_json()
+    assert listings(connection) == 1
+    assert cache.stats()["not_modified"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_each_query_has_its_own_etag(client, cache, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(inventory))
+    etag = client.get("/get_items").headers["ETag"]
+    filtered = client.get("/get_items", query_string={"company_name": "Acme"}, headers={"If-None-Match": etag})
+    assert filtered.status_code == 200
+    assert filtered.headers["ETag"] != etag
+
+
+def test_inventory_write_invalidates_the_cache(client, cache, monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(inventory))
+    etag = client.get("/get_items").headers["ETag"]
+
+    response = client.post("/update_inventory", json={"items": [
+        {"item_name": "bolt", "company_name": "Acme", "quantity": 3, "type": "subtract"},
+    ]})
+    assert response.status_code == 200
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["entries"] == 0
+
+    after = client.get("/get_items", headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != etag
+    assert listings(connection) == 2
+
+
+def test_rejected_update_keeps_the_cache(client, cache, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(inventory))
+    etag = client.get("/get_items").headers["ETag"]
+    response = client.post("/update_inventory", json={"items": [
+        {"item_name": "gear", "company_name": "Acme", "quantity": 1, "type": "add"},
+    ]})
+    assert response.status_code == 404
+    assert client.get("/get_items", headers={"If-None-Match": etag}).status_code == 304
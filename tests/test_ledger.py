@@ -0,0 +1,153 @@
+import datetime
+from decimal import Decimal
+
+import ledger
+
+DAY1 = datetime.date(2024, 3, 1)
+DAY2 = datetime.date(2024, 3, 2)
+
+
+# The ledger tables in memory, answering the statements refresh_snapshots()
+# issues (matched by their text, parameters taken as given)
+class LedgerDatabase:
+    def __init__(self):
+        self.movements = []
+        self.item_daily = {}  # (item id, day) -> row
+        self.company_daily = {}  # (company key, day) -> row
+        self.commits = 0
+
+    def cursor(self):
+        return LedgerCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def add(self, movement_id, item_id, company_name, delta, quantity_after, price, day):
+        self.movements.append({
+            "id": movement_id, "item_id": item_id, "company_name": company_name, "delta": delta,
+            "quantity_after": quantity_after, "price_per_item": Decimal(price), "day": day, "folded": 0,
+        })
+
+    def company(self, company_name):
+        return {day: (row["quantity_in"], row["quantity_out"], row["closing_quantity"], row["closing_value"])
+                for (key, day), row in sorted(self.company_daily.items()) if key == company_name.lower()}
+
+
+class LedgerCursor:
+    def __init__(self, database):
+        self.db = database
+        self.rows = []
+
+    def close(self):
+        pass
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    @staticmethod
+    def _latest(table, key, keys, before):
+        latest = {}
+        for row in table.values():
+            if row[key] in keys and (before is None or row["day"] < before):
+                if row[key] not in latest or row["day"] > latest[row[key]]["day"]:
+                    latest[row[key]] = row
+        return list(latest.values())
+
+    def execute(self, sql, params=()):
+        params = list(params)
+        self.rows = []
+        if "FROM snapshot_watermarks" in sql or sql.startswith(("INSERT IGNORE", "UPDATE snapshot_watermarks")):
+            self.rows = [{"last_movement_id": 0}]
+        elif "FROM inventory_movements WHERE folded = 0" in sql:
+            unfolded = [dict(movement) for movement in self.db.movements if not movement["folded"]]
+            self.rows = sorted(unfolded, key=lambda movement: movement["id"])[:params[0]]
+        elif sql.startswith("UPDATE inventory_movements SET folded = 1"):
+            for movement in self.db.movements:
+                if movement["id"] in params:
+                    movement["folded"] = 1
+        elif "FROM inventory_item_daily WHERE item_id IN" in sql:
+            before = params.pop() if "day <" in sql else None
+            self.rows = self._latest(self.db.item_daily, "item_id", set(params), before)
+        elif "FROM inventory_company_daily WHERE company_name IN" in sql and "MAX(day)" in sql:
+            before = params.pop() if "day <" in sql else None
+            keys = {company.lower() for company in params}
+            rows = self._latest({k: dict(r, key=k[0]) for k, r in self.db.company_daily.items()},
+                                "key", keys, before)
+            self.rows = rows
+        elif "FROM inventory_company_daily WHERE company_name IN" in sql:
+            first_day = params.pop()
+            keys = {company.lower() for company in params}
+            self.rows = [dict(row) for (key, day), row in self.db.company_daily.items()
+                         if key in keys and day >= first_day]
+        else:
+            raise AssertionError(f"unexpected statement: {sql}")
+
+    def executemany(self, sql, rows):
+        for row in rows:
+            if sql.startswith("INSERT INTO inventory_item_daily"):
+                item_id, day, company, quantity_in, quantity_out, quantity, value = row
+                current = self.db.item_daily.get((item_id, day))
+                if current is not None:
+                    quantity_in += current["quantity_in"]
+                    quantity_out += current["quantity_out"]
+                self.db.item_daily[(item_id, day)] = {
+                    "item_id": item_id, "day": day, "company_name": company, "quantity_in": quantity_in,
+                    "quantity_out": quantity_out, "closing_quantity": quantity, "closing_value": value}
+            elif sql.startswith("INSERT INTO inventory_company_daily"):
+                company, day, quantity_in, quantity_out, quantity, value = row
+                self.db.company_daily[(company.lower(), day)] = {
+                    "company_name": company, "day": day, "quantity_in": quantity_in,
+                    "quantity_out": quantity_out, "closing_quantity": quantity, "closing_value": value}
+            else:
+                raise AssertionError(f"unexpected statement: {sql}")
+
+
+def add_movements(database):
+    database.add(1, 1, "Acme", 10, 10, "2.00", DAY1)
+    database.add(2, 2, "acme", 5, 5, "1.00", DAY1)
+    database.add(3, 1, "Acme", -3, 7, "2.00", DAY2)
+
+
+def test_refresh_folds_in_one_pass():
+    database = LedgerDatabase()
+    add_movements(database)
+    assert ledger.refresh_snapshots(database) == 3
+    assert database.company("Acme") == {
+        DAY1: (15, 0, 15, Decimal("25.00")),
+        DAY2: (0, 3, 12, Decimal("19.00")),
+    }
+    assert ledger.refresh_snapshots(database) == 0
+
+
+def test_movement_committed_after_later_ids_is_still_folded():
+    expected = LedgerDatabase()
+    add_movements(expected)
+    ledger.refresh_snapshots(expected)
+
+    database = LedgerDatabase()
+    add_movements(database)
+    late = database.movements.pop(1)
+    # Movement 2's transaction commits after 3 has been folded
+    assert ledger.refresh_snapshots(database) == 2
+    database.movements.insert(1, late)
+    assert ledger.refresh_snapshots(database) == 1
+
+    assert database.company("Acme") == expected.company("Acme")
+    assert database.item_daily == expected.item_daily
+
+
+def test_small_batches_match_one_batch():
+    expected = LedgerDatabase()
+    add_movements(expected)
+    ledger.refresh_snapshots(expected)
+
+    database = LedgerDatabase()
+    add_movements(database)
+    assert ledger.refresh_snapshots(database, batch_size=1) == 3
+    assert database.company("Acme") == expected.company("Acme")
@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+import re
+from decimal import Decimal
+
+import pytest
+
+import wakinjologin
+from fakes import FakeConnection, use_connection
+
+ITEMS = [
+    {"id": n, "item_name": f"item{n}", "quantity": n * 10, "company_name": "Acme", "price_per_item": Decimal("1.50")}
+    for n in range(1, 6)
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    # Pages must come from the fake table, not from another test's cache
+    monkeypatch.setattr(wakinjologin, "items_cache", wakinjologin.ItemsCache())
+
+
+# The items table, answering keyset listings: WHERE id > n, ORDER BY id, LIMIT m
+def items_table(sql):
+    if not sql.startswith("SELECT"):
+        return 1
+    after = re.search(r"\bid > (\d+)", sql)
+    limit = re.search(r"LIMIT (\d+)$", sql)
+    columns = sql[len("SELECT "):sql.index(" FROM")].split(", ")
+    rows = [row for row in ITEMS if not after or row["id"] > int(after.group(1))]
+    rows = rows[:int(limit.group(1))] if limit else rows
+    return [{column: row[column] for column in columns} for row in rows]
+
+
+def page(client, **args):
+    response = client.get("/get_items", query_string=args)
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    return [item["item_name"] for item in body["data"]], body.get("next_after")
+
+
+def test_pages_follow_the_cursor_to_the_last_page(client, monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(items_table))
+    assert page(client, limit=2) == (["item1", "item2"], 2)
+    assert page(client, limit=2, after=2) == (["item3", "item4"], 4)
+    assert page(client, limit=2, after=4) == (["item5"], None)
+    # One extra row is asked for to tell whether another page follows
+    assert connection.statements[0].endswith("ORDER BY id LIMIT 3")
+    assert "WHERE id > 2 ORDER BY id" in connection.statements[1]
+
+
+def test_page_ending_exactly_at_the_last_row_has_no_next_cursor(client, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(items_table))
+    assert page(client, limit=5) == ([f"item{n}" for n in range(1, 6)], None)
+    # A cursor past the end is an empty page, not a 404
+    assert page(client, limit=5, after=5) == ([], None)
+
+
+def test_cursor_key_is_selected_even_when_not_asked_for(client, monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(items_table))
+    response = client.get("/get_items", query_string={"limit": 2, "fields": "item_name"})
+    assert response.get_json()["data"] == [{"item_name": "item1"}, {"item_name": "item2"}]
+    assert response.get_json()["next_after"] == 2
+    assert connection.statements[0].startswith("SELECT id, item_name FROM items")
+
+
+def test_bad_listing_arguments_are_rejected(client):
+    for args in ({"limit": 0}, {"limit": "many"}, {"fields": "password"}, {"format": "xml"}):
+        assert client.get("/get_items", query_string=args).status_code == 400, args
+
+
+def test_ndjson_export_has_one_object_per_line(client, monkeypatch):
+    monkeypatch.setattr(wakinjologin, "EXPORT_CHUNK_ROWS", 2)
+    use_connection(monkeypatch, FakeConnection(items_table))
+    response = client.get("/get_items", query_string={"format": "ndjson", "fields": "id,price_per_item"})
+    assert response.mimetype == "application/x-ndjson"
+    assert response.headers["Content-Disposition"] == "attachment; filename=items.ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [{"id": n, "price_per_item": "1.50"} for n in range(1, 6)]
+
+
+def test_csv_export_has_a_header_row(client, monkeypatch):
+    monkeypatch.setattr(wakinjologin, "EXPORT_CHUNK_ROWS", 2)
+    use_connection(monkeypatch, FakeConnection(items_table))
+    response = client.get("/get_items", query_string={"format": "csv", "after": 3})
+    assert response.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows == [list(wakinjologin.ITEM_FIELDS), ["4", "item4", "40", "Acme", "1.50"],
+                    ["5", "item5", "50", "Acme", "1.50"]]
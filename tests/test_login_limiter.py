@@ -0,0 +1,91 @@
+import pytest
+
+import wakinjologin
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return wakinjologin.MemoryLimiterStore()
+    return wakinjologin.SQLiteLimiterStore(str(tmp_path / "limiter.db"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [600.0]
+    monkeypatch.setattr(wakinjologin.time, "time", lambda: now[0])
+    return now
+
+
+def test_store_counts_this_and_the_previous_window(store):
+    assert store.hit("ip:1", 10) == (1, 0)
+    assert store.hit("ip:1", 10) == (2, 0)
+    assert store.hit("ip:2", 10) == (1, 0)
+    assert store.hit("ip:1", 11) == (1, 2)
+    # A skipped window leaves nothing to carry over
+    assert store.hit("ip:1", 13) == (1, 0)
+
+
+def test_store_keeps_and_clears_failures(store):
+    assert store.get_failure("employee:alice") is None
+    store.set_failure("employee:alice", 2, 100.0, 130.0)
+    assert tuple(store.get_failure("employee:alice")) == (2, 100.0, 130.0)
+    store.clear_failure("employee:alice")
+    assert store.get_failure("employee:alice") is None
+
+
+def test_memory_store_prunes_stale_windows():
+    store = wakinjologin.MemoryLimiterStore(max_keys=2)
+    store.hit("a", 1)
+    store.hit("b", 1)
+    store.hit("c", 5)
+    assert store.hit("c", 5) == (2, 0)
+    assert len(store._windows) <= 2
+
+
+def test_user_limit_slides_over_the_previous_window(store, clock):
+    limiter = wakinjologin.LoginLimiter(store, user_limit=3, ip_limit=0, window=60)
+    assert [limiter.check("employee", "Alice", "10.0.0.1") for _ in range(3)] == [0, 0, 0]
+    assert limiter.check("employee", "alice", "10.0.0.2") == 60
+    assert limiter.check("employee", "bob", "10.0.0.1") == 0
+
+    # Halfway through the next window half of the previous count still weighs in
+    clock[0] = 690.0
+    assert limiter.check("employee", "alice", "10.0.0.1") == 0
+    assert limiter.check("employee", "alice", "10.0.0.1") == 30
+    assert limiter.stats()["limited_user"] == 2
+
+
+def test_ip_limit_is_shared_across_usernames(store, clock):
+    limiter = wakinjologin.LoginLimiter(store, user_limit=0, ip_limit=2, window=60)
+    assert limiter.check("employee", "alice", "10.0.0.1") == 0
+    assert limiter.check("admin", "bob", "10.0.0.1") == 0
+    assert limiter.check("employee", "carol", "10.0.0.1") > 0
+    assert limiter.check("employee", "carol", "10.0.0.2") == 0
+
+
+def test_lockout_doubles_and_clears_on_success(store, clock):
+    limiter = wakinjologin.LoginLimiter(store, user_limit=0, ip_limit=0, lockout_threshold=2,
+                                        lockout_base=30, lockout_max=100, lockout_reset=900)
+    limiter.failure("employee", "alice")
+    assert limiter.check("employee", "alice", "10.0.0.1") == 0
+    limiter.failure("employee", "alice")
+    assert limiter.check("employee", "alice", "10.0.0.1") == 30
+    limiter.failure("employee", "alice")
+    assert limiter.check("employee", "Alice", "10.0.0.1") == 60
+    limiter.failure("employee", "alice")
+    assert limiter.check("employee", "alice", "10.0.0.1") == 100
+    # Locks are per role
+    assert limiter.check("admin", "alice", "10.0.0.1") == 0
+
+    limiter.success("employee", "alice")
+    assert limiter.check("employee", "alice", "10.0.0.1") == 0
+
+
+def test_failures_reset_after_a_quiet_period(store, clock):
+    limiter = wakinjologin.LoginLimiter(store, user_limit=0, ip_limit=0, lockout_threshold=2,
+                                        lockout_base=30, lockout_reset=900)
+    limiter.failure("employee", "alice")
+    clock[0] += 901
+    limiter.failure("employee", "alice")
+    assert limiter.check("employee", "alice", "10.0.0.1") == 0
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pymysql
+import pytest
+
+import migrations
+import wakinjologin
+from fakes import FakeConnection, use_connection
+
+ALL_VERSIONS = [version for version, _, _ in migrations.MIGRATIONS]
+
+
+@pytest.fixture(autouse=True)
+def unchecked_schema(monkeypatch):
+    monkeypatch.setitem(wakinjologin._schema_state, "pending", None)
+
+
+def schema(applied):
+    def handler(sql):
+        if sql == "SELECT version FROM schema_migrations":
+            if applied is None:
+                raise pymysql.err.ProgrammingError(1146, "Table 'schema_migrations' doesn't exist")
+            return [{"version": version} for version in applied]
+        return [{"1": 1}]
+    return handler
+
+
+def test_healthz(client):
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "alive"
+
+
+def test_readyz_when_schema_is_current(client, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(schema(ALL_VERSIONS)))
+    response = client.get("/readyz")
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["checks"] == {"database": True, "schema": True, "warm_up": True}
+
+
+def test_readyz_reports_pending_migrations(client, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(schema(ALL_VERSIONS[:2])))
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["pending_migrations"] == ALL_VERSIONS[2:]
+
+
+def test_readyz_before_any_migration(client, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(schema(None)))
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["pending_migrations"] == ALL_VERSIONS
+
+
+def test_readyz_without_database(client, monkeypatch):
+    use_connection(monkeypatch, None)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["checks"] == {"database": False, "schema": False, "warm_up": True}
+
+
+def test_readyz_waits_for_warm_up(client, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(schema(ALL_VERSIONS)))
+    monkeypatch.setattr(wakinjologin, "PREWARM", True)
+    monkeypatch.setitem(wakinjologin._warm_state, "ready", False)
+    opened = threading.Event()
+    monkeypatch.setattr(wakinjologin.db_pool, "warm", lambda: opened.wait(5))
+
+    # The first request starts the warm-up; until it is done, not ready
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["checks"]["warm_up"] is False
+
+    opened.set()
+    deadline = time.monotonic() + 5
+    while not wakinjologin.warmed() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    response = client.get("/readyz")
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["startup"]["warmed"] is True
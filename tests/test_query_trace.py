@@ -0,0 +1,44 @@
+import pytest
+
+import wakinjologin
+
+
+@pytest.mark.parametrize("query, normalized", [
+    ("SELECT id FROM items WHERE item_name = 'bolt' AND quantity < 10",
+     "SELECT id FROM items WHERE item_name = ? AND quantity < ?"),
+    ("SELECT id FROM items WHERE item_name = 'washer\\'s' OR item_name = 'it''s'",
+     "SELECT id FROM items WHERE item_name = ? OR item_name = ?"),
+    ("SELECT id FROM items WHERE price_per_item > -2.50 AND quantity < 1e-05 AND flags = 0x1F",
+     "SELECT id FROM items WHERE price_per_item > ? AND quantity < ? AND flags = ?"),
+    # Numbers inside identifiers are left alone
+    ("SELECT t2.col1 FROM items2 AS t2 LIMIT 10", "SELECT t2.col1 FROM items2 AS t2 LIMIT ?"),
+    ("SELECT id FROM items WHERE id IN (1, 2, 3)", "SELECT id FROM items WHERE id IN (...)"),
+    ("INSERT INTO items (item_name, quantity) VALUES ('a', 1),('b', 2),('c', 3)",
+     "INSERT INTO items (item_name, quantity) VALUES (?, ?), ..."),
+    ("UPDATE items SET quantity = CASE id WHEN 1 THEN 3 WHEN 2 THEN 5 END WHERE id IN (1, 2)",
+     "UPDATE items SET quantity = CASE id WHEN ? THEN ? WHEN ? THEN ? END WHERE id IN (...)"),
+    ("SELECT  id\n  FROM items\tWHERE id = 1", "SELECT id FROM items WHERE id = ?"),
+])
+def test_normalize_statement(query, normalized):
+    assert wakinjologin.normalize_statement(query) == normalized
+
+
+def test_batches_of_any_size_normalize_alike():
+    one = wakinjologin.normalize_statement("SELECT id FROM items WHERE id IN (7)")
+    many = wakinjologin.normalize_statement("SELECT id FROM items WHERE id IN (7, 8, 9, 10)")
+    assert one == many == "SELECT id FROM items WHERE id IN (...)"
+
+
+def test_repeated_statement_is_reported_as_n_plus_one(monkeypatch):
+    monkeypatch.setattr(wakinjologin, "QUERY_TRACE_REPEAT", 3)
+    trace = wakinjologin.QueryTrace()
+    for item_id in range(3):
+        trace.record(f"SELECT quantity FROM items WHERE id = {item_id}", False, 0.01, 1)
+    trace.record("SELECT id FROM items WHERE company_name = %s", True, 0.05, 4)
+
+    summary = trace.summary()
+    assert summary["queries"] == 4
+    assert summary["n_plus_one"] == ["SELECT quantity FROM items WHERE id = ?"]
+    # Slowest statement first
+    assert [entry["count"] for entry in summary["statements"]] == [1, 3]
+    assert summary["statements"][1]["rows"] == 3
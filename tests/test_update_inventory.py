@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from fakes import FakeConnection, is_item_lookup, item_lookup, use_connection
+
+ITEMS = {
+    ("bolt", "Acme"): {"id": 1, "item_name": "bolt", "company_name": "Acme", "quantity": 10,
+                       "price_per_item": Decimal("2.50")},
+    ("nut", "Acme"): {"id": 2, "item_name": "nut", "company_name": "Acme", "quantity": 4,
+                      "price_per_item": Decimal("0.10")},
+}
+
+
+def inventory(sql):
+    if is_item_lookup(sql):
+        return item_lookup(sql, ITEMS.values())
+    return 1
+
+
+def test_update_inventory_writes_quantities_and_movements(client, monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(inventory))
+    response = client.post("/update_inventory", json={"items": [
+        {"item_name": "bolt", "company_name": "Acme", "quantity": 3, "type": "subtract"},
+        {"item_name": "nut", "company_name": "Acme", "quantity": 2, "type": "add"},
+    ]})
+
+    assert response.status_code == 200, response.get_json()
+    assert [update["status"] for update in response.get_json()["updates"]] == ["✅ Success", "✅ Success"]
+    assert connection.commits == 1
+    statements = connection.statements
+    # One statement looks up and locks both items
+    assert is_item_lookup(statements[0]) and statements[0].count(" FOR UPDATE)") == 2
+    assert statements[1] == "UPDATE items SET quantity = CASE id WHEN 1 THEN 7 WHEN 2 THEN 6 END WHERE id IN (1, 2)"
+    # Both movements go in as one multi-row INSERT
+    movements = [sql for sql in statements if sql.startswith("INSERT INTO inventory_movements")]
+    assert len(movements) == 1
+    assert "(1, 'Acme', -3, 7, 2.50, 'subtract'),(2, 'Acme', 2, 6, 0.10, 'add')" in movements[0]
+    assert any(sql.startswith("INSERT INTO company_inventory") for sql in statements)
+
+
+def test_update_inventory_rejects_unregistered_items(client, monkeypatch):
+    connection = use_connection(monkeypatch, FakeConnection(inventory))
+    response = client.post("/update_inventory", json={"items": [
+        {"item_name": "gear", "company_name": "Acme", "quantity": 1, "type": "add"},
+    ]})
+
+    assert response.status_code == 404
+    assert response.get_json()["details"][0]["error"] == "Item not found"
+    assert connection.commits == 0 and connection.rollbacks == 1
+
+
+def test_update_inventory_matches_names_like_the_collation(client, monkeypatch):
+    cafe = {"id": 3, "item_name": "Café crème", "company_name": "Acme", "quantity": 5,
+            "price_per_item": Decimal("3.00")}
+    connection = use_connection(monkeypatch, FakeConnection(
+        lambda sql: item_lookup(sql, [cafe]) if is_item_lookup(sql) else 1))
+    response = client.post("/update_inventory", json={"items": [
+        {"item_name": "cafe creme", "company_name": "ACME", "quantity": 2, "type": "subtract"},
+        {"item_name": "Café crème", "company_name": "Acme", "quantity": 1, "type": "subtract"},
+    ]})
+
+    assert response.status_code == 200, response.get_json()
+    assert [update["message"].rsplit(" ", 1)[1] for update in response.get_json()["updates"]] == ["3", "2"]
+    assert "UPDATE items SET quantity = CASE id WHEN 3 THEN 2 END WHERE id IN (3)" in connection.statements
+
+
+def test_trailing_spaces_name_another_item(client, monkeypatch):
+    use_connection(monkeypatch, FakeConnection(inventory))
+    response = client.post("/update_inventory", json={"items": [
+        {"item_name": "bolt ", "company_name": "Acme", "quantity": 1, "type": "add"},
+    ]})
+    assert response.status_code == 404
@@ -0,0 +1,103 @@
+import pytest
+
+import wakinjologin
+
+
+class TableConnection:
+    def __init__(self, usernames):
+        self.usernames = usernames
+
+    def cursor(self, cursor_class=None):
+        return TableCursor(self.usernames)
+
+
+class TableCursor:
+    def __init__(self, usernames):
+        self.usernames = usernames
+        self.rows = []
+
+    def execute(self, sql, args=None):
+        if sql.startswith("SELECT COUNT(*)"):
+            self.rows = [(len(self.usernames),)]
+        else:
+            self.rows = [(username,) for username in self.usernames]
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(wakinjologin, "SHARED_STATE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_index(table="employees", keep=600):
+    return wakinjologin.UsernameIndex(table, keep=keep)
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = wakinjologin.BloomFilter(1000, error_rate=0.01)
+    for n in range(1000):
+        bloom.add(f"user{n}")
+    assert all(f"user{n}" in bloom for n in range(1000))
+    assert sum(f"stranger{n}" in bloom for n in range(10000)) < 300
+
+
+def test_unknown_usernames_are_rejected():
+    index = make_index()
+    assert index.might_exist("anyone")  # not built yet
+    index.rebuild(TableConnection(["alice", "Ćesar"]))
+    assert index.might_exist("ALICE")
+    assert index.might_exist("cesar")
+    assert not index.might_exist("mallory")
+
+
+def test_registration_from_another_worker_is_seen():
+    index = make_index()
+    index.rebuild(TableConnection(["alice"]))
+    make_index().add("bob")
+    assert index.might_exist("bob")
+
+
+def test_registration_logged_before_a_rebuild_survives_it():
+    index = make_index()
+    table = ["alice"]
+    index.rebuild(TableConnection(table))
+    # /register logs bob, a rebuild reads the table before bob's INSERT
+    # commits, then the INSERT commits
+    index.add("bob")
+    index.rebuild(TableConnection(list(table)))
+    table.append("bob")
+    assert index.might_exist("bob")
+    # The rebuild after that one no longer needs the log entry
+    index.rebuild(TableConnection(table))
+    index.rebuild(TableConnection(table))
+    assert index.might_exist("bob")
+
+
+def test_old_log_entries_are_compacted_away(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(wakinjologin.time, "time", lambda: now[0])
+    index = make_index()
+    other = make_index()
+    other.rebuild(TableConnection(["alice"]))
+    index.add("bob")
+    now[0] += 700
+    index.add("carol")
+    index.rebuild(TableConnection(["alice", "bob"]))
+
+    assert index.stats()["compactions"] == 1
+    assert [path.name for path in tmp_path.glob("*.log")] == ["usernames.employees.1.log"]
+    assert b"bob" not in (tmp_path / "usernames.employees.1.log").read_bytes()
+    # A worker part way through the old generation reads the new one afresh
+    index.add("dave")
+    assert other.might_exist("carol") and other.might_exist("dave")
+    assert index.might_exist("bob") and index.might_exist("dave")
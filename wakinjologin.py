@@ -1,15 +1,481 @@
-from flask import Flask, request, jsonify
+# Measured from the first line, so the startup report covers the imports too
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+import click
+import io
 import pymysql
 from pymysql import Error
 from flask_cors import CORS  # Import CORS
 import bcrypt  # Import bcrypt for password hashing
-import smtplib
 from dotenv import load_dotenv
+import accounts
+import ledger
+import migrations
 import os
+import base64
+import datetime
+import bisect
+import contextvars
+import fcntl
+import functools
+import gzip
+import json
+import hashlib
+import hmac
+import math
+import re
+import stat
+import tempfile
+import threading
+import unicodedata
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from pymysql.constants import SERVER_STATUS
+from pymysql.constants.ER import DUP_ENTRY as ER_DUP_ENTRY
+
+# Optional speedups: orjson for JSON, brotli as a second content encoding
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 load_dotenv()
-# Your Flask app code here
-wakinjologin = Flask(__name__)
-CORS(wakinjologin)
+# Routes, hooks and CLI commands are registered on this blueprint;
+# create_app() at the bottom builds the Flask app around it
+api = Blueprint("wakinjologin", __name__, cli_group=None)
+
+# Threads each worker process runs: (name, target, args), started by
+# start_background_tasks() rather than at import, so the gunicorn master
+# never holds a lock a forked worker would inherit
+BACKGROUND_TASKS = []
+
+# Request-level metrics, rendered in the Prometheus text format at /metrics.
+# Counters and histograms live in plain dicts behind one short lock, so a
+# request pays a few dict updates. Under gunicorn set METRICS_DIR: every
+# worker then writes a snapshot there at most every METRICS_FLUSH_INTERVAL
+# seconds and /metrics merges the snapshots of all workers.
+class Metrics:
+    PREFIX = "wakinjologin_"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> per-bucket counts (last one is +Inf), then the sum
+        self._last_flush = 0.0
+        self.gauges = lambda: {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(values)] for (name, labels), values in self._histograms.items()]
+        return {"pid": os.getpid(), "counters": counters, "histograms": histograms, "gauges": self.gauges()}
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def maybe_flush(self):
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith("metrics-") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [tuple(pair) for pair in labels] + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    # Merge every worker's snapshot: counters and histograms are summed,
+    # gauges are reported per live worker with a pid label
+    def render(self):
+        counters = {}
+        histograms = {}
+        gauges = {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    merged[index] += value
+            if snapshot["pid"] == os.getpid() or pid_alive(snapshot["pid"]):
+                for name, value in snapshot["gauges"].items():
+                    gauges[(name, (("pid", str(snapshot["pid"])),))] = value
+
+        lines = []
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            typed = set()
+            for (name, labels), value in sorted(series.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {self.PREFIX}{name} {kind}")
+                    typed.add(name)
+                lines.append(f"{self.PREFIX}{name}{self._labels(labels)} {value}")
+        typed = set()
+        for (name, labels), values in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {self.PREFIX}{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f"{self.PREFIX}{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.PREFIX}{name}_sum{self._labels(labels)} {values[-1]}")
+            lines.append(f"{self.PREFIX}{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+metrics = Metrics(
+    directory=os.getenv("METRICS_DIR"),
+    flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", 1)),
+)
+
+
+# Kind of SQL statement (SELECT, INSERT, ...) for metric labels
+def statement_kind(query):
+    query = query.lstrip()
+    while query.startswith("/*"):
+        query = query[query.find("*/") + 2:].lstrip()
+    kind = query.split(None, 1)[0].upper() if query else ""
+    return kind if kind in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+
+# Name from a leading /* q:<name> */ tag, for profiling a statement by name
+def query_tag(query):
+    query = query.lstrip()
+    if query.startswith("/* q:"):
+        return query[5:query.find("*/")].strip()
+    start = query.find("/* q:")
+    if 0 < start < 16:
+        return query[start + 5:query.find("*/", start)].strip()
+    return "untagged"
+
+
+# Metric labels of a statement. The kind and the tag sit at the start, so
+# only the head of a long or binary statement is looked at.
+def statement_labels(query):
+    query = query[:256]
+    if not isinstance(query, str):
+        query = bytes(query).decode("utf-8", "replace")
+    return (("statement", statement_kind(query)), ("query", query_tag(query)))
+
+
+# Cached for parameterized statements only: their text is a fixed template,
+# while a statement with its values filled in is new every time
+query_labels = functools.lru_cache(maxsize=1024)(statement_labels)
+
+
+# Per-request query tracing, off unless QUERY_TRACE=1. Every statement a
+# request runs through a timed cursor is recorded; requests slower than
+# QUERY_TRACE_SLOW_MS, issuing more than QUERY_TRACE_MAX_QUERIES statements
+# or repeating one statement QUERY_TRACE_REPEAT times (an N+1 loop) are
+# logged and kept for /debug/queries. Traced responses carry a short
+# X-Query-Trace summary header. The traces hold SQL text, so serving them
+# at /debug/queries needs DEBUG_QUERIES=1 too, plus an admin token.
+QUERY_TRACE = os.getenv("QUERY_TRACE") == "1"
+DEBUG_QUERIES = os.getenv("DEBUG_QUERIES") == "1"
+QUERY_TRACE_SLOW_MS = float(os.getenv("QUERY_TRACE_SLOW_MS", 500))
+QUERY_TRACE_MAX_QUERIES = int(os.getenv("QUERY_TRACE_MAX_QUERIES", 50))
+QUERY_TRACE_REPEAT = int(os.getenv("QUERY_TRACE_REPEAT", 5))
+
+_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_SQL_NUMBER = re.compile(r"(?<![\w.])(?:0x[0-9a-f]+|-?\d+(?:\.\d+)?(?:e[+-]?\d+)?)\b", re.IGNORECASE)
+_SQL_IN_LIST = re.compile(r"\bIN\s*\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)", re.IGNORECASE)
+_SQL_ROW_LIST = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+
+
+# Statement text with literals replaced by ?, and IN lists and multi-row
+# VALUES collapsed, so the same statement with other values (or a bulk
+# insert of another size) normalizes to the same text
+def normalize_statement(query):
+    query = _SQL_STRING.sub("?", query)
+    query = _SQL_NUMBER.sub("?", query)
+    query = _SQL_IN_LIST.sub("IN (...)", query)
+    query = _SQL_ROW_LIST.sub(r"\1, ...", query)
+    return " ".join(query.split())
+
+
+# Parameterized statements are fixed strings, so they are worth caching
+normalize_template = functools.lru_cache(maxsize=1024)(normalize_statement)
+
+
+# Statements run by one request. Normalization is left to summary(), so
+# recording a statement costs an append.
+class QueryTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._queries = []  # (query, parameterized, seconds, rows)
+
+    def record(self, query, parameterized, seconds, rows):
+        self._queries.append((query, parameterized, seconds, rows))
+
+    def summary(self):
+        statements = {}
+        for query, parameterized, seconds, rows in self._queries:
+            text = normalize_template(query) if parameterized else normalize_statement(query)
+            entry = statements.setdefault(text, {"statement": text, "count": 0, "seconds": 0.0, "rows": 0})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            # Unbuffered cursors don't know their row count
+            if rows is not None and 0 <= rows < 2 ** 63:
+                entry["rows"] += rows
+        ordered = sorted(statements.values(), key=lambda entry: entry["seconds"], reverse=True)
+        return {
+            "queries": len(self._queries),
+            "query_seconds": sum(query[2] for query in self._queries),
+            "seconds": time.perf_counter() - self.started,
+            "n_plus_one": [entry["statement"] for entry in ordered if entry["count"] >= QUERY_TRACE_REPEAT],
+            "statements": ordered,
+        }
+
+
+# Trace of the request being handled in this thread (or asyncio task)
+current_trace = contextvars.ContextVar("query_trace", default=None)
+
+
+# Flagged request traces of this worker, newest last
+class QueryTraceLog:
+    def __init__(self, keep=100):
+        self._traces = deque(maxlen=keep)
+        self._counters = {"traced": 0, "slow": 0, "too_many_queries": 0, "n_plus_one": 0}
+        self._lock = threading.Lock()
+
+    # Summarize a finished trace, log and keep it if anything stands out,
+    # and return the value for the X-Query-Trace header
+    def finish(self, trace, method, route, status):
+        summary = trace.summary()
+        reasons = []
+        if summary["seconds"] * 1000 >= QUERY_TRACE_SLOW_MS:
+            reasons.append("slow")
+        if summary["queries"] > QUERY_TRACE_MAX_QUERIES:
+            reasons.append("too_many_queries")
+        if summary["n_plus_one"]:
+            reasons.append("n_plus_one")
+        with self._lock:
+            self._counters["traced"] += 1
+            for reason in reasons:
+                self._counters[reason] += 1
+            if reasons:
+                self._traces.append({"method": method, "route": route, "status": status, "pid": os.getpid(),
+                                     "time": time.time(), "reasons": reasons, **summary})
+        if reasons:
+            for reason in reasons:
+                metrics.inc("query_trace_flagged_total", (("route", route), ("reason", reason)))
+            print(f"Query trace {method} {route} ({', '.join(reasons)}): {summary['queries']} queries, "
+                  f"{summary['query_seconds'] * 1000:.1f} of {summary['seconds'] * 1000:.1f} ms in MySQL")
+            for statement in summary["n_plus_one"]:
+                print(f"  N+1 candidate: {statement}")
+        return (f"queries={summary['queries']}; db_ms={summary['query_seconds'] * 1000:.1f}; "
+                f"n_plus_one={len(summary['n_plus_one'])}")
+
+    def recent(self, limit=None):
+        with self._lock:
+            traces = list(self._traces)
+        return traces[-limit:] if limit else traces
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["kept"] = len(self._traces)
+        return stats
+
+
+query_traces = QueryTraceLog(keep=int(os.getenv("QUERY_TRACE_KEEP", 100)))
+
+
+# Observe one statement run by a timed cursor and, when tracing, add it to
+# the request's trace
+def record_statement(cursor, query, parameterized, elapsed):
+    metrics.observe("db_query_seconds", elapsed,
+                    query_labels(query) if parameterized else statement_labels(query))
+    if QUERY_TRACE:
+        trace = current_trace.get()
+        if trace is not None:
+            trace.record(query, parameterized, elapsed, cursor.rowcount)
+
+
+# Times every statement. executemany() is observed once, under its template:
+# PyMySQL runs it through execute(), for multi-row INSERTs with the expanded
+# statement as a bytearray, and those inner calls are not observed again.
+class TimedCursorMixin:
+    _in_batch = False
+
+    def execute(self, query, args=None):
+        if self._in_batch:
+            return super().execute(query, args)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            record_statement(self, query, args is not None, time.perf_counter() - started)
+
+    def executemany(self, query, args):
+        started = time.perf_counter()
+        self._in_batch = True
+        try:
+            return super().executemany(query, args)
+        finally:
+            self._in_batch = False
+            record_statement(self, query, True, time.perf_counter() - started)
+
+
+class TimedDictCursor(TimedCursorMixin, pymysql.cursors.DictCursor):
+    pass
+
+
+# Tuple rows, for narrow queries that don't need a dict per row
+class TimedCursor(TimedCursorMixin, pymysql.cursors.Cursor):
+    pass
+
+
+# JSON_ENCODER=json keeps the stdlib encoder even when orjson is installed
+FAST_JSON = orjson is not None and os.getenv("JSON_ENCODER", "orjson") == "orjson"
+if FAST_JSON:
+    # Dates go through Flask's default (HTTP dates), as with the stdlib encoder
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+# Compact, key-sorted JSON as bytes. Anything orjson can't encode natively
+# (Decimal prices, dates) goes through Flask's default, which turns a Decimal
+# into its exact string, e.g. "12.50".
+def json_bytes(obj):
+    if FAST_JSON:
+        try:
+            return orjson.dumps(obj, default=DefaultJSONProvider.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles
+            pass
+    return json.dumps(obj, default=DefaultJSONProvider.default, sort_keys=True,
+                      separators=(",", ":")).encode("utf-8")
+
+
+# JSON provider for both apps: encodes with orjson when available and times
+# response serialization. Pretty-printed output (debug mode) and calls with
+# extra json.dumps() arguments keep the stdlib path.
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if FAST_JSON and not kwargs:
+            return json_bytes(obj).decode("utf-8")
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if FAST_JSON and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            if not FAST_JSON or self.compact is False or (self.compact is None and self._app.debug):
+                return super().response(*args, **kwargs)
+            body = json_bytes(self._prepare_response_obj(args, kwargs)) + b"\n"
+            return self._app.response_class(body, mimetype=self.mimetype)
+        finally:
+            metrics.observe("json_serialize_seconds", time.perf_counter() - started)
+
+
+# Response compression: bodies of at least COMPRESS_MIN_BYTES are sent gzip-
+# or brotli-encoded when the client accepts it. A negative value disables it.
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+COMPRESSIBLE_MIMETYPES = frozenset(["application/json", "application/x-ndjson", "text/csv", "text/plain"])
+# In order of preference when the client accepts several equally
+CONTENT_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+# Encoding to send a body of the given size in, or None for identity.
+# accept_encodings is the request's parsed Accept-Encoding header.
+def negotiate_encoding(accept_encodings, size):
+    if COMPRESS_MIN_BYTES < 0 or size is None or size < COMPRESS_MIN_BYTES:
+        return None
+    return accept_encodings.best_match(CONTENT_ENCODINGS)
+
+
+def compress(body, encoding):
+    started = time.perf_counter()
+    if encoding == "br":
+        data = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        # Fixed mtime, so the same body always compresses to the same bytes
+        data = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    metrics.observe("compress_seconds", time.perf_counter() - started, (("encoding", encoding),))
+    return data
+
+
+# Whether an outgoing response is a candidate for compression at all
+def compressible(response):
+    return (response.mimetype in COMPRESSIBLE_MIMETYPES
+            and "Content-Encoding" not in response.headers
+            and response.status_code not in (204, 206, 304))
+
+
+# The compressed bytes are a different representation, so a strong ETag
+# becomes weak (clients revalidate with weak comparison either way)
+def weaken_etag(response):
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
 
 # MySQL connection details using PyMySQL
 def get_db_connection():
@@ -21,29 +487,1658 @@ def get_db_connection():
         user=os.getenv("user"),
         password=os.getenv("password"),
         database=os.getenv("database"),
+        port=int(os.getenv("port", 3306)),
             
             charset='utf8mb4',      # Charset set to utf8mb4 for better support
-            cursorclass=pymysql.cursors.DictCursor  # Optional, returns results as dictionaries
+            cursorclass=TimedDictCursor  # Optional, returns results as dictionaries
         )
         return connection
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
+        metrics.inc("errors_total", (("kind", "db_connect"),))
         return None
 
+
+# Bounded, thread-safe pool of MySQL connections shared by all routes.
+# Connections are opened lazily up to max_size, checked out with a timeout,
+# pinged when they have sat idle for a while and recycled once they get old.
+# Each gunicorn worker process gets its own pool (the pid is checked on use,
+# so connections inherited through fork() are never shared).
+class ConnectionPool:
+    def __init__(self, connect, min_size=1, max_size=10, timeout=5.0, recycle=3600, ping_interval=30):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = deque()  # (connection, idle_since) pairs, most recently used last
+        self._opened_at = {}  # id(connection) -> time the connection was opened
+        self._size = 0  # open connections, idle + in use (+ being opened)
+        self._in_use = 0
+        self._counters = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "connect_failures": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+        }
+
+    def _check_pid(self):
+        # After a fork the child must not touch the parent's sockets, just forget them
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _open(self):
+        started = time.perf_counter()
+        connection = self._connect()
+        metrics.observe("db_connect_seconds", time.perf_counter() - started)
+        with self._cond:
+            if connection:
+                self._counters["connects"] += 1
+                self._opened_at[id(connection)] = time.monotonic()
+            else:
+                self._counters["connect_failures"] += 1
+        return connection
+
+    def _close(self, connection):
+        self._opened_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _validate(self, connection, idle_since):
+        # Runs outside the lock: a ping is a network round trip
+        now = time.monotonic()
+        opened_at = self._opened_at.get(id(connection), now)
+        if self.recycle and now - opened_at > self.recycle:
+            failure = "recycled"
+        elif self.ping_interval is not None and now - idle_since > self.ping_interval:
+            try:
+                connection.ping(reconnect=False)
+                return True
+            except Exception:
+                failure = "ping_failures"
+        else:
+            return True
+        self._close(connection)
+        with self._cond:
+            self._counters[failure] += 1
+        return False
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        with self._cond:
+            self._check_pid()
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    print(f"Timed out after {timeout}s waiting for a MySQL connection")
+                    return None
+                waited = True
+                self._cond.wait(remaining)
+            entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                self._size += 1  # reserve the slot before connecting outside the lock
+            self._in_use += 1
+            self._counters["checkouts"] += 1
+            if waited:
+                wait_time = time.monotonic() - started
+                self._counters["waits"] += 1
+                self._counters["wait_time_total"] += wait_time
+                self._counters["wait_time_max"] = max(self._counters["wait_time_max"], wait_time)
+
+        connection = None
+        if entry is not None and self._validate(*entry):
+            connection = entry[0]
+        if connection is None:
+            connection = self._open()
+        if connection is None:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+        return connection
+
+    def release(self, connection, discard=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+        if not discard:
+            try:
+                # Never hand the next request an open transaction (or its stale snapshot)
+                if connection.open and connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                    connection.rollback()
+            except Exception:
+                discard = True
+            if not connection.open:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._close(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def warm(self):
+        # Open connections up to min_size so the first requests skip the handshake
+        while True:
+            with self._cond:
+                self._check_pid()
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            connection = self._open()
+            with self._cond:
+                if connection is None:
+                    self._size -= 1
+                    return
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            self._check_pid()
+            stats = dict(self._counters)
+            stats.update({
+                "pid": self._pid,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+
+# The process's ConnectionPool, built by init_resources()
+db_pool = None
+
+
+# Check a connection out of the pool for the duration of a with-block.
+# Yields None when no connection could be obtained, so routes keep their
+# "Database connection failed" branch. The connection always goes back to
+# the pool; if the block raised a database error, it is closed instead.
+@contextmanager
+def db_connection():
+    connection = db_pool.acquire()
+    try:
+        yield connection
+    except BaseException as e:
+        # Database errors (and aborts like GeneratorExit) may leave the
+        # connection mid-result, so don't reuse it
+        if connection and (isinstance(e, Error) or not isinstance(e, Exception)):
+            db_pool.release(connection, discard=True)
+            connection = None
+        raise
+    finally:
+        if connection:
+            db_pool.release(connection)
+
+
+# Stats reported by /stats, by name. Each provider returns a JSON-able dict.
+STATS_PROVIDERS = {}
+
+# Directory for small state files shared by the worker processes on this
+# host. The token secret lives there, so it is created 0700 and refused if
+# it (or a symlink in its place) belongs to another user or others can
+# write to it: the default under /tmp is a predictable name.
+def shared_state_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    for info in (os.lstat(path), os.stat(path)):
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f"SHARED_STATE_DIR {path} is owned by another user")
+    if not stat.S_ISDIR(os.stat(path).st_mode) or os.stat(path).st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError(f"SHARED_STATE_DIR {path} must be a directory only its owner can write to")
+    return path
+
+
+SHARED_STATE_DIR = shared_state_dir(
+    os.getenv("SHARED_STATE_DIR", os.path.join(tempfile.gettempdir(), "wakinjologin")))
+
+
+# Integer counter in a file shared by all worker processes on the host. Used
+# as a generation number: bump() after a write, compare value() before
+# trusting anything cached in-process.
+class SharedCounter:
+    WIDTH = 20  # fixed width, so a concurrent reader never sees a half-written number
+
+    def __init__(self, name):
+        self.path = os.path.join(SHARED_STATE_DIR, name)
+
+    def value(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return int(f.read(self.WIDTH) or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                value = int(os.pread(fd, self.WIDTH, 0) or 0) + 1
+            except ValueError:
+                value = 1
+            os.pwrite(fd, str(value).zfill(self.WIDTH).encode(), 0)
+            return value
+        finally:
+            os.close(fd)
+
+
+# Username as MySQL's default collations compare it: case-insensitive,
+# trailing spaces ignored
+def username_key(username):
+    return str(username).rstrip(' ').lower()
+
+
+# Remembers recently verified (username, password) pairs so repeated
+# /check_user_exists polls and logins skip both the lookup and bcrypt.
+# Passwords are only kept as an HMAC digest under a per-process key. Entries
+# expire after ttl seconds and are dropped as soon as the user changes; a
+# shared generation counter carries that invalidation to the other workers.
+class CredentialCache:
+    def __init__(self, max_size=10000, ttl=60, secret=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._secret = secret or os.urandom(32)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (role, folded username) -> (username, digest, expires_at)
+        self._generation = SharedCounter("credentials.generation")
+        self._seen_generation = self._generation.value()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _digest(self, password):
+        return hmac.new(self._secret, password.encode('utf-8'), hashlib.sha256).digest()
+
+    @staticmethod
+    def _key(role, username):
+        return role, username_key(username)
+
+    def _sync(self):
+        generation = self._generation.value()
+        if generation != self._seen_generation:
+            self._entries.clear()
+            self._seen_generation = generation
+
+    def lookup(self, role, username, password):
+        if not self.ttl:
+            return False
+        digest = self._digest(password)
+        key = self._key(role, username)
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry and entry[0] == username and entry[2] > time.monotonic() and hmac.compare_digest(entry[1], digest):
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return True
+            if entry and entry[2] <= time.monotonic():
+                del self._entries[key]
+            self._counters["misses"] += 1
+            return False
+
+    def remember(self, role, username, password):
+        if not self.ttl:
+            return
+        digest = self._digest(password)
+        key = self._key(role, username)
+        with self._lock:
+            self._sync()
+            self._entries[key] = (username, digest, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, role, username):
+        self.invalidate_many(role, [username])
+
+    def invalidate_many(self, role, usernames):
+        if not usernames:
+            return
+        with self._lock:
+            for username in usernames:
+                self._entries.pop(self._key(role, username), None)
+            self._counters["invalidations"] += len(usernames)
+        self._generation.bump()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl})
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+credential_cache = CredentialCache(
+    max_size=int(os.getenv("CREDENTIAL_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("CREDENTIAL_CACHE_TTL", 60)),
+)
+STATS_PROVIDERS["credential_cache"] = credential_cache.stats
+
+
+# Bloom filter over folded strings: no false negatives, false positives at
+# roughly error_rate once capacity keys are in
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    # Double hashing over one 128-bit digest
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+# In-process membership filter for the usernames of one table, so unknown
+# usernames (typos, bots) get their 404 without a query. Built from the
+# table in the background and rebuilt every USERNAME_INDEX_RECONCILE
+# seconds, which also catches rows changed outside the app and drops
+# deleted users. Usernames about to be inserted are appended to a shared
+# log in SHARED_STATE_DIR that every worker replays before answering, so a
+# fresh registration is never reported missing. Entries older than keep
+# seconds, which every worker has rebuilt from the table since, are
+# compacted into a new log generation. Only workers sharing SHARED_STATE_DIR
+# see each other's log, so USERNAME_INDEX is off by default: turn it on for
+# a single host, or when SHARED_STATE_DIR is on storage every host shares.
+class UsernameIndex:
+    def __init__(self, table, enabled=True, error_rate=0.01, keep=600):
+        self.table = table
+        self.enabled = enabled
+        self.error_rate = error_rate
+        self.keep = keep
+        self.path = os.path.join(SHARED_STATE_DIR, f"usernames.{table}")
+        self._generation = SharedCounter(f"usernames.{table}.generation")
+        self._lock = threading.Lock()
+        self._filter = None  # None until the first build
+        self._log = (None, 0)  # (generation, offset): how much of the log is in the filter
+        self._counters = {"definite_misses": 0, "maybe_present": 0, "not_ready": 0, "rebuilds": 0,
+                          "compactions": 0}
+
+    def _log_path(self, generation):
+        return f"{self.path}.{generation}.log"
+
+    # Appends take the lock file shared and compaction takes it exclusively,
+    # so nothing is appended to a generation that is being replaced
+    def _locked(self, operation):
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, operation)
+        return fd
+
+    # Record usernames before inserting them; a failed insert only leaves a
+    # false positive behind
+    def add(self, *usernames):
+        if not self.enabled or not usernames:
+            return
+        now = time.time()
+        data = "".join(json.dumps([now, str(username)]) + "\n" for username in usernames).encode('utf-8')
+        lock = self._locked(fcntl.LOCK_SH)
+        try:
+            fd = os.open(self._log_path(self._generation.value()), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        finally:
+            os.close(lock)
+
+    # Folded further than username_key(): the default collations also treat
+    # accented letters as equal, and folding too much only costs a lookup
+    @staticmethod
+    def _key(username):
+        decomposed = unicodedata.normalize('NFKD', username_key(username).casefold())
+        return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+    # Replay log lines appended since the last look (caller holds the lock).
+    # A new generation is read from the start; if it is compacted away while
+    # being read, the one after it is.
+    def _catch_up(self):
+        for _ in range(3):
+            generation = self._generation.value()
+            offset = self._log[1] if self._log[0] == generation else 0
+            try:
+                with open(self._log_path(generation), 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                if generation != self._generation.value():
+                    continue
+                data = b""
+            end = data.rfind(b"\n") + 1  # leave a line still being written for next time
+            for line in data[:end].splitlines():
+                self._filter.add(self._key(json.loads(line)[1]))
+            self._log = (generation, offset + end)
+            return
+
+    # False only when the username is definitely not in the table
+    def might_exist(self, username):
+        with self._lock:
+            if self._filter is None:
+                self._counters["not_ready"] += 1
+                return True
+            self._catch_up()
+            present = self._key(username) in self._filter
+            self._counters["maybe_present" if present else "definite_misses"] += 1
+            return present
+
+    # Build a new filter from the table, then replay the whole log on top
+    # of it: a username logged just before this rebuild may commit only
+    # after the table read. Replaying too much only adds false positives.
+    def rebuild(self, connection):
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(f"SELECT COUNT(*) FROM {self.table}")
+            (count,) = cursor.fetchone()
+            bloom = BloomFilter(max(count * 2, 1024), self.error_rate)
+            cursor.execute(f"SELECT username FROM {self.table}")
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for (username,) in rows:
+                    bloom.add(self._key(username))
+        finally:
+            cursor.close()
+        with self._lock:
+            self._filter = bloom
+            self._log = (None, 0)
+            self._catch_up()
+            self._counters["rebuilds"] += 1
+        self.compact()
+
+    # Move the entries younger than keep seconds into the next generation,
+    # so the log doesn't grow forever and a new worker doesn't replay all of it
+    def compact(self):
+        cutoff = time.time() - self.keep
+        lock = self._locked(fcntl.LOCK_EX)
+        try:
+            generation = self._generation.value()
+            try:
+                with open(self._log_path(generation), 'rb') as f:
+                    lines = f.read().splitlines(keepends=True)
+            except FileNotFoundError:
+                return
+            if not lines or json.loads(lines[0])[0] >= cutoff:
+                return
+            with open(self._log_path(generation + 1), 'wb') as f:
+                f.writelines(line for line in lines if json.loads(line)[0] >= cutoff)
+            self._generation.bump()
+            os.unlink(self._log_path(generation))
+        finally:
+            os.close(lock)
+        with self._lock:
+            self._counters["compactions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["ready"] = self._filter is not None
+            if self._filter is not None:
+                stats["size_bytes"] = len(self._filter.bits)
+        return stats
+
+
+USERNAME_INDEX = os.getenv("USERNAME_INDEX", "0") == "1"
+USERNAME_INDEX_RECONCILE = float(os.getenv("USERNAME_INDEX_RECONCILE", 300))
+username_indexes = None  # table -> UsernameIndex, built by init_resources()
+
+
+# Build the username filters, then rebuild them every interval seconds
+def maintain_username_indexes(interval):
+    while True:
+        with db_connection() as connection:
+            if connection:
+                for index in username_indexes.values():
+                    try:
+                        index.rebuild(connection)
+                    except (Error, OSError) as e:
+                        print(f"Username index rebuild for {index.table} failed: {e}")
+        time.sleep(interval)
+
+
+
+# bcrypt cost factor used for new hashes
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+
+# bcrypt work functions, kept at module level so a process pool can pickle them
+def _bcrypt_hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _bcrypt_check(password, hashed_password):
+    return bcrypt.checkpw(password, hashed_password)
+
+
+# Raised when the hashing pool is saturated; answered with 503 + Retry-After
+class HashingBusy(Exception):
+    pass
+
+
+# Dedicated executor for bcrypt work so a login storm can't pin every request
+# thread. bcrypt releases the GIL, so threads scale with cores; a process pool
+# can be selected instead. At most workers + queue_size jobs are admitted at
+# once, anything beyond that fails fast with HashingBusy.
+class HashingPool:
+    def __init__(self, workers=4, queue_size=16, kind="thread", retry_after=1):
+        self.workers = max(workers, 1)
+        self.queue_size = max(queue_size, 0)
+        self.kind = kind
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                if self.kind == "process":
+                    from concurrent.futures import ProcessPoolExecutor as executor_class
+                else:
+                    executor_class = ThreadPoolExecutor
+                self._executor = executor_class(max_workers=self.workers)
+                self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+                # Bulk work never holds every worker, so interactive hashing
+                # always has one to run on
+                self._bulk_slots = threading.BoundedSemaphore(max(self.workers - 1, 1))
+                self._pid = os.getpid()
+                self._counters = {"submitted": 0, "completed": 0, "rejected": 0, "busy_time_total": 0.0}
+            return self._executor
+
+    # Start fn(*args) and return its concurrent.futures.Future, or raise
+    # HashingBusy straight away when the pool is saturated
+    def submit(self, fn, *args):
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise HashingBusy()
+        started = time.monotonic()
+
+        def done(future):
+            slots.release()
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._counters["completed"] += 1
+                self._counters["busy_time_total"] += elapsed
+            metrics.observe("bcrypt_seconds", elapsed, (("op", fn.__name__.rsplit("_", 1)[-1]),))
+
+        with self._lock:
+            self._counters["submitted"] += 1
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            done(None)
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    # Run fn over many argument tuples in parallel. Unlike run(), waits for a
+    # free slot instead of failing fast, so a bulk job queues behind
+    # interactive work rather than being rejected; it only gives up when no
+    # slot has come free for timeout seconds. At most workers - 1 bulk calls
+    # (of all map() calls together) are in flight at a time, which keeps a
+    # worker and the queue free for submit().
+    def map(self, fn, arg_tuples, timeout=30):
+        executor = self._get_executor()
+        slots = self._slots
+        bulk_slots = self._bulk_slots
+        progress = [time.monotonic()]  # when this call last got a slot or finished a call
+
+        op = (("op", fn.__name__.rsplit("_", 1)[-1]),)
+
+        def on_done(started):
+            def done(future):
+                slots.release()
+                bulk_slots.release()
+                progress[0] = time.monotonic()
+                with self._lock:
+                    self._counters["completed"] += 1
+                metrics.observe("bcrypt_seconds", time.monotonic() - started, op)
+            return done
+
+        futures = []
+        try:
+            for args in arg_tuples:
+                if not self._acquire_bulk(slots, bulk_slots, progress, timeout):
+                    with self._lock:
+                        self._counters["rejected"] += 1
+                    raise HashingBusy()
+                progress[0] = time.monotonic()
+                with self._lock:
+                    self._counters["submitted"] += 1
+                started = time.monotonic()
+                try:
+                    future = executor.submit(fn, *args)
+                except BaseException:
+                    on_done(started)(None)
+                    raise
+                future.add_done_callback(on_done(started))
+                futures.append(future)
+            return [future.result() for future in futures]
+        except BaseException:
+            # Don't spend CPU on results nobody will read
+            for future in futures:
+                future.cancel()
+            raise
+
+    # A bulk slot and a pool slot, giving up once neither this call nor a
+    # slot has moved on for timeout seconds
+    @staticmethod
+    def _acquire_bulk(slots, bulk_slots, progress, timeout):
+        for semaphore in (bulk_slots, slots):
+            while not semaphore.acquire(timeout=max(progress[0] + timeout - time.monotonic(), 0)):
+                if time.monotonic() - progress[0] >= timeout:
+                    if semaphore is slots:
+                        bulk_slots.release()
+                    return False
+        return True
+
+    def stats(self):
+        self._get_executor()
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({
+            "kind": self.kind,
+            "workers": self.workers,
+            "bulk_workers": max(self.workers - 1, 1),
+            "queue_size": self.queue_size,
+            "in_flight": stats["submitted"] - stats["completed"],
+            "rounds": BCRYPT_ROUNDS,
+        })
+        return stats
+
+
+hashing_pool = None  # HashingPool, built by init_resources()
+
+
 # Function to hash the password using bcrypt
 def hash_password(password):
-    # Generate a salt and hash the password
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
+    # Generate a salt and hash the password on the hashing pool
+    hashed_password = hashing_pool.run(_bcrypt_hash, password.encode('utf-8'), BCRYPT_ROUNDS)
     return hashed_password.decode('utf-8')
-@wakinjologin.route("/")
+
+
+# Compare a plain password with a stored bcrypt hash on the hashing pool
+def check_password(password, hashed_password):
+    return hashing_pool.run(_bcrypt_check, password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+# Cost factor a bcrypt hash was created with ("$2b$12$..." -> 12)
+def bcrypt_rounds(hashed_password):
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# Re-hash a just-verified password at the configured cost and store it, so
+# existing users migrate to BCRYPT_ROUNDS as they log in. Only overwrites the
+# hash that was verified, and never fails the login itself.
+def rehash_if_needed(connection, table, username, password, stored_hash):
+    if bcrypt_rounds(stored_hash) == BCRYPT_ROUNDS:
+        return stored_hash
+    try:
+        new_hash = hash_password(password)
+        cursor = connection.cursor(TimedCursor)
+        accounts.replace_password_hash(cursor, table, username, stored_hash, new_hash)
+        connection.commit()
+        cursor.close()
+        return new_hash
+    except (Error, HashingBusy) as e:
+        print(f"Could not rehash password for {username}: {e!r}")
+        return stored_hash
+
+
+@api.app_errorhandler(HashingBusy)
+def hashing_busy(e):
+    response = jsonify({
+        "status": "error",
+        "message": "Server busy, please retry shortly"
+    })
+    response.headers["Retry-After"] = str(hashing_pool.retry_after)
+    return response, 503
+
+
+# Sliding-window counters and failure records for LoginLimiter, kept in this
+# process. One small list per key; stale windows are pruned once the number
+# of keys passes max_keys.
+class MemoryLimiterStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._windows = {}  # key -> [window, current count, previous window count]
+        self._failures = {}  # key -> (failures, last failure time, locked until)
+
+    def hit(self, key, window):
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or entry[0] < window - 1:
+                entry = [window, 0, 0]
+            elif entry[0] == window - 1:
+                entry = [window, 0, entry[1]]
+            entry[1] += 1
+            self._windows[key] = entry
+            if len(self._windows) > self.max_keys:
+                self._prune(window)
+            return entry[1], entry[2]
+
+    def _prune(self, window):
+        for key in [key for key, entry in self._windows.items() if entry[0] < window - 1]:
+            del self._windows[key]
+        # Still full (a flood of distinct keys): drop the oldest inserted
+        while len(self._windows) > self.max_keys:
+            del self._windows[next(iter(self._windows))]
+        while len(self._failures) > self.max_keys:
+            del self._failures[next(iter(self._failures))]
+
+    def get_failure(self, key):
+        with self._lock:
+            return self._failures.get(key)
+
+    def set_failure(self, key, failures, last_failure, locked_until):
+        with self._lock:
+            self._failures[key] = (failures, last_failure, locked_until)
+
+    def clear_failure(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+# Same interface as MemoryLimiterStore, backed by a local SQLite file so all
+# worker processes on the host share the counters
+class SQLiteLimiterStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        db = self._db()
+        with db:
+            db.execute("CREATE TABLE IF NOT EXISTS limiter_windows "
+                       "(key TEXT PRIMARY KEY, win INTEGER, current INTEGER, previous INTEGER)")
+            db.execute("CREATE TABLE IF NOT EXISTS limiter_failures "
+                       "(key TEXT PRIMARY KEY, failures INTEGER, last_failure REAL, locked_until REAL)")
+
+    def _db(self):
+        # sqlite3 connections belong to one thread (and must not cross a fork)
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            import sqlite3
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def hit(self, key, window):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT INTO limiter_windows (key, win, current, previous) VALUES (?, ?, 1, 0) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "previous = CASE WHEN win = excluded.win THEN previous "
+                "WHEN win = excluded.win - 1 THEN current ELSE 0 END, "
+                "current = CASE WHEN win = excluded.win THEN current + 1 ELSE 1 END, "
+                "win = excluded.win",
+                (key, window)
+            )
+            current, previous = db.execute(
+                "SELECT current, previous FROM limiter_windows WHERE key = ?", (key,)).fetchone()
+            if current == 1 and previous == 0 and hash(key) % 100 == 0:
+                db.execute("DELETE FROM limiter_windows WHERE win < ?", (window - 1,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return current, previous
+
+    def get_failure(self, key):
+        return self._db().execute(
+            "SELECT failures, last_failure, locked_until FROM limiter_failures WHERE key = ?", (key,)).fetchone()
+
+    def set_failure(self, key, failures, last_failure, locked_until):
+        self._db().execute(
+            "INSERT OR REPLACE INTO limiter_failures (key, failures, last_failure, locked_until) VALUES (?, ?, ?, ?)",
+            (key, failures, last_failure, locked_until))
+
+    def clear_failure(self, key):
+        self._db().execute("DELETE FROM limiter_failures WHERE key = ?", (key,))
+
+
+# Per-IP and per-username limits on login attempts, using a sliding-window
+# counter (this window's count plus the previous window's, weighted by how
+# much of it still overlaps), and a progressive lockout: after
+# lockout_threshold consecutive failures a username is locked for
+# lockout_base seconds, doubling with each further failure up to lockout_max.
+class LoginLimiter:
+    def __init__(self, store, user_limit=10, ip_limit=50, window=60,
+                 lockout_threshold=5, lockout_base=30, lockout_max=3600, lockout_reset=900):
+        self.store = store
+        self.user_limit = user_limit
+        self.ip_limit = ip_limit
+        self.window = window
+        self.lockout_threshold = lockout_threshold
+        self.lockout_base = lockout_base
+        self.lockout_max = lockout_max
+        self.lockout_reset = lockout_reset
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "limited_ip": 0, "limited_user": 0, "locked_out": 0,
+                          "failures": 0, "lockouts": 0}
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    @staticmethod
+    def _user_key(role, username):
+        return f"{role}:{username_key(username)}"
+
+    # Seconds the caller has to wait before trying again, or 0 if allowed
+    def check(self, role, username, ip):
+        now = time.time()
+        user_key = self._user_key(role, username)
+        failure = self.store.get_failure(user_key)
+        if failure and failure[2] > now:
+            self._count("locked_out")
+            return failure[2] - now
+
+        window, offset = divmod(now, self.window)
+        overlap = 1 - offset / self.window
+        for key, limit, counter in ((f"ip:{ip}", self.ip_limit, "limited_ip"),
+                                    (f"user:{user_key}", self.user_limit, "limited_user")):
+            if not limit:
+                continue
+            current, previous = self.store.hit(key, int(window))
+            if previous * overlap + current > limit:
+                self._count(counter)
+                return self.window - offset
+        self._count("allowed")
+        return 0
+
+    def failure(self, role, username):
+        now = time.time()
+        user_key = self._user_key(role, username)
+        failure = self.store.get_failure(user_key)
+        failures = failure[0] + 1 if failure and now - failure[1] < self.lockout_reset else 1
+        locked_until = 0
+        if self.lockout_threshold and failures >= self.lockout_threshold:
+            locked_until = now + min(self.lockout_base * 2 ** (failures - self.lockout_threshold), self.lockout_max)
+            self._count("lockouts")
+        self.store.set_failure(user_key, failures, now, locked_until)
+        self._count("failures")
+
+    def success(self, role, username):
+        user_key = self._user_key(role, username)
+        if self.store.get_failure(user_key):
+            self.store.clear_failure(user_key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({
+            "store": type(self.store).__name__,
+            "user_limit": self.user_limit,
+            "ip_limit": self.ip_limit,
+            "window": self.window,
+            "lockout_threshold": self.lockout_threshold,
+        })
+        return stats
+
+
+login_limiter = LoginLimiter(
+    SQLiteLimiterStore(os.getenv("LOGIN_LIMIT_DB")) if os.getenv("LOGIN_LIMIT_DB") else MemoryLimiterStore(),
+    user_limit=int(os.getenv("LOGIN_LIMIT_PER_USER", 10)),
+    ip_limit=int(os.getenv("LOGIN_LIMIT_PER_IP", 50)),
+    window=float(os.getenv("LOGIN_LIMIT_WINDOW", 60)),
+    lockout_threshold=int(os.getenv("LOGIN_LOCKOUT_THRESHOLD", 5)),
+    lockout_base=float(os.getenv("LOGIN_LOCKOUT_BASE", 30)),
+    lockout_max=float(os.getenv("LOGIN_LOCKOUT_MAX", 3600)),
+    lockout_reset=float(os.getenv("LOGIN_LOCKOUT_RESET", 900)),
+)
+STATS_PROVIDERS["login_limiter"] = login_limiter.stats
+
+
+# Secret for signing session tokens. Set TOKEN_SECRET when running on more
+# than one host; otherwise one is generated and kept in SHARED_STATE_DIR so
+# every worker on this host signs with the same key. A generated secret is
+# written to a temporary file and linked into place, so a worker starting at
+# the same time never reads a half-written one.
+MIN_TOKEN_SECRET_LENGTH = 32
+
+
+def load_token_secret():
+    if os.getenv("TOKEN_SECRET") is not None:
+        secret = os.getenv("TOKEN_SECRET").encode('utf-8')
+    else:
+        path = os.path.join(SHARED_STATE_DIR, "token.secret")
+        if not os.path.exists(path):
+            fd, temporary = tempfile.mkstemp(dir=SHARED_STATE_DIR, prefix=".token.secret.")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(base64.urlsafe_b64encode(os.urandom(32)))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.link(temporary, path)
+            except FileExistsError:
+                pass  # another worker published its secret first
+            finally:
+                os.unlink(temporary)
+        with open(path, 'rb') as f:
+            secret = f.read().strip()
+    if len(secret) < MIN_TOKEN_SECRET_LENGTH:
+        raise RuntimeError(f"The token secret must be at least {MIN_TOKEN_SECRET_LENGTH} bytes")
+    return secret
+
+
+TOKEN_SECRET = load_token_secret()
+TOKEN_TTL = int(os.getenv("TOKEN_TTL", 12 * 3600))
+# With AUTH_REQUIRED=1 protected routes reject requests without a token;
+# otherwise the routes that predate tokens (require_token(legacy=True))
+# still let a missing token through while their clients migrate. Newer
+# routes always want one.
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED") == "1"
+
+
+# Usernames whose tokens were revoked, with the time of revocation; tokens
+# issued before then are refused. Kept in the token_revocations table, in
+# the same transaction as the change that calls for it, so a revocation
+# reaches every worker on every host: each one reloads the revocations of
+# the last TOKEN_TTL seconds every REVOCATION_REFRESH_INTERVAL seconds, and
+# the revoking worker applies its own at once.
+class RevocationList:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}  # (role, folded username) -> revoked at
+        self._last_purge = 0.0
+
+    # The (sql, params) recording a revocation at revoked_at (a time.time())
+    @staticmethod
+    def revocation(role, username, revoked_at):
+        return (
+            "INSERT INTO token_revocations (role, username, revoked_at) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE revoked_at = GREATEST(revoked_at, VALUES(revoked_at))",
+            (role, username_key(username), revoked_at)
+        )
+
+    # Apply a revocation in this process, once its transaction has committed
+    def remember(self, role, username, revoked_at):
+        key = (role, username_key(username))
+        with self._lock:
+            self._revoked[key] = max(self._revoked.get(key, 0), revoked_at)
+
+    # Reload the revocations still young enough to matter, and drop older
+    # ones from the table (at most once an hour per process)
+    def refresh(self, connection):
+        cutoff = time.time() - TOKEN_TTL
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT role, username, revoked_at FROM token_revocations WHERE revoked_at > %s",
+                           (cutoff,))
+            rows = cursor.fetchall()
+            if time.monotonic() - self._last_purge > 3600:
+                self._last_purge = time.monotonic()
+                cursor.execute("DELETE FROM token_revocations WHERE revoked_at <= %s LIMIT 1000", (cutoff,))
+        # End the read snapshot, so the next refresh sees newer rows
+        connection.commit()
+        revoked = {(row['role'], row['username']): row['revoked_at'] for row in rows}
+        with self._lock:
+            for key, revoked_at in self._revoked.items():
+                if revoked_at > cutoff and revoked_at > revoked.get(key, 0):
+                    revoked[key] = revoked_at
+            self._revoked = revoked
+
+    def revoked_at(self, role, username):
+        with self._lock:
+            return self._revoked.get((role, username_key(username)), 0)
+
+
+revocations = RevocationList()
+REVOCATION_REFRESH_INTERVAL = float(os.getenv("REVOCATION_REFRESH_INTERVAL", 5))
+
+
+def refresh_revocations_periodically(interval):
+    while True:
+        with db_connection() as connection:
+            if connection:
+                try:
+                    revocations.refresh(connection)
+                except Error as e:
+                    print(f"Token revocation refresh failed: {e}")
+        time.sleep(interval)
+
+
+if REVOCATION_REFRESH_INTERVAL:
+    BACKGROUND_TASKS.append(("token-revocations", refresh_revocations_periodically, (REVOCATION_REFRESH_INTERVAL,)))
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload):
+    return _b64encode(hmac.new(TOKEN_SECRET, payload.encode('ascii'), hashlib.sha256).digest())
+
+
+# Stateless session token: base64url(JSON claims) + "." + base64url(HMAC-SHA256)
+def issue_token(username, role):
+    now = time.time()
+    claims = {"sub": username, "role": role, "iat": now, "exp": now + TOKEN_TTL}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode('utf-8'))
+    return f"{payload}.{_sign(payload)}", claims["exp"]
+
+
+# Claims of a valid token, or None if it is malformed, forged, expired or revoked
+def verify_token(token):
+    try:
+        payload, signature = token.split(".")
+        # Compared as bytes: compare_digest() refuses non-ASCII str
+        if not hmac.compare_digest(signature.encode('utf-8'), _sign(payload).encode('ascii')):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, UnicodeError, TypeError):
+        return None
+    if claims.get("exp", 0) <= time.time():
+        return None
+    if claims.get("iat", 0) <= revocations.revoked_at(claims.get("role"), claims.get("sub", "")):
+        return None
+    return claims
+
+
+def bearer_token(headers):
+    authorization = headers.get("Authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        return authorization[7:].strip()
+    return None
+
+
+# Check the request's token against the allowed roles: returns
+# (claims, None) or (None, (message, status)). A wrong or invalid token is
+# always refused; claims is None without a token only on a legacy route
+# while AUTH_REQUIRED is off.
+def authorize(headers, roles, legacy=False):
+    token = bearer_token(headers)
+    if token is None:
+        return None, (None if legacy and not AUTH_REQUIRED else ("Missing token", 401))
+    claims = verify_token(token)
+    if claims is None:
+        return None, ("Invalid or expired token", 401)
+    if claims["role"] not in roles:
+        return None, ("Not allowed for this role", 403)
+    return claims, None
+
+
+# Route decorator: only callers holding a valid token with one of these
+# roles. legacy=True marks a route that predates tokens (see AUTH_REQUIRED).
+def require_token(*roles, legacy=False):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            claims, error = authorize(request.headers, roles, legacy)
+            if error:
+                return jsonify({
+                    "status": "error",
+                    "message": error[0]
+                }), error[1]
+            g.token_claims = claims
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Success response of /login and /admin_login, carrying a fresh token
+def login_success(username, role, message):
+    token, expires_at = issue_token(username, role)
+    return jsonify({
+        "status": "success",
+        "message": message,
+        "token": token,
+        "expires_at": int(expires_at)
+    }), 200
+
+
+# Address of the client; behind a trusted proxy set TRUST_X_FORWARDED_FOR=1
+def client_ip():
+    if os.getenv("TRUST_X_FORWARDED_FOR") == "1" and request.headers.get("X-Forwarded-For"):
+        return request.headers["X-Forwarded-For"].split(",")[0].strip()
+    return request.remote_addr
+
+
+def too_many_attempts(retry_after):
+    response = jsonify({
+        "status": "error",
+        "message": "Too many attempts, please retry later"
+    })
+    response.headers["Retry-After"] = str(max(math.ceil(retry_after), 1))
+    return response, 429
+
+
+# Idempotency-Key support for the write endpoints. The first request with a
+# key claims it in the idempotency_keys table; its response is then stored
+# there, and in a small per-process LRU, for IDEMPOTENCY_TTL seconds, and
+# a retry with the same key gets that response back without the view
+# running again. A duplicate arriving while the first is still running gets
+# 409. A 5xx response releases the claim so the client can retry for real.
+class IdempotencyStore:
+    MAX_KEY_LENGTH = 255
+
+    def __init__(self, ttl, pending_timeout, local_size):
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self.local_size = local_size
+        self._lock = threading.Lock()
+        self._local = OrderedDict()  # (scope, key) -> (expires, fingerprint, stored response)
+        self._last_purge = 0.0
+        self._counters = {"claimed": 0, "replayed_local": 0, "replayed_db": 0, "in_progress": 0,
+                          "mismatched": 0, "released": 0}
+
+    def count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _remember(self, scope, key, fingerprint, stored):
+        with self._lock:
+            self._local[(scope, key)] = (time.monotonic() + self.ttl, fingerprint, stored)
+            self._local.move_to_end((scope, key))
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _recall(self, scope, key):
+        with self._lock:
+            entry = self._local.get((scope, key))
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._local[(scope, key)]
+                return None
+            return entry
+
+    # Drop expired keys, at most once a minute per process
+    def _purge_expired(self, cursor):
+        if time.monotonic() - self._last_purge < 60:
+            return
+        self._last_purge = time.monotonic()
+        cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW(6) LIMIT 1000")
+
+    # Claim (scope, key) for a request with this fingerprint. Returns
+    # ("claimed", created_at of the claim), ("replay", (status, body,
+    # mimetype)), ("in_progress", None), ("mismatched", None) or
+    # ("unavailable", None).
+    def begin(self, scope, key, fingerprint):
+        entry = self._recall(scope, key)
+        if entry is not None:
+            outcome = "replayed_local" if entry[1] == fingerprint else "mismatched"
+            self.count(outcome)
+            return ("replay", entry[2]) if outcome == "replayed_local" else (outcome, None)
+
+        with db_connection() as connection:
+            if not connection:
+                return "unavailable", None
+            cursor = connection.cursor()
+            self._purge_expired(cursor)
+            # Two rounds: the second one follows the takeover of an expired or
+            # abandoned claim
+            for _ in range(2):
+                cursor.execute(
+                    "INSERT IGNORE INTO idempotency_keys (scope, idem_key, fingerprint, created_at, expires_at) "
+                    "VALUES (%s, %s, %s, NOW(6), NOW(6) + INTERVAL %s SECOND)",
+                    (scope, key, fingerprint, self.ttl)
+                )
+                claimed = cursor.rowcount == 1
+                if claimed:
+                    cursor.execute(
+                        "SELECT created_at FROM idempotency_keys WHERE scope = %s AND idem_key = %s", (scope, key))
+                    claimed_at = cursor.fetchone()['created_at']
+                connection.commit()
+                if claimed:
+                    self.count("claimed")
+                    return "claimed", claimed_at
+
+                cursor.execute(
+                    "SELECT fingerprint, status_code, response, mimetype, created_at, "
+                    "expires_at < NOW(6) AS expired, created_at < NOW(6) - INTERVAL %s SECOND AS stale "
+                    "FROM idempotency_keys WHERE scope = %s AND idem_key = %s",
+                    (self.pending_timeout, scope, key)
+                )
+                row = cursor.fetchone()
+                connection.commit()
+                if row is None:
+                    continue
+                if row['expired'] or (row['status_code'] is None and row['stale']):
+                    # Only delete the claim we looked at, not a newer one
+                    # another request took over meanwhile
+                    cursor.execute(
+                        "DELETE FROM idempotency_keys WHERE scope = %s AND idem_key = %s AND created_at = %s",
+                        (scope, key, row['created_at'])
+                    )
+                    connection.commit()
+                    continue
+                if row['fingerprint'] != fingerprint:
+                    self.count("mismatched")
+                    return "mismatched", None
+                if row['status_code'] is None:
+                    self.count("in_progress")
+                    return "in_progress", None
+                stored = (row['status_code'], bytes(row['response']), row['mimetype'])
+                self._remember(scope, key, fingerprint, stored)
+                self.count("replayed_db")
+                return "replay", stored
+            cursor.close()
+        self.count("in_progress")
+        return "in_progress", None
+
+    # Store the response for a claimed key, or release the claim after a
+    # server error so a retry runs the request again. Both only touch the
+    # claim made at claimed_at, not one another request has taken over since.
+    def finish(self, scope, key, fingerprint, claimed_at, status, body, mimetype):
+        if status < 500:
+            self._remember(scope, key, fingerprint, (status, body, mimetype))
+        with db_connection() as connection:
+            if not connection:
+                return
+            cursor = connection.cursor()
+            if status >= 500:
+                cursor.execute(
+                    "DELETE FROM idempotency_keys WHERE scope = %s AND idem_key = %s AND created_at = %s",
+                    (scope, key, claimed_at)
+                )
+                self.count("released")
+            else:
+                cursor.execute(
+                    "UPDATE idempotency_keys SET status_code = %s, response = %s, mimetype = %s, "
+                    "expires_at = NOW(6) + INTERVAL %s SECOND WHERE scope = %s AND idem_key = %s AND created_at = %s",
+                    (status, body, mimetype, self.ttl, scope, key, claimed_at)
+                )
+            connection.commit()
+            cursor.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["local_entries"] = len(self._local)
+        return stats
+
+
+idempotency = IdempotencyStore(
+    ttl=int(os.getenv("IDEMPOTENCY_TTL", 86400)),
+    pending_timeout=int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", 60)),
+    local_size=int(os.getenv("IDEMPOTENCY_LOCAL_SIZE", 10000)),
+)
+STATS_PROVIDERS["idempotency"] = idempotency.stats
+
+
+# Keys are per endpoint and per token holder, hashed to a fixed width
+def idempotency_scope(path, claims):
+    owner = f"{claims.get('role')}:{claims.get('sub')}" if claims else ""
+    return hashlib.sha256(f"{path}|{owner}".encode('utf-8')).hexdigest()
+
+
+# Key for request fingerprints, derived from the token secret so every
+# worker and host computes the same digest
+FINGERPRINT_KEY = hmac.new(TOKEN_SECRET, b"idempotency fingerprint", hashlib.sha256).digest()
+
+
+# Digest of what the request asks for, so a key reused for a different
+# request is rejected rather than answered with the wrong response. It is
+# stored for IDEMPOTENCY_TTL and the request may carry a password, so it is
+# an HMAC rather than a plain hash anyone could brute-force offline.
+def request_fingerprint(method, path, query, body, form_items):
+    digest = hmac.new(FINGERPRINT_KEY, digestmod=hashlib.sha256)
+    for part in (method, path, query):
+        digest.update(part.encode('utf-8') + b"\0")
+    digest.update(body + b"\0")
+    for name, value in sorted(form_items):
+        digest.update(f"{name}={value}".encode('utf-8') + b"\0")
+    return digest.hexdigest()
+
+
+# The response for an idempotency outcome other than "claimed", or None
+def idempotency_response(outcome, stored):
+    if outcome == "replay":
+        status, body, mimetype = stored
+        response = Response(body, status=status, mimetype=mimetype)
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+    if outcome == "in_progress":
+        response = jsonify({
+            "status": "error",
+            "message": "A request with this Idempotency-Key is still being processed"
+        })
+        response.status_code = 409
+        response.headers["Retry-After"] = "1"
+        return response
+    if outcome == "mismatched":
+        return jsonify({
+            "status": "error",
+            "message": "Idempotency-Key was already used for a different request"
+        }), 422
+    if outcome == "unavailable":
+        return jsonify({
+            "status": "error",
+            "message": "Database connection failed"
+        }), 500
+    return None
+
+
+# Make a write endpoint honour the Idempotency-Key header. Goes below
+# @require_token so keys are scoped to the token holder.
+def idempotent(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > IdempotencyStore.MAX_KEY_LENGTH:
+            return jsonify({
+                "status": "error",
+                "message": f"Idempotency-Key must be at most {IdempotencyStore.MAX_KEY_LENGTH} characters"
+            }), 400
+
+        scope = idempotency_scope(request.path, g.get("token_claims"))
+        body = request.get_data(cache=True, parse_form_data=True)
+        fingerprint = request_fingerprint(request.method, request.path, request.query_string.decode('latin-1'),
+                                          body, request.form.items(multi=True))
+        outcome, stored = idempotency.begin(scope, key, fingerprint)
+        if outcome != "claimed":
+            return idempotency_response(outcome, stored)
+        claimed_at = stored
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency.finish(scope, key, fingerprint, claimed_at, 500, b"", None)
+            raise
+        idempotency.finish(scope, key, fingerprint, claimed_at, response.status_code, response.get_data(),
+                           response.mimetype)
+        return response
+    return wrapper
+
+
+@api.route("/")
 def home():
     return "Hello, John!"
 
 
+# Startup timings (seconds) for /readyz and /stats; create_app() and
+# warm_up() fill them in
+startup = {"import": None, "create_app": None, "warm_up": None, "db_pool": None, "hashing_pool": None}
+_warm_state = {"pid": None, "ready": False}
+_warm_lock = threading.Lock()
+# Warm each worker before it reports ready (PREWARM=0 leaves it to the
+# first requests)
+PREWARM = os.getenv("PREWARM", "1") != "0"
+_background_state = {"pid": None}
+_background_lock = threading.Lock()
+
+
+# Start BACKGROUND_TASKS once per process. Called from gunicorn's post_fork,
+# from __main__ and, as a fallback for other servers, on the first request.
+def start_background_tasks():
+    pid = os.getpid()
+    if _background_state["pid"] == pid:
+        return
+    with _background_lock:
+        if _background_state["pid"] == pid:
+            return
+        _background_state["pid"] = pid
+        for name, target, args in BACKGROUND_TASKS:
+            threading.Thread(target=target, args=args, name=name, daemon=True).start()
+
+
+# Open the pool's min_size connections and start the hashing workers, so the
+# first requests don't pay for the handshakes and the process spawn
+def warm_up():
+    with _warm_lock:
+        if warmed():
+            return
+        started = time.perf_counter()
+        db_pool.warm()
+        startup["db_pool"] = time.perf_counter() - started
+        hashing_started = time.perf_counter()
+        # Cheapest cost factor: only the worker start-up is being paid for here
+        hashing_pool.run(_bcrypt_hash, b"warm-up", 4)
+        startup["hashing_pool"] = time.perf_counter() - hashing_started
+        startup["warm_up"] = time.perf_counter() - started
+        _warm_state.update(pid=os.getpid(), ready=True)
+
+
+# Whether warm_up() has finished in this process
+def warmed():
+    return _warm_state["ready"] and _warm_state["pid"] == os.getpid()
+
+
+# Fallback for servers that don't call warm_up() themselves: warm up on a
+# thread when the first request (usually the readiness probe) comes in
+def warm_up_in_background():
+    if PREWARM and not warmed() and not _warm_lock.locked():
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def startup_stats():
+    return {
+        "pid": os.getpid(),
+        "warmed": warmed(),
+        "background_tasks": [name for name, _, _ in BACKGROUND_TASKS],
+        **{f"{name}_seconds": value for name, value in startup.items() if value is not None},
+    }
+
+
+STATS_PROVIDERS["startup"] = startup_stats
+if QUERY_TRACE:
+    STATS_PROVIDERS["query_trace"] = query_traces.stats
+
+
+# Liveness: the process is up and serving. No dependencies are checked, so a
+# database outage doesn't get every worker restarted.
+@api.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "alive", "pid": os.getpid()}), 200
+
+
+# Readiness: the worker has warmed up and the database answers. Only checked
+# out of the pool, so a worker that wasn't pre-warmed opens its first
+# connection here rather than on a user's request.
+@api.route('/readyz', methods=['GET'])
+def readyz():
+    checks = {}
+    try:
+        with db_connection() as connection:
+            if connection is not None:
+                with connection.cursor(TimedCursor) as cursor:
+                    cursor.execute("SELECT /* q:readyz */ 1")
+                    cursor.fetchone()
+            checks["database"] = connection is not None
+        pending = pending_schema_versions() if checks["database"] else None
+    except Error:
+        checks["database"] = False
+        pending = None
+    body, status = readiness(checks, pending)
+    return jsonify(body), status
+
+
+_schema_state = {"pending": None}  # versions not applied, None until checked
+
+
+# Migrations this process has not seen applied, or None if the database
+# can't be asked. Once none are pending that is remembered, since the
+# schema only moves forward.
+def pending_schema_versions():
+    if _schema_state["pending"] != []:
+        with db_connection() as connection:
+            if connection is None:
+                return None
+            with connection.cursor(TimedCursor) as cursor:
+                _schema_state["pending"] = migrations.pending_versions(cursor)
+    return _schema_state["pending"]
+
+
+# /readyz body and status for both apps, from the database check and the
+# pending migrations. With PREWARM on, not ready until warm_up() has finished.
+def readiness(checks, pending):
+    checks["schema"] = pending == []
+    checks["warm_up"] = warmed() or not PREWARM
+    ready = all(checks.values())
+    body = {
+        "status": "ready" if ready else "not ready",
+        "checks": checks,
+        "startup": startup_stats()
+    }
+    if pending:
+        body["pending_migrations"] = pending
+        body["message"] = "Run `flask --app wakinjologin migrate` or start with DB_AUTO_MIGRATE=1"
+    return body, 200 if ready else 503
+
+
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if QUERY_TRACE:
+        current_trace.set(QueryTrace())
+    start_background_tasks()
+    warm_up_in_background()
+
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("http_request_seconds", time.perf_counter() - started, (("route", route),))
+        metrics.inc("http_requests_total", (("route", route), ("method", request.method),
+                                            ("status", str(response.status_code))))
+        metrics.maybe_flush()
+    return response
+
+
+@api.after_app_request
+def finish_query_trace(response):
+    trace = current_trace.get() if QUERY_TRACE else None
+    if trace is not None:
+        # Worker threads serve many requests; don't leave the trace behind
+        current_trace.set(None)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        response.headers["X-Query-Trace"] = query_traces.finish(trace, request.method, route, response.status_code)
+    return response
+
+
+# Compress large buffered responses the client can decode. Streamed exports
+# (no Content-Length) and responses that already carry an encoding, such as
+# cached /get_items bodies, are left alone.
+@api.after_app_request
+def compress_response(response):
+    if response.direct_passthrough or response.is_streamed or not compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request.accept_encodings, response.content_length)
+    if encoding is not None:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        weaken_etag(response)
+    return response
+
+
+# Numeric values from the /stats providers, exported as gauges
+def stats_gauges():
+    gauges = {}
+    for provider_name, provider in STATS_PROVIDERS.items():
+        for key, value in provider().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "pid":
+                gauges[f"{provider_name}_{key}"] = value
+    return gauges
+
+
+metrics.gauges = stats_gauges
+
+
+# Prometheus scrape endpoint (all workers merged when METRICS_DIR is set)
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# Claims of the caller's session token, so clients can check a session
+# without re-sending the password
+@api.route('/session', methods=['GET'])
+def session():
+    claims = verify_token(bearer_token(request.headers) or "")
+    if claims is None:
+        return jsonify({
+            "status": "error",
+            "message": "Invalid or expired token"
+        }), 401
+    return jsonify({
+        "status": "success",
+        "message": "Session is valid",
+        "data": {"username": claims["sub"], "role": claims["role"], "expires_at": int(claims["exp"])}
+    }), 200
+
+
+# Recently flagged request traces of the worker that answers
+# (QUERY_TRACE=1 and DEBUG_QUERIES=1, admin token whatever AUTH_REQUIRED says)
+@api.route('/debug/queries', methods=['GET'])
+@require_token('admin')
+def debug_queries():
+    if not (DEBUG_QUERIES and QUERY_TRACE):
+        return jsonify({
+            "status": "error",
+            "message": "Query tracing is disabled"
+        }), 404
+    limit = request.args.get('limit', type=int)
+    return jsonify({
+        "status": "success",
+        "data": {"stats": query_traces.stats(), "traces": query_traces.recent(limit and max(limit, 1))}
+    }), 200
+
+
+# Per-worker runtime stats (pool usage, wait times, ...) for sizing
+@api.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "status": "success",
+        "data": {name: provider() for name, provider in STATS_PROVIDERS.items()}
+    }), 200
+
+
 # Define the route that accepts a POST request for registration
 
-@wakinjologin.route('/register', methods=['POST'])
+@api.route('/register', methods=['POST'])
+@idempotent
 def register_user():
     # Get 'worker_id', 'username', 'phone_number', 'password' and 'confirm_password' from form data
     worker_id = request.form.get('worker_id')
@@ -70,39 +2165,40 @@ def register_user():
     hashed_password = hash_password(password)
 
     # Save data to MySQL database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor()
 
-            # Insert data into the 'employees' table (with hashed password)
-            cursor.execute("INSERT INTO employees (worker_id, username, phone_number, passwd) VALUES (%s, %s, %s, %s)", 
-                           (worker_id, username, phone_number, hashed_password))
-            connection.commit()  # Commit the transaction
+                # Insert data into the 'employees' table (with hashed password)
+                username_indexes['employees'].add(username)
+                cursor.execute("INSERT INTO employees (worker_id, username, phone_number, passwd) VALUES (%s, %s, %s, %s)", 
+                               (worker_id, username, phone_number, hashed_password))
+                connection.commit()  # Commit the transaction
+                credential_cache.invalidate('employee', username)
 
-            # Close the connection
-            cursor.close()
-            connection.close()
+                cursor.close()
 
-            return jsonify({
-                "status": "success",
-                "message": "User registered successfully"
-            }), 200
+                return jsonify({
+                    "status": "success",
+                    "message": "User registered successfully"
+                }), 200
 
-        except Error as e:
+            except Error as e:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Error saving data to MySQL: {e}"
+                }), 500
+
+        else:
             return jsonify({
                 "status": "error",
-                "message": f"Error saving data to MySQL: {e}"
+                "message": "Database connection failed"
             }), 500
 
-    else:
-        return jsonify({
-            "status": "error",
-            "message": "Database connection failed"
-        }), 500
 
-
-@wakinjologin.route('/delete_employee', methods=['POST'])
+@api.route('/delete_employee', methods=['POST'])
+@require_token('admin', legacy=True)
 def delete_employee():
     # Get 'username' from the form data
     username = request.form.get('username')
@@ -114,52 +2210,57 @@ def delete_employee():
             "message": "Missing username"
         }), 400
 
+    # Unknown usernames are answered without touching the database
+    if not username_indexes['employees'].might_exist(username):
+        return jsonify({
+            "status": "error",
+            "message": "Username not found"
+        }), 404
+
     # Retrieve the user from the database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor(TimedCursor)
+
+                # Delete the user; no row deleted means no such user
+                if not accounts.delete_account(cursor, 'employees', username):
+                    return jsonify({
+                        "status": "error",
+                        "message": "Username not found"
+                    }), 404
+                # Their tokens stop working along with the account
+                revoked_at = time.time()
+                cursor.execute(*revocations.revocation('employee', username, revoked_at))
+                connection.commit()
+                credential_cache.invalidate('employee', username)
+                revocations.remember('employee', username, revoked_at)
+
+                cursor.close()
 
-            # Check if the username exists in the database
-            cursor.execute("SELECT * FROM employees WHERE username = %s", (username,))
-            user = cursor.fetchone()
+                return jsonify({
+                    "status": "success",
+                    "message": "Deleted successfully"
+                }), 200
 
-            # If the user does not exist
-            if not user:
+            except Error as e:
+                # Handle database errors
                 return jsonify({
                     "status": "error",
-                    "message": "Username not found"
-                }), 404
-
-            # Delete the user if exists
-            cursor.execute("DELETE FROM employees WHERE username = %s", (username,))
-            connection.commit()
-
-            cursor.close()
-            connection.close()
+                    "message": f"Error accessing database: {e}"
+                }), 500
 
-            return jsonify({
-                "status": "success",
-                "message": "Deleted successfully"
-            }), 200
-
-        except Error as e:
-            # Handle database errors
+        else:
+            # If the database connection fails
             return jsonify({
                 "status": "error",
-                "message": f"Error accessing database: {e}"
+                "message": "Database connection failed"
             }), 500
 
-    else:
-        # If the database connection fails
-        return jsonify({
-            "status": "error",
-            "message": "Database connection failed"
-        }), 500
-
 
 
-@wakinjologin.route('/admin_register', methods=['POST'])
+@api.route('/admin_register', methods=['POST'])
+@idempotent
 def admin_register():
     # Get 'admin_id', 'username', 'phone_number', 'password' and 'confirm_password' from form data
     admin_id = request.form.get('admin_id')
@@ -186,43 +2287,45 @@ def admin_register():
     hashed_password = hash_password(password)
 
     # Save data to MySQL database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor()
 
-            # Insert data into the 'employees' table (with hashed password)
-            cursor.execute("INSERT INTO admins (admin_id, username, phone_number, password) VALUES (%s, %s, %s, %s)", 
-                           (admin_id, username, phone_number, hashed_password))
-            connection.commit()  # Commit the transaction
+                # Insert data into the 'employees' table (with hashed password)
+                username_indexes['admins'].add(username)
+                cursor.execute("INSERT INTO admins (admin_id, username, phone_number, password) VALUES (%s, %s, %s, %s)", 
+                               (admin_id, username, phone_number, hashed_password))
+                connection.commit()  # Commit the transaction
 
-            # Close the connection
-            cursor.close()
-            connection.close()
+                cursor.close()
 
-            return jsonify({
-                "status": "success",
-                "message": "Admin registered successfully"
-            }), 200
+                return jsonify({
+                    "status": "success",
+                    "message": "Admin registered successfully"
+                }), 200
 
-        except Error as e:
+            except Error as e:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Error saving data to MySQL: {e}"
+                }), 500
+
+        else:
             return jsonify({
                 "status": "error",
-                "message": f"Error saving data to MySQL: {e}"
+                "message": "Database connection failed"
             }), 500
-
-    else:
-        return jsonify({
-            "status": "error",
-            "message": "Database connection failed"
-        }), 500
-@wakinjologin.route('/item_register', methods=['POST'])
+@api.route('/item_register', methods=['POST'])
+@idempotent
 def item_register():
     # Get 'item_name', 'quantity', 'company_name', 'price_per_item'
     item_name = request.form.get('item_name')
     quantity = request.form.get('quantity')
     company_name = request.form.get('company_name')
     price_per_item = request.form.get('price_per_item')
+    # upsert=true adds the quantity to an already registered item instead of failing
+    upsert = request.form.get('upsert', '').lower() == 'true'
     
     # Validate if all fields are present
     if not item_name or not quantity or not company_name or not price_per_item:
@@ -232,50 +2335,253 @@ def item_register():
         }), 400
     
     # Connect to the database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            
-            # Check if item already exists for the given company
-            cursor.execute("SELECT * FROM items WHERE item_name = %s AND company_name = %s", (item_name, company_name))
-            existing_item = cursor.fetchone()
-            
-            if existing_item:
-                return jsonify({
-                    "status": "error",
-                    "message": "Item already exists. Please go to the update panel."
-                }), 400
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor()
             
-            # Insert data into the 'items' table if item does not exist
-            cursor.execute("INSERT INTO items (item_name, quantity, company_name, price_per_item) VALUES (%s, %s, %s, %s)", 
-                           (item_name, quantity, company_name, price_per_item))
-            connection.commit()  # Commit the transaction
+                # Single atomic insert; the unique (company_name, item_name) key
+                # rejects duplicates, or merges the quantity when upserting
+                sql = "INSERT INTO items (item_name, quantity, company_name, price_per_item) VALUES (%s, %s, %s, %s)"
+                if upsert:
+                    sql += " ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)"
+                cursor.execute(sql, (item_name, quantity, company_name, price_per_item))
+                # ON DUPLICATE KEY UPDATE reports 1 for an insert, 2 (or 0 if unchanged) for an update
+                updated = cursor.rowcount != 1
+                cursor.execute(*ledger.registration_movement(item_name, company_name, quantity))
+                cursor.execute(*ledger.registration_company_total(item_name, company_name, quantity, not updated))
+                connection.commit()  # Commit the transaction
+                items_cache.invalidate()
             
-            # Close the connection
-            cursor.close()
-            connection.close()
+                cursor.close()
             
-            return jsonify({
-                "status": "success",
-                "message": "Product registered successfully"
-            }), 200
+                return jsonify({
+                    "status": "success",
+                    "message": "Product quantity updated" if updated else "Product registered successfully"
+                }), 200
         
-        except Error as e:
+            except pymysql.err.IntegrityError as e:
+                if e.args[0] == ER_DUP_ENTRY:
+                    return jsonify({
+                        "status": "error",
+                        "message": "Item already exists. Please go to the update panel."
+                    }), 400
+                return jsonify({
+                    "status": "error",
+                    "message": f"Error saving data to MySQL: {e}"
+                }), 500
+
+            except Error as e:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Error saving data to MySQL: {e}"
+                }), 500
+    
+        else:
             return jsonify({
                 "status": "error",
-                "message": f"Error saving data to MySQL: {e}"
+                "message": "Database connection failed"
             }), 500
-    
-    else:
+
+
+# Largest number of rows accepted by one bulk registration request
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", 10000))
+
+
+# Rows of a bulk JSON body ({"<key>": [...]}), or None if it is malformed
+def bulk_rows(key):
+    data = request.get_json(silent=True)
+    rows = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(rows, list) or not rows:
+        return None
+    return rows
+
+
+def bulk_result(index, ok, message):
+    return {"index": index, "status": "success" if ok else "error", "message": message}
+
+
+def bulk_response(results, inserted, status=200, message=None):
+    response = {
+        "status": "success" if status == 200 else "error",
+        "inserted": len(inserted),
+        "failed": len(results) - len(inserted),
+        "results": results
+    }
+    if message:
+        response["message"] = message
+    return jsonify(response), status
+
+
+# Insert (index, params) rows with executemany in chunked transactions. A
+# chunk rejected by the database (e.g. a duplicate key) is redone row by row,
+# so only the offending rows are reported. Fills results in place and
+# returns the indexes that were inserted. after_insert(cursor, params list),
+# if given, runs in each chunk's transaction with the rows that went in.
+def bulk_insert(connection, sql, rows, results, success_message, duplicate_message=None, after_insert=None):
+    cursor = connection.cursor()
+    inserted = []
+    for chunk in chunked(rows):
+        try:
+            cursor.executemany(sql, [params for _, params in chunk])
+            if after_insert:
+                after_insert(cursor, [params for _, params in chunk])
+            connection.commit()
+            done = [index for index, _ in chunk]
+        except (pymysql.err.IntegrityError, pymysql.err.DataError):
+            connection.rollback()
+            done = []
+            for index, params in chunk:
+                try:
+                    cursor.execute(sql, params)
+                    done.append(index)
+                except (pymysql.err.IntegrityError, pymysql.err.DataError) as e:
+                    if duplicate_message and e.args[0] == ER_DUP_ENTRY:
+                        results[index] = bulk_result(index, False, duplicate_message)
+                    else:
+                        results[index] = bulk_result(index, False, f"Error saving data to MySQL: {e}")
+            if after_insert and done:
+                inserted_params = dict(chunk)
+                after_insert(cursor, [inserted_params[index] for index in done])
+            connection.commit()
+        for index in done:
+            results[index] = bulk_result(index, True, success_message)
+        inserted.extend(done)
+    cursor.close()
+    return inserted
+
+
+# Shared body of /register_bulk and /admin_register_bulk: validate every row,
+# hash all passwords in parallel on the hashing pool, then bulk insert
+def bulk_register_users(table, id_field, password_field, role, success_message):
+    rows = bulk_rows(table)
+    if rows is None:
         return jsonify({
             "status": "error",
-            "message": "Database connection failed"
-        }), 500
+            "message": f"Invalid input, expecting a list of {table}."
+        }), 400
+    if len(rows) > BULK_MAX_ROWS:
+        return jsonify({
+            "status": "error",
+            "message": f"Too many rows, at most {BULK_MAX_ROWS} per request"
+        }), 400
+
+    results = [None] * len(rows)
+    valid = []
+    seen = set()
+    for index, row in enumerate(rows):
+        values = [row.get(field) for field in (id_field, 'username', 'phone_number', password_field)] \
+            if isinstance(row, dict) else [None]
+        if not all(values):
+            results[index] = bulk_result(index, False, "Missing fields")
+        elif row.get('confirm_passwd') is not None and row['confirm_passwd'] != row[password_field]:
+            results[index] = bulk_result(index, False, "Passwords do not match")
+        elif username_key(values[1]) in seen:
+            results[index] = bulk_result(index, False, "Duplicate username in request")
+        else:
+            seen.add(username_key(values[1]))
+            valid.append((index, values))
+
+    # Hash the passwords before saving them
+    hashes = hashing_pool.map(_bcrypt_hash, [(str(values[3]).encode('utf-8'), BCRYPT_ROUNDS) for _, values in valid])
+    insert_rows = [
+        (index, values[:3] + [hashed_password.decode('utf-8')])
+        for (index, values), hashed_password in zip(valid, hashes)
+    ]
+
+    inserted = []
+    with db_connection() as connection:
+        if not connection:
+            return bulk_response(results, inserted, 500, "Database connection failed")
+        try:
+            username_indexes[table].add(*(values[1] for _, values in insert_rows))
+            inserted = bulk_insert(
+                connection,
+                f"INSERT INTO {table} ({id_field}, username, phone_number, {password_field}) VALUES (%s, %s, %s, %s)",
+                insert_rows, results, success_message
+            )
+        except Error as e:
+            return bulk_response(results, inserted, 500, f"Error saving data to MySQL: {e}")
+        finally:
+            credential_cache.invalidate_many(role, [rows[index]['username'] for index in inserted])
+
+    return bulk_response(results, inserted)
+
+
+@api.route('/register_bulk', methods=['POST'])
+@idempotent
+def register_bulk():
+    # JSON body: {"employees": [{"worker_id", "username", "phone_number", "passwd"}, ...]}
+    return bulk_register_users("employees", "worker_id", "passwd", "employee", "User registered successfully")
+
+
+@api.route('/admin_register_bulk', methods=['POST'])
+@idempotent
+def admin_register_bulk():
+    # JSON body: {"admins": [{"admin_id", "username", "phone_number", "password"}, ...]}
+    return bulk_register_users("admins", "admin_id", "password", "admin", "Admin registered successfully")
+
+
+# Ledger movements and company totals for a chunk of newly inserted items
+def record_item_registrations(cursor, params):
+    cursor.execute(*ledger.bulk_registration_movements(params))
+    cursor.execute(*ledger.bulk_registration_company_totals(params))
+
+
+@api.route('/item_register_bulk', methods=['POST'])
+@idempotent
+def item_register_bulk():
+    # JSON body: {"items": [{"item_name", "quantity", "company_name", "price_per_item"}, ...]}
+    rows = bulk_rows('items')
+    if rows is None:
+        return jsonify({
+            "status": "error",
+            "message": "Invalid input, expecting a list of items."
+        }), 400
+    if len(rows) > BULK_MAX_ROWS:
+        return jsonify({
+            "status": "error",
+            "message": f"Too many rows, at most {BULK_MAX_ROWS} per request"
+        }), 400
+
+    results = [None] * len(rows)
+    valid = []
+    seen = set()
+    for index, row in enumerate(rows):
+        values = [row.get(field) for field in ('item_name', 'quantity', 'company_name', 'price_per_item')] \
+            if isinstance(row, dict) else [None]
+        if not all(values):
+            results[index] = bulk_result(index, False, "Missing fields")
+        elif item_key(values[0], values[2]) in seen:
+            results[index] = bulk_result(index, False, "Duplicate item in request")
+        else:
+            seen.add(item_key(values[0], values[2]))
+            valid.append((index, values))
+
+    inserted = []
+    with db_connection() as connection:
+        if not connection:
+            return bulk_response(results, inserted, 500, "Database connection failed")
+        try:
+            # The unique (company_name, item_name) key rejects existing items
+            inserted = bulk_insert(
+                connection,
+                "INSERT INTO items (item_name, quantity, company_name, price_per_item) VALUES (%s, %s, %s, %s)",
+                valid, results, "Product registered successfully",
+                duplicate_message="Item already exists. Please go to the update panel.",
+                after_insert=record_item_registrations
+            )
+        except Error as e:
+            return bulk_response(results, inserted, 500, f"Error saving data to MySQL: {e}")
+        finally:
+            if inserted:
+                items_cache.invalidate()
+
+    return bulk_response(results, inserted)
 
 
 # Define the route that accepts a POST request for login
-@wakinjologin.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login_user():
     # Get 'username' and 'password' from form data
     username = request.form.get('username')
@@ -288,48 +2594,64 @@ def login_user():
             "message": "Missing username or password"
         }), 400
 
-    # Retrieve the user from the database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    # Recently verified credentials skip the lookup and bcrypt
+    if credential_cache.lookup('employee', username, password):
+        return login_success(username, 'employee', "Login successful")
 
-            # Check if the username exists
-            cursor.execute("SELECT * FROM employees WHERE username = %s", (username,))
-            user = cursor.fetchone()
+    # Over-limit or locked-out attempts stop here, before the lookup and bcrypt
+    retry_after = login_limiter.check('employee', username, client_ip())
+    if retry_after:
+        return too_many_attempts(retry_after)
 
-            # If the user does not exist
-            if not user:
-                return jsonify({
-                    "status": "error",
-                    "message": "Username not found"
-                }), 404
+    # Unknown usernames are answered without touching the database
+    if not username_indexes['employees'].might_exist(username):
+        return jsonify({
+            "status": "error",
+            "message": "Username not found"
+        }), 404
 
-            # Compare the entered password with the stored hash
-            if bcrypt.checkpw(password.encode('utf-8'), user['passwd'].encode('utf-8')):  # Password match check
-                return jsonify({
-                    "status": "success",
-                    "message": "Login successful"
-                }), 200
-            else:
+    # Retrieve the user from the database
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor(TimedCursor)
+
+                # Check if the username exists (only its password hash is needed)
+                stored_hash = accounts.password_hash(cursor, 'employees', username)
+
+                # If the user does not exist
+                if stored_hash is None:
+                    return jsonify({
+                        "status": "error",
+                        "message": "Username not found"
+                    }), 404
+
+                # Compare the entered password with the stored hash
+                if check_password(password, stored_hash):  # Password match check
+                    login_limiter.success('employee', username)
+                    rehash_if_needed(connection, 'employees', username, password, stored_hash)
+                    credential_cache.remember('employee', username, password)
+                    return login_success(username, 'employee', "Login successful")
+                else:
+                    login_limiter.failure('employee', username)
+                    return jsonify({
+                        "status": "error",
+                        "message": "Invalid password"
+                    }), 400
+
+            except Error as e:
                 return jsonify({
                     "status": "error",
-                    "message": "Invalid password"
-                }), 400
+                    "message": f"Error accessing database: {e}"
+                }), 500
 
-        except Error as e:
+        else:
             return jsonify({
                 "status": "error",
-                "message": f"Error accessing database: {e}"
+                "message": "Database connection failed"
             }), 500
 
-    else:
-        return jsonify({
-            "status": "error",
-            "message": "Database connection failed"
-        }), 500
-
-@wakinjologin.route('/admin_login', methods=['POST'])
+@api.route('/admin_login', methods=['POST'])
 def admin_login_user():
     # Get 'username' and 'password' from form data
     username = request.form.get('username')
@@ -342,49 +2664,320 @@ def admin_login_user():
             "message": "Missing username or password"
         }), 400
 
-    # Retrieve the user from the database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    # Over-limit or locked-out attempts stop here, before the lookup and bcrypt
+    retry_after = login_limiter.check('admin', username, client_ip())
+    if retry_after:
+        return too_many_attempts(retry_after)
 
-            # Check if the username exists
-            cursor.execute("SELECT * FROM admins WHERE username = %s", (username,))
-            user = cursor.fetchone()
-
-            # If the user does not exist
-            if not user:
-                return jsonify({
-                    "status": "error",
-                    "message": "Username not found"
-                }), 404
+    # Unknown usernames are answered without touching the database
+    if not username_indexes['admins'].might_exist(username):
+        return jsonify({
+            "status": "error",
+            "message": "Username not found"
+        }), 404
 
-            # Compare the entered password with the stored hash
-            if bcrypt.checkpw(password.encode('utf-8'), user['password'].encode('utf-8')):  # Password match check
-                return jsonify({
-                    "status": "success",
-                    "message": "Admin-login successful"
-                }), 200
-            else:
+    # Retrieve the user from the database
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor(TimedCursor)
+
+                # Check if the username exists (only its password hash is needed)
+                stored_hash = accounts.password_hash(cursor, 'admins', username)
+
+                # If the user does not exist
+                if stored_hash is None:
+                    return jsonify({
+                        "status": "error",
+                        "message": "Username not found"
+                    }), 404
+
+                # Compare the entered password with the stored hash
+                if check_password(password, stored_hash):  # Password match check
+                    login_limiter.success('admin', username)
+                    rehash_if_needed(connection, 'admins', username, password, stored_hash)
+                    return login_success(username, 'admin', "Admin-login successful")
+                else:
+                    login_limiter.failure('admin', username)
+                    return jsonify({
+                        "status": "error",
+                        "message": "Invalid password"
+                    }), 400
+
+            except Error as e:
                 return jsonify({
                     "status": "error",
-                    "message": "Invalid password"
-                }), 400
+                    "message": f"Error accessing database: {e}"
+                }), 500
 
-        except Error as e:
+        else:
             return jsonify({
                 "status": "error",
-                "message": f"Error accessing database: {e}"
+                "message": "Database connection failed"
             }), 500
 
-    else:
-        return jsonify({
-            "status": "error",
-            "message": "Database connection failed"
-        }), 500
+# Rows per IN (...) list / CASE update when working on batches of items
+ITEM_BATCH_SIZE = int(os.getenv("ITEM_BATCH_SIZE", 500))
+
+
+def chunked(rows, size=None):
+    size = size or ITEM_BATCH_SIZE
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+# Key for the items of one request that name the same item, folded like
+# MySQL's default collation. Only used to group a request's own lines: rows
+# are matched to them by the database (see item_lookup_queries()).
+def item_key(item_name, company_name):
+    return ledger.collation_key(item_name), ledger.collation_key(company_name)
+
+
+# Fetch every (item_name, company_name) pair in one statement per chunk,
+# optionally row-locking them. Keys are visited in sorted order so concurrent
+# locking batches can't deadlock each other. Returns {item_key: row}.
+def fetch_items(cursor, pairs, for_update=False):
+    rows = {}
+    for sql, params, keys in item_lookup_queries(pairs, for_update):
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            rows[keys[row.pop('requested')]] = row
+    return rows
+
+
+# The (sql, params, keys) statements fetch_items() runs: one lookup per
+# wanted pair, joined with UNION ALL, each row tagged with the index in keys
+# of the pair it answers. So the column's collation decides which row a
+# pair names, not a fold of the names in Python.
+def item_lookup_queries(pairs, for_update=False):
+    unique = {}
+    for item_name, company_name in pairs:
+        unique.setdefault(item_key(item_name, company_name), (item_name, company_name))
+    lock = " FOR UPDATE" if for_update else ""
+    for keys in chunked(sorted(unique)):
+        yield (
+            " UNION ALL ".join(
+                f"(SELECT {index} AS requested, id, item_name, company_name, quantity, price_per_item FROM items "
+                f"WHERE item_name = %s AND company_name = %s{lock})"
+                for index in range(len(keys))
+            ),
+            [value for key in keys for value in unique[key]],
+            keys
+        )
+
+
+# Items from an /update_inventory payload that are incomplete or not registered
+def find_missing_items(items, rows):
+    missing_items = []
+    for item in items:
+        item_name = item.get('item_name')
+        company_name = item.get('company_name')
+        if not item_name or not company_name:
+            missing_items.append({
+                "item_name": item_name,
+                "company_name": company_name,
+                "error": "Missing item_name or company_name"
+            })
+        elif item_key(item_name, company_name) not in rows:
+            missing_items.append({
+                "item_name": item_name,
+                "company_name": company_name,
+                "error": "Item not found"
+            })
+    return missing_items
+
+
+# Apply add/subtract lines in order against the locked quantities, in memory.
+# quantities ({item id: quantity}) carries the running stock level between
+# lines, so several lines for the same item see each other's effect.
+# Returns the per-line responses; quantities is updated in place, and each
+# applied line is appended to movements as (item id, delta, new quantity).
+def plan_inventory_updates(items, rows, quantities, movements=None):
+    responses = []
+    for item in items:
+        item_name = item.get('item_name')
+        company_name = item.get('company_name')
+        quantity = item.get('quantity')
+        update_type = item.get('type')
+
+        # Basic validations
+        if not all([item_name, company_name, quantity, update_type]):
+            responses.append({"item_name": item_name, "status": "error", "message": "Missing data"})
+            continue
+
+        try:
+            quantity = int(quantity)
+            if quantity <= 0:
+                raise ValueError("Quantity must be a positive integer")
+        except (TypeError, ValueError):
+            responses.append({"item_name": item_name, "status": "error", "message": "Invalid quantity"})
+            continue
+
+        row = rows[item_key(item_name, company_name)]
+        current_quantity = quantities.get(row['id'], row['quantity'])
+
+        # Update logic based on update_type
+        if update_type == 'add':
+            new_quantity = current_quantity + quantity
+        elif update_type == 'subtract':
+            if current_quantity < quantity:
+                responses.append({"item_name": item_name, "status": "error", "message": "Not enough stock"})
+                continue
+            new_quantity = current_quantity - quantity
+        else:
+            responses.append({"item_name": item_name, "status": "error", "message": "Invalid update type"})
+            continue
+
+        quantities[row['id']] = new_quantity
+        if movements is not None:
+            movements.append((row['id'], new_quantity - current_quantity, new_quantity))
+        responses.append({
+            "item_name": item_name,
+            "status": "✅ Success",
+            "message": f"🎉 Inventory updated! New quantity: {new_quantity}"
+        })
+    return responses
+
+
+# Write new quantities ({item id: quantity}) with one CASE update per chunk
+def write_item_quantities(cursor, quantities):
+    for sql, params in item_quantity_updates(quantities):
+        cursor.execute(sql, params)
+
+
+# The (sql, params) statements write_item_quantities() runs
+def item_quantity_updates(quantities):
+    for chunk in chunked(sorted(quantities.items())):
+        cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        placeholders = ", ".join(["%s"] * len(chunk))
+        yield (
+            f"UPDATE items SET quantity = CASE id {cases} END WHERE id IN ({placeholders})",
+            [value for pair in chunk for value in pair] + [item_id for item_id, _ in chunk]
+        )
+
+
+# Optional write-behind aggregation for /update_inventory (INVENTORY_AGGREGATE=1).
+# Till traffic is many tiny single-line requests, each of which would lock
+# the same bestseller rows in its own transaction. Instead the first caller
+# becomes the leader: it waits INVENTORY_AGGREGATE_WINDOW_MS for others to
+# join, then applies every queued request in one transaction, in arrival
+# order, so each caller still gets its own responses and new quantities.
+# Requests arriving during a flush queue up and the next of them leads the
+# following batch. Only helps with threaded workers (gunicorn --threads).
+class InventoryAggregator:
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = []
+        self._leading = False
+        self._counters = {"requests": 0, "batches": 0, "max_batch": 0}
+
+    # Queue one request's lines and wait for its batch to commit. Returns
+    # ("updates", responses), ("missing", details) or ("unavailable", None);
+    # re-raises an error that failed the whole batch.
+    def submit(self, items):
+        entry = {"items": items, "done": threading.Event(), "lead": False, "result": None, "error": None}
+        with self._lock:
+            self._pending.append(entry)
+            self._counters["requests"] += 1
+            lead = entry["lead"] = not self._leading
+            self._leading = True
+        if lead:
+            time.sleep(self.window)
+        else:
+            entry["done"].wait()
+        if entry["lead"]:
+            self._lead()
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["result"]
+
+    def _lead(self):
+        with self._lock:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            self._counters["batches"] += 1
+            self._counters["max_batch"] = max(self._counters["max_batch"], len(batch))
+        try:
+            self._flush(batch)
+        except BaseException as e:
+            for entry in batch:
+                entry["error"] = e
+        finally:
+            with self._lock:
+                # Hand leadership to the oldest request that queued meanwhile
+                if self._pending:
+                    self._pending[0]["lead"] = True
+                    self._pending[0]["done"].set()
+                else:
+                    self._leading = False
+            for entry in batch:
+                entry["lead"] = False
+                entry["done"].set()
+
+    # One transaction for the whole batch: a single locking read of every
+    # item involved, then each request planned in order against the running
+    # quantities. A request that fails is left out without touching the
+    # others' plans.
+    def _flush(self, batch):
+        with db_connection() as connection:
+            if not connection:
+                for entry in batch:
+                    entry["result"] = ("unavailable", None)
+                return
+            cursor = connection.cursor()
+            pairs = [
+                (item.get('item_name'), item.get('company_name'))
+                for entry in batch for item in entry["items"]
+                if isinstance(item, dict) and item.get('item_name') and item.get('company_name')
+            ]
+            rows = fetch_items(cursor, pairs, for_update=True)
+            quantities = {}
+            movements = []
+            for entry in batch:
+                try:
+                    missing_items = find_missing_items(entry["items"], rows)
+                    if missing_items:
+                        entry["result"] = ("missing", missing_items)
+                        continue
+                    planned = dict(quantities)
+                    planned_movements = []
+                    entry["result"] = ("updates", plan_inventory_updates(entry["items"], rows, planned, planned_movements))
+                    quantities = planned
+                    movements.extend(planned_movements)
+                except Exception as e:
+                    entry["error"] = e
+            write_item_quantities(cursor, quantities)
+            ledger.record_movements(cursor, movements, rows)
+            ledger.record_company_totals(cursor, movements, rows)
+            connection.commit()
+            cursor.close()
+        if quantities:
+            items_cache.invalidate()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["queued"] = len(self._pending)
+        stats["window_ms"] = self.window * 1000
+        stats["avg_batch"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+inventory_aggregator = None
+if os.getenv("INVENTORY_AGGREGATE") == "1":
+    inventory_aggregator = InventoryAggregator(
+        window=float(os.getenv("INVENTORY_AGGREGATE_WINDOW_MS", 5)) / 1000,
+        max_batch=int(os.getenv("INVENTORY_AGGREGATE_MAX_BATCH", 100)),
+    )
+    STATS_PROVIDERS["inventory_aggregator"] = inventory_aggregator.stats
+
 
 import traceback  # Add this to log errors
-@wakinjologin.route('/update_inventory', methods=['POST'])
+@api.route('/update_inventory', methods=['POST'])
+@require_token('employee', 'admin', legacy=True)
+@idempotent
 def update_inventory():
     try:
         data = request.json
@@ -392,119 +2985,71 @@ def update_inventory():
         if not data or 'items' not in data or not isinstance(data['items'], list):
             return jsonify({"status": "error", "message": "Invalid input, expecting a list of items."}), 400
 
-        # Get DB connection
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({"status": "error", "message": "Database connection failed"}), 500
-
-        # Use DictCursor (make sure your get_db_connection() sets this)
-        cursor = connection.cursor()  # Assuming get_db_connection() uses DictCursor
-        responses = []
-        missing_items = []
-
-        # --- Pre-check: Verify ALL items exist ---
-        for item in data['items']:
-            item_name = item.get('item_name')
-            company_name = item.get('company_name')
-            if not item_name or not company_name:
-                missing_items.append({
-                    "item_name": item_name,
-                    "company_name": company_name,
-                    "error": "Missing item_name or company_name"
-                })
-                continue
-
-            cursor.execute(
-                "SELECT quantity FROM items WHERE item_name = %s AND company_name = %s",
-                (item_name, company_name)
-            )
-            item_record = cursor.fetchone()
-            if not item_record:
-                missing_items.append({
-                    "item_name": item_name,
-                    "company_name": company_name,
-                    "error": "Item not found"
-                })
-
-        if missing_items:
-            cursor.close()
-            connection.close()
-            return jsonify({
-                "status": "error",
-                "message": "Register this item first!",
-                "details": missing_items
-            }), 404
-
-        # --- All items exist. Proceed with update ---
-        for item in data['items']:
-            item_name = item.get('item_name')
-            company_name = item.get('company_name')
-            quantity = item.get('quantity')
-            update_type = item.get('type')
-
-            # Basic validations
-            if not all([item_name, company_name, quantity, update_type]):
-                responses.append({"item_name": item_name, "status": "error", "message": "Missing data"})
-                continue
-
-            try:
-                quantity = int(quantity)
-                if quantity <= 0:
-                    raise ValueError("Quantity must be a positive integer")
-            except (TypeError, ValueError):
-                responses.append({"item_name": item_name, "status": "error", "message": "Invalid quantity"})
-                continue
-
-            # Retrieve current quantity (we already confirmed the item exists)
-            cursor.execute(
-                "SELECT quantity FROM items WHERE item_name = %s AND company_name = %s",
-                (item_name, company_name)
-            )
-            item_record = cursor.fetchone()
-            current_quantity = item_record["quantity"]
+        if inventory_aggregator is not None:
+            outcome, payload = inventory_aggregator.submit(data['items'])
+            if outcome == "unavailable":
+                return jsonify({"status": "error", "message": "Database connection failed"}), 500
+            if outcome == "missing":
+                return jsonify({
+                    "status": "error",
+                    "message": "Register this item first!",
+                    "details": payload
+                }), 404
+            return jsonify({"updates": payload}), 200
 
-            # Update logic based on update_type
-            if update_type == 'add':
-                new_quantity = current_quantity + quantity
-                cursor.execute(
-                    "UPDATE items SET quantity = %s WHERE item_name = %s AND company_name = %s",
-                    (new_quantity, item_name, company_name)
-                )
-            elif update_type == 'subtract':
-                if current_quantity < quantity:
-                    responses.append({"item_name": item_name, "status": "error", "message": "Not enough stock"})
-                    continue
-                new_quantity = current_quantity - quantity
-                cursor.execute(
-                    "UPDATE items SET quantity = %s WHERE item_name = %s AND company_name = %s",
-                    (new_quantity, item_name, company_name)
-                )
-            else:
-                responses.append({"item_name": item_name, "status": "error", "message": "Invalid update type"})
-                continue
+        # Get DB connection
+        with db_connection() as connection:
+            if not connection:
+                return jsonify({"status": "error", "message": "Database connection failed"}), 500
+
+            # Use DictCursor (make sure your get_db_connection() sets this)
+            cursor = connection.cursor()  # Assuming get_db_connection() uses DictCursor
+
+            # --- Pre-check: Verify ALL items exist (one locking read for the whole batch) ---
+            pairs = [
+                (item.get('item_name'), item.get('company_name'))
+                for item in data['items']
+                if item.get('item_name') and item.get('company_name')
+            ]
+            rows = fetch_items(cursor, pairs, for_update=True)
+            missing_items = find_missing_items(data['items'], rows)
+
+            if missing_items:
+                connection.rollback()
+                cursor.close()
+                return jsonify({
+                    "status": "error",
+                    "message": "Register this item first!",
+                    "details": missing_items
+                }), 404
 
-            responses.append({
-                "item_name": item_name,
-                "status": "✅ Success",
-                "message": f"🎉 Inventory updated! New quantity: {new_quantity}"
-            })
+            # --- All items exist. Validate in memory, then write once ---
+            quantities = {}
+            movements = []
+            responses = plan_inventory_updates(data['items'], rows, quantities, movements)
+            write_item_quantities(cursor, quantities)
+            ledger.record_movements(cursor, movements, rows)
+            ledger.record_company_totals(cursor, movements, rows)
 
-        connection.commit()
-        cursor.close()
-        connection.close()
+            connection.commit()
+            cursor.close()
+            if quantities:
+                items_cache.invalidate()
 
-        return jsonify({"updates": responses}), 200
+            return jsonify({"updates": responses}), 200
 
     except Error as db_err:
         traceback.print_exc()
+        metrics.inc("errors_total", (("kind", "update_inventory_db"),))
         return jsonify({"status": "error", "message": f"Database error: {str(db_err)}"}), 500
 
     except Exception as e:
         traceback.print_exc()
+        metrics.inc("errors_total", (("kind", "update_inventory_server"),))
         return jsonify({"status": "error", "message": f"Server error: {str(e)}"}), 500
 
 # Define the route that accepts a GET request to check if the username and password exist
-@wakinjologin.route('/check_user_exists', methods=['GET'])
+@api.route('/check_user_exists', methods=['GET'])
 def check_user_exists():
     # Get 'username' and 'password' from query parameters
     username = request.args.get('username')
@@ -517,124 +3062,790 @@ def check_user_exists():
             "message": "Username and password are required"
         }), 400
 
-    # Retrieve the user from the database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    # Recently verified credentials skip the lookup and bcrypt
+    if credential_cache.lookup('employee', username, password):
+        return jsonify({
+            "status": "success",
+            "message": "User exists and password matches"
+        }), 200
 
-            # Check if the username exists
-            cursor.execute("SELECT * FROM employees WHERE username = %s", (username,))
-            user = cursor.fetchone()
+    # Over-limit or locked-out attempts stop here, before the lookup and bcrypt
+    retry_after = login_limiter.check('employee', username, client_ip())
+    if retry_after:
+        return too_many_attempts(retry_after)
 
-            # If the user does not exist
-            if not user:
-                return jsonify({
-                    "status": "error",
-                    "message": "Username not found"
-                }), 404
+    # Unknown usernames are answered without touching the database
+    if not username_indexes['employees'].might_exist(username):
+        return jsonify({
+            "status": "error",
+            "message": "Username not found"
+        }), 404
 
-            # Compare the entered password with the stored hash
-            if bcrypt.checkpw(password.encode('utf-8'), user['passwd'].encode('utf-8')):
-                return jsonify({
-                    "status": "success",
-                    "message": "User exists and password matches"
-                }), 200
-            else:
+    # Retrieve the user from the database
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor(TimedCursor)
+
+                # Check if the username exists (only its password hash is needed)
+                stored_hash = accounts.password_hash(cursor, 'employees', username)
+
+                # If the user does not exist
+                if stored_hash is None:
+                    return jsonify({
+                        "status": "error",
+                        "message": "Username not found"
+                    }), 404
+
+                # Compare the entered password with the stored hash
+                if check_password(password, stored_hash):
+                    login_limiter.success('employee', username)
+                    credential_cache.remember('employee', username, password)
+                    return jsonify({
+                        "status": "success",
+                        "message": "User exists and password matches"
+                    }), 200
+                else:
+                    login_limiter.failure('employee', username)
+                    return jsonify({
+                        "status": "error",
+                        "message": "Invalid password"
+                    }), 400
+
+            except Error as e:
                 return jsonify({
                     "status": "error",
-                    "message": "Invalid password"
-                }), 400
+                    "message": f"Error accessing database: {e}"
+                }), 500
 
-        except Error as e:
+        else:
             return jsonify({
                 "status": "error",
-                "message": f"Error accessing database: {e}"
+                "message": "Database connection failed"
             }), 500
 
+# Columns clients may request with ?fields= on the listing endpoints
+EMPLOYEE_FIELDS = ("worker_id", "username", "phone_number")
+ITEM_FIELDS = ("id", "item_name", "quantity", "company_name", "price_per_item")
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 1000))
+
+
+# Integer query parameter, or None when it is absent
+def int_arg(name, args=None):
+    value = (request.args if args is None else args).get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+# Parse ?fields=, ?limit=, ?after= and ?format= for a keyset-paginated listing.
+# Without limit/after the whole table is returned, as before.
+def parse_listing_args(allowed_fields, args=None):
+    args = request.args if args is None else args
+    fields = args.get('fields')
+    if fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in allowed_fields]
+        if unknown or not fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
     else:
+        fields = list(allowed_fields)
+
+    if args.get('format', 'json') not in ('json',) + tuple(EXPORT_FORMATS):
+        raise ValueError(f"format must be one of: json, {', '.join(EXPORT_FORMATS)}")
+
+    limit = int_arg('limit', args)
+    if limit is not None:
+        if limit <= 0:
+            raise ValueError("limit must be a positive integer")
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    return fields, limit, args.get('after')
+
+
+# Listing arguments for /get_items, plus its filters (?company_name= and
+# ?low_stock_below=) as SQL conditions: (fields, limit, after, conditions, params)
+def parse_item_listing_args(args=None):
+    args = request.args if args is None else args
+    fields, limit, after = parse_listing_args(ITEM_FIELDS, args)
+    after = int_arg('after', args)
+    conditions = []
+    params = []
+    company_name = args.get('company_name')
+    if company_name:
+        conditions.append("company_name = %s")
+        params.append(company_name)
+    low_stock_below = int_arg('low_stock_below', args)
+    if low_stock_below is not None:
+        conditions.append("quantity < %s")
+        params.append(low_stock_below)
+    return fields, limit, after, conditions, params
+
+
+# SELECT for a listing ordered by key_field, starting after the given key
+def listing_query(table, key_field, columns, conditions, params, limit, after):
+    conditions = list(conditions)
+    params = list(params)
+    if after is not None:
+        conditions.append(f"{key_field} > %s")
+        params.append(after)
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {key_field}"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+
+# Select one page ordered by key_field, starting after the given key. One
+# extra row is fetched to tell whether another page follows; next_after is
+# the key to pass as ?after= for it (None on the last page).
+def select_page(cursor, table, key_field, fields, conditions, params, limit, after):
+    columns = list(fields) if key_field in fields else [key_field] + list(fields)
+    sql, params = listing_query(table, key_field, columns, conditions, params,
+                                None if limit is None else limit + 1, after)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1][key_field]
+    if key_field not in fields:
+        for row in rows:
+            del row[key_field]
+    return rows, next_after
+
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 500))
+
+
+# Stream a listing as NDJSON or CSV straight off an unbuffered server-side
+# cursor, a chunk of rows at a time, so worker memory stays flat however big
+# the table is. The pooled connection is held until the response is closed;
+# if the client goes away mid-stream it is discarded rather than drained.
+def stream_export(sql, params, fields, export_format, filename):
+    connection = db_pool.acquire()
+    if not connection:
         return jsonify({
             "status": "error",
             "message": "Database connection failed"
         }), 500
+    cursor = connection.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cursor.execute(sql, params)
+    except Error as e:
+        db_pool.release(connection, discard=True)
+        return jsonify({
+            "status": "error",
+            "message": f"Error accessing database: {e}"
+        }), 500
 
-@wakinjologin.route('/get_employees', methods=['GET'])
+    state = {"finished": False}
+    dumps = current_app.json.dumps
+
+    def generate():
+        if export_format == "csv":
+            import csv
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+            writer.writeheader()
+            yield buffer.getvalue()
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            if export_format == "csv":
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(dumps(row) + "\n" for row in rows)
+        cursor.close()
+        state["finished"] = True
+
+    def release():
+        db_pool.release(connection, discard=not state["finished"])
+
+    response = Response(generate(), mimetype=EXPORT_FORMATS[export_format])
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}.{export_format}"
+    response.call_on_close(release)
+    return response
+
+
+# In-process cache of /get_items JSON responses. Entries belong to a
+# catalogue version held in a SharedCounter; /item_register and
+# /update_inventory bump it after they commit, which retires every cached
+# response in every worker at once. The ETag is derived from the version and
+# the query alone, so a matching If-None-Match is answered with 304 before
+# any cache or database work. Each entry keeps the encoded JSON and, once
+# asked for, its gzip/brotli forms, so a hit is neither re-serialized nor
+# re-compressed.
+class ItemsCache:
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._version = SharedCounter("items.version")
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (version, query) -> (etag, {encoding: body})
+        self._counters = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "compressions": 0}
+
+    def version(self):
+        return self._version.value()
+
+    @staticmethod
+    def etag(version, query):
+        return f"items-{version}-{hashlib.sha1(repr(query).encode('utf-8')).hexdigest()[:16]}"
+
+    def count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def get(self, version, query):
+        with self._lock:
+            entry = self._entries.get((version, query))
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end((version, query))
+            self._counters["hits"] += 1
+            return entry
+
+    def put(self, version, query, body):
+        with self._lock:
+            # Entries for older versions can never be hit again
+            for key in [key for key in self._entries if key[0] != version]:
+                del self._entries[key]
+            entry = (self.etag(version, query), {"identity": body})
+            self._entries[(version, query)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    # Body of an entry in the given content encoding, compressed on first
+    # use. Two threads may both compress a missing form; either result is
+    # kept, so that needs no lock.
+    def encoded(self, entry, encoding):
+        bodies = entry[1]
+        body = bodies.get(encoding)
+        if body is None:
+            body = bodies[encoding] = compress(bodies["identity"], encoding)
+            self.count("compressions")
+        return body
+
+    def invalidate(self):
+        self._version.bump()
+        with self._lock:
+            self._entries.clear()
+            self._counters["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"entries": len(self._entries), "max_entries": self.max_entries})
+        stats["version"] = self.version()
+        return stats
+
+
+items_cache = ItemsCache(max_entries=int(os.getenv("ITEMS_CACHE_ENTRIES", 64)))
+STATS_PROVIDERS["items_cache"] = items_cache.stats
+
+
+# JSON response for a cached /get_items entry, in the encoding the client
+# accepts, revalidated by the client
+def cached_items_response(entry):
+    encoding = negotiate_encoding(request.accept_encodings, len(entry[1]["identity"]))
+    response = Response(items_cache.encoded(entry, encoding or "identity"), status=200,
+                        mimetype="application/json")
+    response.set_etag(entry[0], weak=encoding is not None)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@api.route('/get_employees', methods=['GET'])
+@require_token('admin', legacy=True)
 def get_employees():
+    try:
+        fields, limit, after = parse_listing_args(EMPLOYEE_FIELDS)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    # ?format=ndjson|csv streams the listing instead of building one JSON document
+    export_format = request.args.get('format')
+    if export_format in EXPORT_FORMATS:
+        sql, params = listing_query("employees", "worker_id", fields, [], [], limit, after)
+        return stream_export(sql, params, fields, export_format, "employees")
+
     # Retrieve the employees from the database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor()
 
-            # Retrieve all employees from the database
-            cursor.execute("SELECT worker_id, username, phone_number FROM employees")
-            employees = cursor.fetchall()
+                # Retrieve one page (or all) of the employees from the database
+                employees, next_after = select_page(cursor, "employees", "worker_id", fields, [], [], limit, after)
 
-            # If no employees exist
-            if not employees:
+                # If no employees exist
+                if not employees and after is None:
+                    return jsonify({
+                        "status": "error",
+                        "message": "No employees found"
+                    }), 404
+
+                # Return the list of employees
+                response = {
+                    "status": "success",
+                    "message": "Employees retrieved successfully",
+                    "data": employees
+                }
+                if limit is not None:
+                    response["next_after"] = next_after
+                return jsonify(response), 200
+
+            except Error as e:
                 return jsonify({
                     "status": "error",
-                    "message": "No employees found"
-                }), 404
-
-            # Return the list of employees
-            return jsonify({
-                "status": "success",
-                "message": "Employees retrieved successfully",
-                "data": employees
-            }), 200
+                    "message": f"Error accessing database: {e}"
+                }), 500
 
-        except Error as e:
+        else:
             return jsonify({
                 "status": "error",
-                "message": f"Error accessing database: {e}"
+                "message": "Database connection failed"
             }), 500
-
-    else:
+@api.route('/get_items', methods=['GET'])
+def get_items():
+    # Optional filters: ?company_name= and ?low_stock_below=
+    try:
+        fields, limit, after, conditions, params = parse_item_listing_args()
+    except ValueError as e:
         return jsonify({
             "status": "error",
-            "message": "Database connection failed"
-        }), 500
-@wakinjologin.route('/get_items', methods=['GET'])
-def get_items():
-    # Retrieve the employees from the database
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+            "message": str(e)
+        }), 400
+
+    # ?format=ndjson|csv streams the listing instead of building one JSON document
+    export_format = request.args.get('format')
+    if export_format in EXPORT_FORMATS:
+        sql, params = listing_query("items", "id", fields, conditions, params, limit, after)
+        return stream_export(sql, params, fields, export_format, "items")
+
+    # Unchanged catalogue: answer from the ETag or the cache without touching MySQL
+    version = items_cache.version()
+    query = tuple(sorted(request.args.items(multi=True)))
+    etag = items_cache.etag(version, query)
+    if request.if_none_match.contains_weak(etag):
+        items_cache.count("not_modified")
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    cached = items_cache.get(version, query)
+    if cached:
+        return cached_items_response(cached)
+
+    # Retrieve the items from the database
+    with db_connection() as connection:
+        if connection:
+            try:
+                cursor = connection.cursor()
+
+                # Retrieve one page (or all) of the items from the database
+                items, next_after = select_page(cursor, "items", "id", fields, conditions, params, limit, after)
 
-            # Retrieve all items from the database
-            cursor.execute("SELECT id, item_name, quantity, company_name, price_per_item FROM items")
-            items = cursor.fetchall()
+                # If no items exist
+                if not items and after is None:
+                    return jsonify({
+                        "status": "error",
+                        "message": "No items found"
+                    }), 404
 
-            # If no items exist
-            if not items:
+                # Return the list of items
+                response = {
+                    "status": "success",
+                    "message": "items retrieved successfully",
+                    "data": items
+                }
+                if limit is not None:
+                    response["next_after"] = next_after
+                return cached_items_response(items_cache.put(version, query, json_bytes(response) + b"\n"))
+
+            except Error as e:
                 return jsonify({
                     "status": "error",
-                    "message": "No items found"
-                }), 404
+                    "message": f"Error accessing database: {e}"
+                }), 500
 
-            # Return the list of items
+        else:
             return jsonify({
-                "status": "success",
-                "message": "items retrieved successfully",
-                "data": items
-            }), 200
+                "status": "error",
+                "message": "Database connection failed"
+            }), 500
+
+
+def date_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+
+
+# Shared body of the ledger reports. ?company_name= narrows to one company,
+# ?item_name= (with company_name) to one item. report(cursor, item_id)
+# returns the rows; summary(rows), if given, adds fields to the response.
+# Snapshot reports reflect movements up to as_of_movement (see
+# refresh-snapshots); live reports read the current totals.
+def ledger_report(report, summary=None, snapshot=True):
+    item_name = request.args.get('item_name')
+    company_name = request.args.get('company_name')
+    if item_name and not company_name:
+        return jsonify({
+            "status": "error",
+            "message": "item_name needs company_name"
+        }), 400
 
+    with db_connection() as connection:
+        if not connection:
+            return jsonify({
+                "status": "error",
+                "message": "Database connection failed"
+            }), 500
+        try:
+            cursor = connection.cursor()
+            item_id = None
+            if item_name:
+                cursor.execute(
+                    "SELECT id FROM items WHERE item_name = %s AND company_name = %s", (item_name, company_name)
+                )
+                item = cursor.fetchone()
+                if not item:
+                    return jsonify({
+                        "status": "error",
+                        "message": "Item not found"
+                    }), 404
+                item_id = item['id']
+            rows = report(cursor, item_id)
+            as_of = ledger.snapshot_watermark(cursor) if snapshot else None
+            cursor.close()
         except Error as e:
             return jsonify({
                 "status": "error",
                 "message": f"Error accessing database: {e}"
             }), 500
 
+    response = {
+        "status": "success",
+        "data": [ledger.report_row(row) for row in rows]
+    }
+    if snapshot:
+        response["as_of_movement"] = as_of
+    if summary:
+        response.update(summary(rows))
+    return jsonify(response), 200
+
+
+# Closing stock and value at the end of ?date= (default today)
+@api.route('/reports/stock_at', methods=['GET'])
+@require_token('admin')
+def report_stock_at():
+    try:
+        day = date_arg('date', datetime.date.today())
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    company_name = request.args.get('company_name')
+    return ledger_report(lambda cursor, item_id: ledger.stock_at(cursor, day, company_name, item_id))
+
+
+# Units in and out from ?from= to ?to= (default the last 30 days)
+@api.route('/reports/turnover', methods=['GET'])
+@require_token('admin')
+def report_turnover():
+    try:
+        end = date_arg('to', datetime.date.today())
+        start = date_arg('from', end - datetime.timedelta(days=30))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if start > end:
+        return jsonify({"status": "error", "message": "from must not be after to"}), 400
+    company_name = request.args.get('company_name')
+    return ledger_report(lambda cursor, item_id: ledger.turnover(cursor, start, end, company_name, item_id))
+
+
+# Stock value (quantity * price_per_item) per company at the end of ?date=,
+# with the total
+@api.route('/reports/valuation', methods=['GET'])
+@require_token('admin')
+def report_valuation():
+    try:
+        day = date_arg('date', datetime.date.today())
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    company_name = request.args.get('company_name')
+    return ledger_report(
+        lambda cursor, item_id: ledger.stock_at(cursor, day, company_name, item_id),
+        lambda rows: {"total_value": str(sum((row['closing_value'] for row in rows), Decimal(0)))}
+    )
+
+
+# Live totals per company: item count, units in stock and stock value
+@api.route('/reports/company_value', methods=['GET'])
+@require_token('admin')
+def report_company_value():
+    company_name = request.args.get('company_name')
+    return ledger_report(
+        lambda cursor, item_id: ledger.company_value(cursor, company_name),
+        lambda rows: {"total_value": str(sum((row['total_value'] for row in rows), Decimal(0)))},
+        snapshot=False
+    )
+
+
+# Items with fewer than ?below= (default 10) units, lowest first
+@api.route('/reports/low_stock', methods=['GET'])
+@require_token('admin')
+def report_low_stock():
+    try:
+        below = int_arg('below')
+        limit = int_arg('limit')
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    below = 10 if below is None else below
+    limit = max(1, min(MAX_PAGE_SIZE, limit or 100))
+    company_name = request.args.get('company_name')
+    return ledger_report(lambda cursor, item_id: ledger.low_stock(cursor, below, limit, company_name), snapshot=False)
+
+
+# The ?limit= (default 10) items with the highest stock value
+@api.route('/reports/top_items', methods=['GET'])
+@require_token('admin')
+def report_top_items():
+    try:
+        limit = int_arg('limit')
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    limit = max(1, min(MAX_PAGE_SIZE, limit or 10))
+    company_name = request.args.get('company_name')
+    return ledger_report(lambda cursor, item_id: ledger.top_items(cursor, limit, company_name), snapshot=False)
+
+
+# Recompute the per-company totals from items, e.g. after editing items by hand:
+#   flask --app wakinjologin rebuild-aggregates
+@api.cli.command("rebuild-aggregates")
+def rebuild_aggregates_command():
+    with db_connection() as connection:
+        if not connection:
+            raise click.ClickException("Database connection failed")
+        cursor = connection.cursor()
+        ledger.rebuild_company_totals(cursor)
+        connection.commit()
+        cursor.close()
+    click.echo("Company totals rebuilt")
+
+
+# Fold new inventory movements into the daily snapshots:
+#   flask --app wakinjologin refresh-snapshots
+@api.cli.command("refresh-snapshots")
+def refresh_snapshots_command():
+    with db_connection() as connection:
+        if not connection:
+            raise click.ClickException("Database connection failed")
+        applied = ledger.refresh_snapshots(connection)
+    click.echo(f"Applied {applied} movement(s) to the snapshots")
+
+
+# Every SNAPSHOT_REFRESH_INTERVAL seconds (0 disables) each worker tries a
+# refresh; the watermark row lock makes concurrent refreshes take turns.
+def refresh_snapshots_periodically(interval):
+    while True:
+        time.sleep(interval)
+        with db_connection() as connection:
+            if not connection:
+                continue
+            try:
+                ledger.refresh_snapshots(connection)
+            except Error as e:
+                print(f"Snapshot refresh failed: {e}")
+
+
+SNAPSHOT_REFRESH_INTERVAL = float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", 300))
+if SNAPSHOT_REFRESH_INTERVAL > 0:
+    BACKGROUND_TASKS.append(("snapshot-refresh", refresh_snapshots_periodically, (SNAPSHOT_REFRESH_INTERVAL,)))
+
+
+# Apply pending schema migrations (tables and indexes, see migrations.py):
+#   flask --app wakinjologin migrate
+@api.cli.command("migrate")
+@click.option("--check", is_flag=True, help="Only list pending migrations.")
+def migrate_command(check):
+    with db_connection() as connection:
+        if not connection:
+            raise click.ClickException("Database connection failed")
+        try:
+            if check:
+                for version, description in migrations.pending_migrations(connection):
+                    click.echo(f"Pending migration {version}: {description}")
+                return
+            applied = migrations.migrate(connection, echo=click.echo)
+        except migrations.MigrationError as e:
+            raise click.ClickException(str(e))
+    click.echo(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+
+
+# EXPLAIN the hot queries and report any that would scan a whole table:
+#   flask --app wakinjologin check-query-plans
+@api.cli.command("check-query-plans")
+def check_query_plans_command():
+    with db_connection() as connection:
+        if not connection:
+            raise click.ClickException("Database connection failed")
+        warnings = migrations.check_query_plans(connection)
+    for warning in warnings:
+        click.echo(f"WARNING: {warning}")
+    click.echo(f"{len(migrations.HOT_QUERIES) - len(warnings)} of {len(migrations.HOT_QUERIES)} hot queries use an index")
+
+
+# Startup self-check: with DB_AUTO_MIGRATE=1 pending migrations are applied
+# (otherwise they are logged), then (unless DB_STARTUP_CHECK=0) the hot queries are EXPLAINed and any full
+# table scan is logged. Runs in the background so startup isn't blocked on
+# the database.
+def startup_self_check():
+    with db_connection() as connection:
+        if not connection:
+            print("Startup self-check skipped: database connection failed")
+            return
+        try:
+            if os.getenv("DB_AUTO_MIGRATE") == "1":
+                migrations.migrate(connection)
+            else:
+                pending = migrations.pending_migrations(connection)
+                for version, description in pending:
+                    print(f"Migration {version} is pending: {description}")
+                if pending:
+                    print("Run `flask --app wakinjologin migrate` (or set DB_AUTO_MIGRATE=1); "
+                          "/readyz reports not ready until then")
+            if os.getenv("DB_STARTUP_CHECK", "1") != "0":
+                for warning in migrations.check_query_plans(connection):
+                    print(f"Query plan warning: {warning}")
+        except (Error, migrations.MigrationError) as e:
+            print(f"Startup self-check failed: {e}")
+
+
+if os.getenv("DB_AUTO_MIGRATE") == "1" or os.getenv("DB_STARTUP_CHECK", "1") != "0":
+    BACKGROUND_TASKS.append(("startup-self-check", startup_self_check, ()))
+
+
+# Measure bcrypt hash/verify latency per cost factor on this machine and
+# recommend the highest cost that fits the latency budget:
+#   flask --app wakinjologin bcrypt-benchmark --target-ms 250
+@api.cli.command("bcrypt-benchmark")
+@click.option("--min-rounds", default=8, show_default=True, help="Lowest cost factor to measure.")
+@click.option("--max-rounds", default=15, show_default=True, help="Highest cost factor to measure.")
+@click.option("--target-ms", default=250.0, show_default=True, help="Latency budget for one verification.")
+@click.option("--samples", default=3, show_default=True, help="Timed runs per cost factor.")
+def bcrypt_benchmark(min_rounds, max_rounds, target_ms, samples):
+    password = b"benchmark-password"
+    recommended = None
+    click.echo(f"{'rounds':>6} {'hash ms':>10} {'verify ms':>10}")
+    for rounds in range(max(min_rounds, 4), min(max_rounds, 31) + 1):
+        hash_times = []
+        verify_times = []
+        for _ in range(max(samples, 1)):
+            started = time.perf_counter()
+            hashed_password = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+            hash_times.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            bcrypt.checkpw(password, hashed_password)
+            verify_times.append((time.perf_counter() - started) * 1000)
+        hash_ms = sorted(hash_times)[len(hash_times) // 2]
+        verify_ms = sorted(verify_times)[len(verify_times) // 2]
+        marker = " *" if rounds == BCRYPT_ROUNDS else ""
+        click.echo(f"{rounds:>6} {hash_ms:>10.1f} {verify_ms:>10.1f}{marker}")
+        if verify_ms <= target_ms:
+            recommended = rounds
+        else:
+            # Each extra round doubles the cost, no point measuring further
+            break
+    click.echo(f"Configured: BCRYPT_ROUNDS={BCRYPT_ROUNDS} (marked *)")
+    if recommended is None:
+        click.echo(f"No cost factor >= {min_rounds} verifies within {target_ms} ms on this machine")
     else:
-        return jsonify({
-            "status": "error",
-            "message": "Database connection failed"
-        }), 500
+        click.echo(f"Recommended for a {target_ms} ms budget: BCRYPT_ROUNDS={recommended}")
+
+
+# Build the connection pool, the hashing pool and the username filters and
+# register their stats and background maintenance. Once per process; the
+# pools themselves only connect or start workers when first used.
+def init_resources():
+    global db_pool, hashing_pool, username_indexes
+    if db_pool is not None:
+        return
+    db_pool = ConnectionPool(
+        get_db_connection,
+        min_size=int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+        max_size=int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+        recycle=float(os.getenv("DB_POOL_RECYCLE", 3600)),
+        ping_interval=float(os.getenv("DB_POOL_PING_INTERVAL", 30)),
+    )
+    STATS_PROVIDERS["db_pool"] = db_pool.stats
+
+    hashing_pool = HashingPool(
+        workers=int(os.getenv("HASH_WORKERS", os.cpu_count() or 1)),
+        queue_size=int(os.getenv("HASH_QUEUE_SIZE", 16)),
+        kind=os.getenv("HASH_EXECUTOR", "thread"),
+        retry_after=int(os.getenv("HASH_RETRY_AFTER", 1)),
+    )
+    STATS_PROVIDERS["hashing_pool"] = hashing_pool.stats
+
+    # Log entries are kept for two reconcile intervals, so every worker has
+    # rebuilt from the table since
+    username_indexes = {
+        table: UsernameIndex(table, enabled=USERNAME_INDEX, keep=2 * USERNAME_INDEX_RECONCILE)
+        for table in ("employees", "admins")
+    }
+    for table, index in username_indexes.items():
+        STATS_PROVIDERS[f"usernames_{table}"] = index.stats
+    if USERNAME_INDEX:
+        BACKGROUND_TASKS.append(
+            ("username-index", maintain_username_indexes, (USERNAME_INDEX_RECONCILE,))
+        )
+
+
+# Build the Flask app: set up the pools and filters the routes use (see
+# init_resources(), a no-op after the first call), then wire the app object
+# together. Tests and tools can call it to make their own app.
+def create_app():
+    started = time.perf_counter()
+    init_resources()
+    app = Flask(__name__)
+    app.json = TimedJSONProvider(app)
+    CORS(app, origins=os.getenv("CORS_ORIGINS", "*").split(","))
+    app.register_blueprint(api)
+    startup["create_app"] = time.perf_counter() - started
+    return app
+
+
+startup["import"] = time.perf_counter() - IMPORT_STARTED
+wakinjologin = create_app()
 
 
 # Run the application
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 10000))  # Use Render's allowed port  
+    start_background_tasks()
+    if PREWARM:
+        warm_up()
     wakinjologin.run(host="0.0.0.0", port=port)  
\ No newline at end of file
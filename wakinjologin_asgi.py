@@ -0,0 +1,888 @@
+# ASGI entry point: the same routes and JSON contracts as wakinjologin.py,
+# served natively async. MySQL goes through an aiomysql pool and bcrypt work
+# is awaited on the shared hashing pool, so one process can keep thousands of
+# requests in flight without a thread each. Routes that only exist in the
+# Flask app (bulk registration, ...) are passed through to it.
+#
+#   uvicorn wakinjologin_asgi:application --workers 2
+import asyncio
+import csv
+import functools
+import io
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql
+from asgiref.wsgi import WsgiToAsgi
+from pymysql import Error
+from quart import Quart, Response, g, request, jsonify
+
+import accounts
+import ledger
+import wakinjologin as wsgi
+from wakinjologin import (
+    BCRYPT_ROUNDS, DEBUG_QUERIES, EMPLOYEE_FIELDS, ER_DUP_ENTRY, EXPORT_FORMATS, EXPORT_CHUNK_ROWS, QUERY_TRACE,
+    STATS_PROVIDERS, QueryTrace, current_trace, query_traces,
+    HashingBusy, IdempotencyStore, TimedJSONProvider, _bcrypt_check, _bcrypt_hash, authorize, bcrypt_rounds,
+    compress, compressible, credential_cache, json_bytes, negotiate_encoding, weaken_etag,
+    find_missing_items, idempotency, idempotency_scope, issue_token, item_lookup_queries, item_quantity_updates, items_cache, listing_query,
+    login_limiter, metrics, parse_item_listing_args, parse_listing_args, plan_inventory_updates,
+    record_statement, request_fingerprint, revocations,
+)
+
+wsgi.init_resources()
+app = Quart(__name__)
+app.json = TimedJSONProvider(app)
+
+db_pool = None
+
+
+# Async counterpart of wakinjologin.TimedCursorMixin; aiomysql also runs
+# executemany() through execute()
+class TimedCursorMixin:
+    _in_batch = False
+
+    async def execute(self, query, args=None):
+        if self._in_batch:
+            return await super().execute(query, args)
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, args)
+        finally:
+            record_statement(self, query, args is not None, time.perf_counter() - started)
+
+    async def executemany(self, query, args):
+        started = time.perf_counter()
+        self._in_batch = True
+        try:
+            return await super().executemany(query, args)
+        finally:
+            self._in_batch = False
+            record_statement(self, query, True, time.perf_counter() - started)
+
+
+class TimedDictCursor(TimedCursorMixin, aiomysql.DictCursor):
+    pass
+
+
+class TimedCursor(TimedCursorMixin, aiomysql.Cursor):
+    pass
+
+
+@app.before_serving
+async def open_db_pool():
+    global db_pool
+    db_pool = await aiomysql.create_pool(
+        host=os.getenv("host"),
+        user=os.getenv("user"),
+        password=os.getenv("password"),
+        db=os.getenv("database"),
+        port=int(os.getenv("port", 3306)),
+        charset='utf8mb4',
+        cursorclass=TimedDictCursor,
+        # aiomysql closes connections released mid-transaction, so reads run
+        # in autocommit and writes open their transaction explicitly
+        autocommit=True,
+        minsize=int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+        maxsize=int(os.getenv("ASYNC_DB_POOL_MAX_SIZE", os.getenv("DB_POOL_MAX_SIZE", 10))),
+        pool_recycle=int(float(os.getenv("DB_POOL_RECYCLE", 3600))),
+    )
+    wsgi.start_background_tasks()
+    if wsgi.PREWARM:
+        # Hashing workers and the pool behind the pass-through routes
+        await asyncio.to_thread(wsgi.warm_up)
+
+
+@app.after_serving
+async def close_db_pool():
+    if db_pool is not None:
+        db_pool.close()
+        await db_pool.wait_closed()
+
+
+# Async counterpart of wakinjologin.db_connection(): yields None when no
+# connection could be had within DB_POOL_TIMEOUT, rolls back anything left
+# open and drops the connection after a database error.
+@asynccontextmanager
+async def db_connection():
+    try:
+        connection = await asyncio.wait_for(db_pool.acquire(), float(os.getenv("DB_POOL_TIMEOUT", 5)))
+    except (asyncio.TimeoutError, Error) as e:
+        print(f"Error connecting to MySQL: {e!r}")
+        metrics.inc("errors_total", (("kind", "db_connect"),))
+        connection = None
+    try:
+        yield connection
+    except BaseException as e:
+        if connection and (isinstance(e, Error) or not isinstance(e, Exception)):
+            connection.close()
+        raise
+    finally:
+        if connection:
+            if not connection.closed and connection.get_transaction_status():
+                try:
+                    await connection.rollback()
+                except Error:
+                    connection.close()
+            db_pool.release(connection)
+
+
+def async_pool_stats():
+    if db_pool is None:
+        return {}
+    return {
+        "size": db_pool.size,
+        "idle": db_pool.freesize,
+        "in_use": db_pool.size - db_pool.freesize,
+        "min_size": db_pool.minsize,
+        "max_size": db_pool.maxsize,
+    }
+
+
+async def hash_password(password):
+    hashed_password = await asyncio.wrap_future(
+        wsgi.hashing_pool.submit(_bcrypt_hash, password.encode('utf-8'), BCRYPT_ROUNDS))
+    return hashed_password.decode('utf-8')
+
+
+async def check_password(password, hashed_password):
+    return await asyncio.wrap_future(
+        wsgi.hashing_pool.submit(_bcrypt_check, password.encode('utf-8'), hashed_password.encode('utf-8')))
+
+
+# Async counterpart of wakinjologin.rehash_if_needed()
+async def rehash_if_needed(connection, table, username, password, stored_hash):
+    if bcrypt_rounds(stored_hash) == BCRYPT_ROUNDS:
+        return stored_hash
+    try:
+        new_hash = await hash_password(password)
+        async with connection.cursor(TimedCursor) as cursor:
+            await cursor.execute(accounts.REHASH_SQL[table], (new_hash, username, stored_hash))
+        return new_hash
+    except (Error, HashingBusy) as e:
+        print(f"Could not rehash password for {username}: {e!r}")
+        return stored_hash
+
+
+@app.errorhandler(HashingBusy)
+async def hashing_busy(e):
+    response = jsonify({
+        "status": "error",
+        "message": "Server busy, please retry shortly"
+    })
+    response.headers["Retry-After"] = str(wsgi.hashing_pool.retry_after)
+    return response, 503
+
+
+def client_ip():
+    if os.getenv("TRUST_X_FORWARDED_FOR") == "1" and request.headers.get("X-Forwarded-For"):
+        return request.headers["X-Forwarded-For"].split(",")[0].strip()
+    return request.remote_addr
+
+
+def too_many_attempts(retry_after):
+    response = jsonify({
+        "status": "error",
+        "message": "Too many attempts, please retry later"
+    })
+    response.headers["Retry-After"] = str(max(math.ceil(retry_after), 1))
+    return response, 429
+
+
+# Async counterpart of wakinjologin.require_token()
+def require_token(*roles, legacy=False):
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            claims, error = authorize(request.headers, roles, legacy)
+            if error:
+                return jsonify({
+                    "status": "error",
+                    "message": error[0]
+                }), error[1]
+            g.token_claims = claims
+            return await view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Async counterpart of wakinjologin.idempotent(); the claim and the stored
+# response go through the same store, on a worker thread
+def idempotent(view):
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return await view(*args, **kwargs)
+        if len(key) > IdempotencyStore.MAX_KEY_LENGTH:
+            return jsonify({
+                "status": "error",
+                "message": f"Idempotency-Key must be at most {IdempotencyStore.MAX_KEY_LENGTH} characters"
+            }), 400
+
+        scope = idempotency_scope(request.path, g.get("token_claims"))
+        form = await request.form
+        body = await request.get_data()
+        fingerprint = request_fingerprint(request.method, request.path, request.query_string.decode('latin-1'),
+                                          body, form.items(multi=True))
+        outcome, stored = await asyncio.to_thread(idempotency.begin, scope, key, fingerprint)
+        if outcome == "replay":
+            status, stored_body, mimetype = stored
+            response = Response(stored_body, status=status, mimetype=mimetype)
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+        if outcome == "in_progress":
+            response = jsonify({
+                "status": "error",
+                "message": "A request with this Idempotency-Key is still being processed"
+            })
+            response.status_code = 409
+            response.headers["Retry-After"] = "1"
+            return response
+        if outcome == "mismatched":
+            return jsonify({
+                "status": "error",
+                "message": "Idempotency-Key was already used for a different request"
+            }), 422
+        if outcome == "unavailable":
+            return db_failed()
+        claimed_at = stored
+
+        try:
+            response = await app.make_response(await view(*args, **kwargs))
+        except BaseException:
+            await asyncio.to_thread(idempotency.finish, scope, key, fingerprint, claimed_at, 500, b"", None)
+            raise
+        await asyncio.to_thread(idempotency.finish, scope, key, fingerprint, claimed_at, response.status_code,
+                                await response.get_data(), response.mimetype)
+        return response
+    return wrapper
+
+
+def db_failed():
+    return jsonify({
+        "status": "error",
+        "message": "Database connection failed"
+    }), 500
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+    if QUERY_TRACE:
+        current_trace.set(QueryTrace())
+
+
+@app.after_request
+async def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("http_request_seconds", time.perf_counter() - started, (("route", route),))
+        metrics.inc("http_requests_total", (("route", route), ("method", request.method),
+                                            ("status", str(response.status_code))))
+        metrics.maybe_flush()
+    return response
+
+
+@app.after_request
+async def finish_query_trace(response):
+    trace = current_trace.get() if QUERY_TRACE else None
+    if trace is not None:
+        current_trace.set(None)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        response.headers["X-Query-Trace"] = query_traces.finish(trace, request.method, route, response.status_code)
+    return response
+
+
+# Same rules as wakinjologin.compress_response; compression runs on a thread
+@app.after_request
+async def compress_response(response):
+    if not compressible(response) or response.content_length is None:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request.accept_encodings, response.content_length)
+    if encoding is not None:
+        response.set_data(await asyncio.to_thread(compress, await response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        weaken_etag(response)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# Liveness and readiness, as in wakinjologin.py
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    return jsonify({"status": "alive", "pid": os.getpid()}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+async def readyz():
+    checks = {}
+    async with db_connection() as connection:
+        if connection is not None:
+            try:
+                async with connection.cursor(TimedCursor) as cursor:
+                    await cursor.execute("SELECT /* q:readyz */ 1")
+                    await cursor.fetchone()
+            except Error:
+                connection.close()
+                connection = None
+        checks["database"] = connection is not None
+    pending = None
+    if checks["database"]:
+        try:
+            pending = await asyncio.to_thread(wsgi.pending_schema_versions)
+        except Error:
+            pass
+    body, status = wsgi.readiness(checks, pending)
+    return jsonify(body), status
+
+
+@app.route('/debug/queries', methods=['GET'])
+@require_token('admin')
+async def debug_queries():
+    if not (DEBUG_QUERIES and QUERY_TRACE):
+        return jsonify({
+            "status": "error",
+            "message": "Query tracing is disabled"
+        }), 404
+    limit = request.args.get('limit', type=int)
+    return jsonify({
+        "status": "success",
+        "data": {"stats": query_traces.stats(), "traces": query_traces.recent(limit and max(limit, 1))}
+    }), 200
+
+
+@app.route('/stats', methods=['GET'])
+async def stats():
+    return jsonify({
+        "status": "success",
+        "data": {name: provider() for name, provider in STATS_PROVIDERS.items()}
+    }), 200
+
+
+# Shared body of /register and /admin_register
+async def register_account(table, id_field, password_field, role, success_message):
+    form = await request.form
+    account_id = form.get(id_field)
+    username = form.get('username')
+    phone_number = form.get('phone_number')
+    password = form.get(password_field)
+    confirm_password = form.get('confirm_passwd')
+
+    # Validate if all fields are present
+    if not account_id or not username or not phone_number or not password or not confirm_password:
+        return jsonify({
+            "status": "error",
+            "message": "Missing fields"
+        }), 400
+
+    # Validate if the passwords match
+    if password != confirm_password:
+        return jsonify({
+            "status": "error",
+            "message": "Passwords do not match"
+        }), 400
+
+    # Hash the password before saving it
+    hashed_password = await hash_password(password)
+
+    async with db_connection() as connection:
+        if not connection:
+            return db_failed()
+        try:
+            wsgi.username_indexes[table].add(username)
+            async with connection.cursor() as cursor:
+                await cursor.execute(
+                    f"INSERT INTO {table} ({id_field}, username, phone_number, {password_field}) VALUES (%s, %s, %s, %s)",
+                    (account_id, username, phone_number, hashed_password))
+            credential_cache.invalidate(role, username)
+            return jsonify({
+                "status": "success",
+                "message": success_message
+            }), 200
+        except Error as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Error saving data to MySQL: {e}"
+            }), 500
+
+
+@app.route('/register', methods=['POST'])
+@idempotent
+async def register_user():
+    return await register_account("employees", "worker_id", "passwd", "employee", "User registered successfully")
+
+
+@app.route('/admin_register', methods=['POST'])
+@idempotent
+async def admin_register():
+    return await register_account("admins", "admin_id", "password", "admin", "Admin registered successfully")
+
+
+def account_verified(username, role, message, login):
+    response = {
+        "status": "success",
+        "message": message
+    }
+    if login:
+        response["token"], expires_at = issue_token(username, role)
+        response["expires_at"] = int(expires_at)
+    return jsonify(response), 200
+
+
+# Shared body of /login, /admin_login and /check_user_exists
+# (login=True also upgrades the hash cost and issues a session token)
+async def verify_account(username, password, table, role, success_message,
+                         missing_message="Missing username or password", login=True):
+    # Validate if both fields are present
+    if not username or not password:
+        return jsonify({
+            "status": "error",
+            "message": missing_message
+        }), 400
+
+    # Recently verified credentials skip the lookup and bcrypt
+    if role == 'employee' and credential_cache.lookup(role, username, password):
+        return account_verified(username, role, success_message, login)
+
+    # Over-limit or locked-out attempts stop here, before the lookup and bcrypt
+    retry_after = login_limiter.check(role, username, client_ip())
+    if retry_after:
+        return too_many_attempts(retry_after)
+
+    # Unknown usernames are answered without touching the database
+    if not wsgi.username_indexes[table].might_exist(username):
+        return jsonify({
+            "status": "error",
+            "message": "Username not found"
+        }), 404
+
+    async with db_connection() as connection:
+        if not connection:
+            return db_failed()
+        try:
+            async with connection.cursor(TimedCursor) as cursor:
+                await cursor.execute(accounts.PASSWORD_HASH_SQL[table], (username,))
+                user = await cursor.fetchone()
+
+            # If the user does not exist
+            if not user:
+                return jsonify({
+                    "status": "error",
+                    "message": "Username not found"
+                }), 404
+
+            # Compare the entered password with the stored hash
+            stored_hash = user[0]
+            if not await check_password(password, stored_hash):
+                login_limiter.failure(role, username)
+                return jsonify({
+                    "status": "error",
+                    "message": "Invalid password"
+                }), 400
+
+            login_limiter.success(role, username)
+            if login:
+                await rehash_if_needed(connection, table, username, password, stored_hash)
+            if role == 'employee':
+                credential_cache.remember(role, username, password)
+            return account_verified(username, role, success_message, login)
+        except Error as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Error accessing database: {e}"
+            }), 500
+
+
+@app.route('/login', methods=['POST'])
+async def login_user():
+    form = await request.form
+    return await verify_account(form.get('username'), form.get('passwd'),
+                                "employees", "employee", "Login successful")
+
+
+@app.route('/admin_login', methods=['POST'])
+async def admin_login_user():
+    form = await request.form
+    return await verify_account(form.get('username'), form.get('password'),
+                                "admins", "admin", "Admin-login successful")
+
+
+@app.route('/check_user_exists', methods=['GET'])
+async def check_user_exists():
+    return await verify_account(request.args.get('username'), request.args.get('passwd'),
+                                "employees", "employee", "User exists and password matches",
+                                missing_message="Username and password are required", login=False)
+
+
+@app.route('/delete_employee', methods=['POST'])
+@require_token('admin', legacy=True)
+async def delete_employee():
+    form = await request.form
+    username = form.get('username')
+
+    # Validate if the 'username' is provided
+    if not username:
+        return jsonify({
+            "status": "error",
+            "message": "Missing username"
+        }), 400
+
+    # Unknown usernames are answered without touching the database
+    if not wsgi.username_indexes['employees'].might_exist(username):
+        return jsonify({
+            "status": "error",
+            "message": "Username not found"
+        }), 404
+
+    async with db_connection() as connection:
+        if not connection:
+            return db_failed()
+        try:
+            await connection.begin()
+            async with connection.cursor(TimedCursor) as cursor:
+                # One DELETE; no row deleted means no such user
+                await cursor.execute(accounts.DELETE_SQL['employees'], (username,))
+                if not cursor.rowcount:
+                    await connection.rollback()
+                    return jsonify({
+                        "status": "error",
+                        "message": "Username not found"
+                    }), 404
+                # Their tokens stop working along with the account
+                revoked_at = time.time()
+                await cursor.execute(*revocations.revocation('employee', username, revoked_at))
+            await connection.commit()
+            credential_cache.invalidate('employee', username)
+            revocations.remember('employee', username, revoked_at)
+            return jsonify({
+                "status": "success",
+                "message": "Deleted successfully"
+            }), 200
+        except Error as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Error accessing database: {e}"
+            }), 500
+
+
+@app.route('/item_register', methods=['POST'])
+@idempotent
+async def item_register():
+    form = await request.form
+    item_name = form.get('item_name')
+    quantity = form.get('quantity')
+    company_name = form.get('company_name')
+    price_per_item = form.get('price_per_item')
+    upsert = form.get('upsert', '').lower() == 'true'
+
+    # Validate if all fields are present
+    if not item_name or not quantity or not company_name or not price_per_item:
+        return jsonify({
+            "status": "error",
+            "message": "Missing fields"
+        }), 400
+
+    async with db_connection() as connection:
+        if not connection:
+            return db_failed()
+        try:
+            sql = "INSERT INTO items (item_name, quantity, company_name, price_per_item) VALUES (%s, %s, %s, %s)"
+            if upsert:
+                sql += " ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)"
+            await connection.begin()
+            async with connection.cursor() as cursor:
+                await cursor.execute(sql, (item_name, quantity, company_name, price_per_item))
+                updated = cursor.rowcount != 1
+                await cursor.execute(*ledger.registration_movement(item_name, company_name, quantity))
+                await cursor.execute(*ledger.registration_company_total(item_name, company_name, quantity, not updated))
+            await connection.commit()
+            items_cache.invalidate()
+            return jsonify({
+                "status": "success",
+                "message": "Product quantity updated" if updated else "Product registered successfully"
+            }), 200
+        except pymysql.err.IntegrityError as e:
+            if e.args[0] == ER_DUP_ENTRY:
+                return jsonify({
+                    "status": "error",
+                    "message": "Item already exists. Please go to the update panel."
+                }), 400
+            return jsonify({
+                "status": "error",
+                "message": f"Error saving data to MySQL: {e}"
+            }), 500
+        except Error as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Error saving data to MySQL: {e}"
+            }), 500
+
+
+@app.route('/update_inventory', methods=['POST'])
+@require_token('employee', 'admin', legacy=True)
+@idempotent
+async def update_inventory():
+    try:
+        data = await request.get_json()
+        # Validate input structure
+        if not data or 'items' not in data or not isinstance(data['items'], list):
+            return jsonify({"status": "error", "message": "Invalid input, expecting a list of items."}), 400
+
+        async with db_connection() as connection:
+            if not connection:
+                return jsonify({"status": "error", "message": "Database connection failed"}), 500
+
+            pairs = [
+                (item.get('item_name'), item.get('company_name'))
+                for item in data['items']
+                if item.get('item_name') and item.get('company_name')
+            ]
+            await connection.begin()
+            async with connection.cursor() as cursor:
+                rows = {}
+                for sql, params, keys in item_lookup_queries(pairs, for_update=True):
+                    await cursor.execute(sql, params)
+                    for row in await cursor.fetchall():
+                        rows[keys[row.pop('requested')]] = row
+                missing_items = find_missing_items(data['items'], rows)
+
+                if missing_items:
+                    await connection.rollback()
+                    return jsonify({
+                        "status": "error",
+                        "message": "Register this item first!",
+                        "details": missing_items
+                    }), 404
+
+                quantities = {}
+                movements = []
+                responses = plan_inventory_updates(data['items'], rows, quantities, movements)
+                for sql, params in item_quantity_updates(quantities):
+                    await cursor.execute(sql, params)
+                if movements:
+                    await cursor.executemany(*ledger.movement_inserts(movements, rows))
+                    await cursor.executemany(*ledger.company_total_updates(movements, rows))
+            await connection.commit()
+            if quantities:
+                items_cache.invalidate()
+
+            return jsonify({"updates": responses}), 200
+
+    except Error as db_err:
+        print(f"Database error in /update_inventory: {db_err!r}")
+        metrics.inc("errors_total", (("kind", "update_inventory_db"),))
+        return jsonify({"status": "error", "message": f"Database error: {str(db_err)}"}), 500
+
+    except Exception as e:
+        print(f"Server error in /update_inventory: {e!r}")
+        metrics.inc("errors_total", (("kind", "update_inventory_server"),))
+        return jsonify({"status": "error", "message": f"Server error: {str(e)}"}), 500
+
+
+# Async counterpart of wakinjologin.stream_export()
+async def stream_export(sql, params, fields, export_format, filename):
+    try:
+        connection = await asyncio.wait_for(db_pool.acquire(), float(os.getenv("DB_POOL_TIMEOUT", 5)))
+    except (asyncio.TimeoutError, Error) as e:
+        print(f"Error connecting to MySQL: {e!r}")
+        return db_failed()
+    try:
+        cursor = await connection.cursor(aiomysql.SSDictCursor)
+        await cursor.execute(sql, params)
+    except Error as e:
+        connection.close()
+        db_pool.release(connection)
+        return jsonify({
+            "status": "error",
+            "message": f"Error accessing database: {e}"
+        }), 500
+
+    async def generate():
+        finished = False
+        try:
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+                writer.writeheader()
+                yield buffer.getvalue()
+            while True:
+                rows = await cursor.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                if export_format == "csv":
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows(rows)
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(app.json.dumps(row) + "\n" for row in rows)
+            await cursor.close()
+            finished = True
+        finally:
+            if not finished:
+                connection.close()
+            db_pool.release(connection)
+
+    response = Response(generate(), mimetype=EXPORT_FORMATS[export_format])
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}.{export_format}"
+    response.timeout = None
+    return response
+
+
+async def select_page(connection, table, key_field, fields, conditions, params, limit, after):
+    columns = list(fields) if key_field in fields else [key_field] + list(fields)
+    sql, params = listing_query(table, key_field, columns, conditions, params,
+                                None if limit is None else limit + 1, after)
+    async with connection.cursor() as cursor:
+        await cursor.execute(sql, params)
+        rows = list(await cursor.fetchall())
+
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1][key_field]
+    if key_field not in fields:
+        for row in rows:
+            del row[key_field]
+    return rows, next_after
+
+
+@app.route('/get_employees', methods=['GET'])
+@require_token('admin', legacy=True)
+async def get_employees():
+    try:
+        fields, limit, after = parse_listing_args(EMPLOYEE_FIELDS, request.args)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    export_format = request.args.get('format')
+    if export_format in EXPORT_FORMATS:
+        sql, params = listing_query("employees", "worker_id", fields, [], [], limit, after)
+        return await stream_export(sql, params, fields, export_format, "employees")
+
+    async with db_connection() as connection:
+        if not connection:
+            return db_failed()
+        try:
+            employees, next_after = await select_page(connection, "employees", "worker_id", fields, [], [],
+                                                      limit, after)
+        except Error as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Error accessing database: {e}"
+            }), 500
+
+    # If no employees exist
+    if not employees and after is None:
+        return jsonify({
+            "status": "error",
+            "message": "No employees found"
+        }), 404
+
+    response = {
+        "status": "success",
+        "message": "Employees retrieved successfully",
+        "data": employees
+    }
+    if limit is not None:
+        response["next_after"] = next_after
+    return jsonify(response), 200
+
+
+async def cached_items_response(entry):
+    encoding = negotiate_encoding(request.accept_encodings, len(entry[1]["identity"]))
+    if encoding is None:
+        body = entry[1]["identity"]
+    else:
+        body = entry[1].get(encoding) or await asyncio.to_thread(items_cache.encoded, entry, encoding)
+    response = Response(body, status=200, mimetype="application/json")
+    response.set_etag(entry[0], weak=encoding is not None)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route('/get_items', methods=['GET'])
+async def get_items():
+    try:
+        fields, limit, after, conditions, params = parse_item_listing_args(request.args)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    export_format = request.args.get('format')
+    if export_format in EXPORT_FORMATS:
+        sql, params = listing_query("items", "id", fields, conditions, params, limit, after)
+        return await stream_export(sql, params, fields, export_format, "items")
+
+    # Unchanged catalogue: answer from the ETag or the cache without touching MySQL
+    version = items_cache.version()
+    query = tuple(sorted(request.args.items(multi=True)))
+    etag = items_cache.etag(version, query)
+    if request.if_none_match.contains_weak(etag):
+        items_cache.count("not_modified")
+        response = Response("", status=304)
+        response.set_etag(etag)
+        return response
+    cached = items_cache.get(version, query)
+    if cached:
+        return await cached_items_response(cached)
+
+    async with db_connection() as connection:
+        if not connection:
+            return db_failed()
+        try:
+            items, next_after = await select_page(connection, "items", "id", fields, conditions, params,
+                                                  limit, after)
+        except Error as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Error accessing database: {e}"
+            }), 500
+
+    # If no items exist
+    if not items and after is None:
+        return jsonify({
+            "status": "error",
+            "message": "No items found"
+        }), 404
+
+    response = {
+        "status": "success",
+        "message": "items retrieved successfully",
+        "data": items
+    }
+    if limit is not None:
+        response["next_after"] = next_after
+    return await cached_items_response(items_cache.put(version, query, json_bytes(response) + b"\n"))
+
+
+STATS_PROVIDERS["async_db_pool"] = async_pool_stats
+
+# Everything the async app doesn't route goes to the Flask app on a thread
+wsgi_fallback = WsgiToAsgi(wsgi.wakinjologin)
+async_paths = {rule.rule for rule in app.url_map.iter_rules()}
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["path"] not in async_paths:
+        await wsgi_fallback(scope, receive, send)
+    else:
+        await app(scope, receive, send)